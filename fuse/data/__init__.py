@@ -18,3 +18,4 @@ from fuse.data.utils.collates import CollateDefault
 from fuse.data.utils.export import ExportDataset
 from fuse.data.pipelines.pipeline_default import PipelineDefault
 from fuse.data.datasets.dataset_default import DatasetBase, DatasetDefault
+from fuse.data.datasets.dataset_iterable import DatasetIterable
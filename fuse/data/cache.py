@@ -0,0 +1,137 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Command line tool for the maintenance of SamplesCacher caches, see fuse/data/datasets/caching/cache_maintenance.py
+
+Usage examples:
+    python -m fuse.data.cache list /path/to/cache_dir
+    python -m fuse.data.cache verify /path/to/cache_dir --workers 16
+    python -m fuse.data.cache drop-stale /path/to/cache_dir/my_cache --keep hash_[...] checkpoint_[op_id]@[...] --dry-run
+    python -m fuse.data.cache reclaim /path/to/cache_dir --min-age-hours 12
+    python -m fuse.data.cache repack /path/to/cache_dir/my_cache --codec lz4
+"""
+
+import argparse
+import sys
+from typing import List, Optional
+
+from fuse.data.datasets.caching.cache_maintenance import (
+    drop_stale,
+    list_caches,
+    reclaim_temp_files,
+    repack,
+    verify_caches,
+)
+
+
+def _format_size(size_bytes: Optional[int]) -> str:
+    if size_bytes is None:
+        return "-"
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size_bytes < 1024:
+            return f"{size_bytes:.1f}{unit}"
+        size_bytes /= 1024
+    return f"{size_bytes:.1f}TB"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m fuse.data.cache", description="SamplesCacher caches maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def _add_command(name: str, help: str) -> argparse.ArgumentParser:
+        subparser = subparsers.add_parser(name, help=help)
+        subparser.add_argument(
+            "paths", nargs="+", help="named cache directories and/or directories that contain named caches"
+        )
+        subparser.add_argument(
+            "--keep",
+            nargs="+",
+            default=None,
+            help="names of the valid pipeline hash dir / checkpoint dirs (reported by SamplesCacher). "
+            "required when a named cache has several pipeline hash dirs or several checkpoint dirs of the same op_id",
+        )
+        return subparser
+
+    _add_command("list", "list the caches with their sizes and sample counts")
+    subparser = _add_command("verify", "decode all of the cached samples and verify the samples indices")
+    subparser.add_argument("--workers", type=int, default=0)
+    subparser.add_argument("--include-stale", action="store_true")
+    subparser = _add_command("drop-stale", "delete the caches of previous pipelines and the stale checkpoints")
+    subparser.add_argument("--dry-run", action="store_true")
+    subparser = _add_command("reclaim", "delete partially written files and orphaned sample files")
+    subparser.add_argument("--min-age-hours", type=float, default=24.0)
+    subparser.add_argument("--dry-run", action="store_true")
+    subparser = _add_command("repack", "repack the samples into large shard files (see CacheStoragePackedShards)")
+    subparser.add_argument("--max-shard-size-bytes", type=int, default=2**30)
+    subparser.add_argument("--codec", default="none")
+    subparser.add_argument("--codec-level", type=int, default=None)
+    subparser.add_argument("--memmap-keys", nargs="+", default=None)
+    subparser.add_argument("--dry-run", action="store_true")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        df = list_caches(args.paths, keep=args.keep)
+        df["size"] = df["size_bytes"].map(_format_size)
+        print(df.drop(columns=["size_bytes"]).to_string(index=False))
+        return 0
+
+    if args.command == "verify":
+        failures = verify_caches(args.paths, workers=args.workers, include_stale=args.include_stale, keep=args.keep)
+        for desc, error in failures:
+            print(f"FAILED: {desc}: {error}")
+        print(f"found {len(failures)} failures")
+        return 1 if len(failures) > 0 else 0
+
+    verb = "would delete" if getattr(args, "dry_run", False) else "deleted"
+    if args.command == "drop-stale":
+        for path in drop_stale(args.paths, keep=args.keep, dry_run=args.dry_run):
+            print(f"{verb} {path}")
+        return 0
+
+    if args.command == "reclaim":
+        files, total_bytes = reclaim_temp_files(
+            args.paths, min_age_hours=args.min_age_hours, keep=args.keep, dry_run=args.dry_run
+        )
+        for path in files:
+            print(f"{verb} {path}")
+        print(f"{verb} {len(files)} files, {_format_size(total_bytes)}")
+        return 0
+
+    if args.command == "repack":
+        repacked = repack(
+            args.paths,
+            max_shard_size_bytes=args.max_shard_size_bytes,
+            codec=args.codec,
+            codec_level=args.codec_level,
+            memmap_keys=args.memmap_keys,
+            keep=args.keep,
+            dry_run=args.dry_run,
+        )
+        for info in repacked:
+            print(
+                f"{'would repack' if args.dry_run else 'repacked'} {info['path']}: {info['num_samples']} samples, "
+                f"{info['num_dropped']} orphaned samples dropped, "
+                f"{_format_size(info['bytes_before'])} -> {_format_size(info['bytes_after'])}"
+            )
+        if len(repacked) > 0 and not args.dry_run:
+            print("Note - load the repacked caches with SamplesCacher(..., storage=CacheStoragePackedShards(...))")
+        return 0
+
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1 +1,2 @@
 from .dataset_default import DatasetDefault
+from .dataset_iterable import DatasetIterable
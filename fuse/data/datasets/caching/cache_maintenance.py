@@ -0,0 +1,558 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Maintenance of SamplesCacher caches: listing, verifying, dropping stale pipeline caches, reclaiming temporary / orphaned files and repacking.
+The command line interface is in fuse/data/cache.py (python -m fuse.data.cache --help).
+
+A named cache is the directory [cache_dir]/[unique_name] of a SamplesCacher, and contains:
+    hash_[pipeline hash]/ - the samples cached with a specific pipeline. Only one is valid, the others are "stale".
+    checkpoints/checkpoint_[op_id]@[hash]/ - the checkpoints of the pipeline, see checkpoint_op_ids in SamplesCacher.
+Which pipeline hash dir (and checkpoint dir of each op_id) is valid depends on the current pipeline, so when there are several of them,
+the valid ones must be specified with "keep" (SamplesCacher reports them when it finds the cache of a different pipeline).
+All of the functions below accept either named cache directories or directories that contain named caches (the cache_dirs of the cacher).
+Listing, dropping and reclaiming only scan the directories and read small index files - samples are never loaded.
+"""
+
+import os
+import re
+import time
+from glob import glob
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import pandas as pd
+
+from fuse.data.datasets.caching.cache_storage import CacheStorageDirectory, CacheStoragePackedShards
+from fuse.data.datasets.caching.samples_cacher import PROCESSED_INDEX_PREFIX, SamplesCacher
+from fuse.utils.file_io.file_io import (
+    COMPRESSION_CODECS_EXTENSIONS,
+    delete_directory_tree,
+    load_pickle,
+    save_pickle_safe,
+)
+from fuse.utils.multiprocessing.run_multiprocessed import run_multiprocessed
+
+# the postfix of files that are being written (see get_randomized_postfix_name)
+TEMP_FILE_POSTFIX = ".scramlbed"
+# the name of a stored sample, in a pipeline hash dir or in a checkpoint dir, followed by the files postfix
+_SAMPLE_FILENAME_PATTERN = re.compile(r"^(out_sample_id@[0-9a-f]{32}|checkpoint@[0-9a-f]{32}@\d+)(.*)$")
+_CHECKPOINT_DIR_PATTERN = re.compile(r"^checkpoint_(.+)@([0-9a-f]{32})$")
+_PICKLE_EXTS = set(".pkl" + ext for ext in COMPRESSION_CODECS_EXTENSIONS.values())
+
+
+def find_named_caches(paths: Sequence[str]) -> List[str]:
+    """
+    :param paths: named cache directories and/or directories that contain named caches
+    :return: the named cache directories
+    """
+    ans = []
+    for path in paths:
+        if _is_named_cache(path):
+            ans.append(os.path.abspath(path))
+            continue
+        if not os.path.isdir(path):
+            raise Exception(f"cache directory {path} does not exist")
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            if entry.is_dir() and _is_named_cache(entry.path):
+                ans.append(os.path.abspath(entry.path))
+    return ans
+
+
+def get_storage_dirs(named_cache_dir: str, keep: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """
+    :param keep: optional, names of the valid pipeline hash dir (hash_[...]) and checkpoint dirs (checkpoint_[op_id]@[...]).
+        The names don't have to exist - for example, the hash dir of a new pipeline which was not cached yet.
+        The pipeline hash dirs are stale if a pipeline hash dir is specified, and the checkpoint dirs of an op_id are stale if a checkpoint of the op_id is specified.
+        Otherwise, a single pipeline hash dir (or checkpoint dir of an op_id) is considered valid, and the validity of several dirs is unknown.
+    :return: a dict per directory that holds stored samples: pipeline hash dir or checkpoint dir, with the keys:
+        "path", "kind" ("pipeline" or "checkpoint"), "name" and "stale" (None if unknown)
+    """
+    hash_dirs = sorted(d for d in glob(os.path.join(named_cache_dir, "hash_*")) if os.path.isdir(d))
+    checkpoint_dirs = sorted(
+        d for d in glob(os.path.join(named_cache_dir, "checkpoints", "checkpoint_*")) if os.path.isdir(d)
+    )
+
+    # the dirs are grouped - only one dir of each group is valid
+    groups: Dict[str, List[str]] = {"pipeline": hash_dirs}
+    for d in checkpoint_dirs:
+        groups.setdefault(_get_storage_dir_group(os.path.basename(d)), []).append(d)
+    keep_groups = set(_get_storage_dir_group(name) for name in keep) if keep is not None else set()
+    stale: Dict[str, Optional[bool]] = {}
+    for group, dirs in groups.items():
+        for d in dirs:
+            if group in keep_groups:
+                stale[d] = os.path.basename(d) not in keep
+            else:
+                stale[d] = False if len(dirs) == 1 else None
+
+    ans = []
+    for d in hash_dirs + checkpoint_dirs:
+        ans.append(
+            dict(
+                path=d,
+                kind="pipeline" if d in hash_dirs else "checkpoint",
+                name=os.path.basename(d),
+                stale=stale[d],
+            )
+        )
+    return ans
+
+
+def _get_storage_dir_group(name: str) -> str:
+    """
+    :return: "pipeline" for a pipeline hash dir, and checkpoint_[op_id] for a checkpoint dir
+    """
+    if name.startswith("hash_"):
+        return "pipeline"
+    match = _CHECKPOINT_DIR_PATTERN.match(name)
+    return "checkpoint_" + (match.group(1) if match is not None else name)
+
+
+def list_caches(paths: Sequence[str], keep: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Lists the pipeline hash dirs and the checkpoint dirs of the named caches, without loading any sample
+    :param paths: named cache directories and/or directories that contain named caches
+    :param keep: see get_storage_dirs()
+    :return: a dataframe with a row per directory, and the columns:
+        cache, kind, name, stale, storage ("directory", "packed_shards" or "mixed"), num_samples, num_shards, num_temp_files, size_bytes, last_modified
+    """
+    rows = []
+    for named_cache_dir in find_named_caches(paths):
+        for storage_dir in get_storage_dirs(named_cache_dir, keep):
+            samples, shards = _scan_storage_dir(storage_dir["path"])
+            num_packed = sum(1 for kind, _ in samples.values() if kind == "packed_shards")
+            storage = "packed_shards" if num_packed > 0 else "directory"
+            if 0 < num_packed < len(samples):
+                storage = "mixed"
+            size_bytes, num_temp_files, last_modified = _get_tree_stats(storage_dir["path"])
+            rows.append(
+                dict(
+                    cache=named_cache_dir,
+                    kind=storage_dir["kind"],
+                    name=storage_dir["name"],
+                    stale=storage_dir["stale"],
+                    storage=storage,
+                    num_samples=len(samples),
+                    num_shards=len(shards),
+                    num_temp_files=num_temp_files,
+                    size_bytes=size_bytes,
+                    last_modified=pd.Timestamp(last_modified, unit="s"),
+                )
+            )
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "cache",
+            "kind",
+            "name",
+            "stale",
+            "storage",
+            "num_samples",
+            "num_shards",
+            "num_temp_files",
+            "size_bytes",
+            "last_modified",
+        ],
+    )
+
+
+def verify_caches(
+    paths: Sequence[str], workers: int = 0, include_stale: bool = False, keep: Optional[Sequence[str]] = None
+) -> List[Tuple[str, str]]:
+    """
+    Verifies the integrity of the cached samples - in parallel, decodes each of the stored samples
+    (which validates the checksum of gzip compressed samples and the structure of all samples),
+    and checks that all of the locations recorded in the samples indices (full_sets_info) exist.
+    :param paths: named cache directories and/or directories that contain named caches
+    :param workers: the number of processes to use
+    :param include_stale: verify also the stale pipeline hash dirs and checkpoint dirs
+    :param keep: see get_storage_dirs()
+    :return: a list of (description, error) of the failed samples and locations. Empty if the caches are valid.
+    """
+    failures = []
+    args = []
+    for named_cache_dir in find_named_caches(paths):
+        for storage_dir in get_storage_dirs(named_cache_dir, keep):
+            if storage_dir["stale"] and not include_stale:
+                continue
+            samples, _ = _scan_storage_dir(storage_dir["path"])
+            args.extend((sample_hash, kind, location) for sample_hash, (kind, location) in samples.items())
+            if storage_dir["kind"] == "pipeline":
+                failures.extend(_verify_index_locations(storage_dir["path"]))
+
+    results = run_multiprocessed(_verify_sample_worker, args, workers=workers, verbose=1, desc="verify")
+    for (sample_hash, _, location), error in zip(args, results):
+        if error is not None:
+            failures.append((f"{sample_hash} at {location}", error))
+    return failures
+
+
+def drop_stale(paths: Sequence[str], keep: Optional[Sequence[str]] = None, dry_run: bool = False) -> List[str]:
+    """
+    Deletes the stale pipeline hash dirs and checkpoint dirs (see get_storage_dirs()).
+    Unlike restart_cache=True, the valid cache and checkpoints are kept.
+    Raises an exception, without deleting anything, if it's unknown which of the dirs are valid.
+    :param paths: named cache directories and/or directories that contain named caches
+    :param keep: see get_storage_dirs()
+    :param dry_run: only return the directories, without deleting them
+    :return: the deleted directories
+    """
+    ans = []
+    for named_cache_dir in find_named_caches(paths):
+        storage_dirs = get_storage_dirs(named_cache_dir, keep)
+        unknown = [storage_dir["name"] for storage_dir in storage_dirs if storage_dir["stale"] is None]
+        if len(unknown) > 0:
+            raise Exception(
+                f"Error: can't tell which of {unknown} in {named_cache_dir} are valid. "
+                "Specify the valid pipeline hash dir and checkpoint dirs with keep (--keep), "
+                "they are reported by SamplesCacher when it finds the cache of a different pipeline"
+            )
+        ans.extend(storage_dir["path"] for storage_dir in storage_dirs if storage_dir["stale"])
+    if not dry_run:
+        for path in ans:
+            delete_directory_tree(path)
+    return ans
+
+
+def reclaim_temp_files(
+    paths: Sequence[str], min_age_hours: float = 24.0, keep: Optional[Sequence[str]] = None, dry_run: bool = False
+) -> Tuple[List[str], int]:
+    """
+    Deletes partially written files, left by interrupted writes, and orphaned sample files -
+    files of samples that are not referenced by any of the processed original samples (for example, when caching was interrupted).
+    Orphaned records inside shard files are reclaimed by repack().
+    :param paths: named cache directories and/or directories that contain named caches
+    :param min_age_hours: delete only files that were not modified for this amount of hours, to avoid deleting files of a running caching session
+    :param keep: see get_storage_dirs()
+    :param dry_run: only return the files, without deleting them
+    :return: a tuple of: the deleted files and their total size in bytes
+    """
+    max_mtime = time.time() - min_age_hours * 3600
+    ans = []
+    total_bytes = 0
+    for named_cache_dir in find_named_caches(paths):
+        candidates = []
+        for root, _, filenames in os.walk(named_cache_dir):
+            candidates.extend(os.path.join(root, f) for f in filenames if f.endswith(TEMP_FILE_POSTFIX))
+        for storage_dir in get_storage_dirs(named_cache_dir, keep):
+            if storage_dir["stale"]:
+                continue  # handled by drop_stale()
+            referenced = _get_referenced_sample_hashes(storage_dir["path"], storage_dir["kind"])
+            for name, path in _iter_directory_sample_files(storage_dir["path"]):
+                if name not in referenced:
+                    candidates.append(path)
+            candidates.extend(_get_incomplete_sample_files(storage_dir["path"]))
+
+        for path in candidates:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > max_mtime:
+                continue
+            ans.append(path)
+            total_bytes += stat.st_size
+            if not dry_run:
+                os.remove(path)
+    return ans, total_bytes
+
+
+def repack(
+    paths: Sequence[str],
+    max_shard_size_bytes: int = 2**30,
+    codec: str = "none",
+    codec_level: Optional[int] = None,
+    memmap_keys: Optional[Sequence[str]] = None,
+    keep: Optional[Sequence[str]] = None,
+    dry_run: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Repacks the samples of the valid pipeline hash dirs and checkpoint dirs into large shard files (see CacheStoragePackedShards):
+    samples stored in their own files are moved into shards, many small shards are merged and orphaned samples are dropped.
+    The samples indices (full_sets_info) are updated with the new locations.
+    Note - the cache must not be in use while repacking, and must be loaded with storage=CacheStoragePackedShards(...) afterwards.
+    :param paths: named cache directories and/or directories that contain named caches
+    :param max_shard_size_bytes: codec: codec_level: memmap_keys: see CacheStoragePackedShards
+    :param keep: see get_storage_dirs()
+    :param dry_run: only return the directories that would be repacked
+    :return: a dict per repacked directory with the keys: "path", "num_samples", "num_dropped", "bytes_before", "bytes_after"
+    """
+    ans = []
+    for named_cache_dir in find_named_caches(paths):
+        for storage_dir in get_storage_dirs(named_cache_dir, keep):
+            if storage_dir["stale"]:
+                continue
+            path = storage_dir["path"]
+            samples, shards = _scan_storage_dir(path)
+            referenced = _get_referenced_sample_hashes(path, storage_dir["kind"])
+            live = {h: v for h, v in samples.items() if h in referenced}
+            has_directory_samples = any(kind == "directory" for kind, _ in samples.values())
+            if len(live) == 0 or (not has_directory_samples and len(shards) <= 1 and len(live) == len(samples)):
+                continue  # nothing to gain
+
+            bytes_before = _get_tree_stats(path)[0]
+            info = dict(
+                path=path, num_samples=len(live), num_dropped=len(samples) - len(live), bytes_before=bytes_before
+            )
+            if dry_run:
+                info["bytes_after"] = None
+                ans.append(info)
+                continue
+
+            new_locations = _repack_storage_dir(path, live, max_shard_size_bytes, codec, codec_level, memmap_keys)
+            if storage_dir["kind"] == "pipeline":
+                _update_index_locations(path, new_locations)
+            for _, file_path in _iter_directory_sample_files(path):
+                os.remove(file_path)
+            for shard in shards:
+                for ext in [".idx", ".bin"]:
+                    if os.path.exists(shard + ext):
+                        os.remove(shard + ext)
+            info["bytes_after"] = _get_tree_stats(path)[0]
+            ans.append(info)
+    return ans
+
+
+def _is_named_cache(path: str) -> bool:
+    return os.path.isdir(path) and (
+        len(glob(os.path.join(path, "hash_*"))) > 0 or os.path.isdir(os.path.join(path, "checkpoints"))
+    )
+
+
+def _get_tree_stats(path: str) -> Tuple[int, int, float]:
+    """
+    :return: a tuple of: total size in bytes, number of temp files and latest modification time of the files in the directory tree
+    """
+    size_bytes = 0
+    num_temp_files = 0
+    last_modified = os.stat(path).st_mtime
+    for root, _, filenames in os.walk(path):
+        for f in filenames:
+            try:
+                stat = os.stat(os.path.join(root, f))
+            except FileNotFoundError:
+                continue
+            size_bytes += stat.st_size
+            last_modified = max(last_modified, stat.st_mtime)
+            if f.endswith(TEMP_FILE_POSTFIX):
+                num_temp_files += 1
+    return size_bytes, num_temp_files, last_modified
+
+
+def _iter_directory_sample_files(storage_dir: str) -> Iterator[Tuple[str, str]]:
+    """
+    Iterates over the files of the samples stored by CacheStorageDirectory
+    :return: an iterator of (sample hash, file path)
+    """
+    for entry in os.scandir(storage_dir):
+        match = _SAMPLE_FILENAME_PATTERN.match(entry.name)
+        if match is None or entry.name.endswith(TEMP_FILE_POSTFIX):
+            continue
+        yield match.group(1), entry.path
+
+
+def _scan_storage_dir(storage_dir: str) -> Tuple[Dict[str, Tuple[str, Any]], List[str]]:
+    """
+    Finds the stored samples without loading them
+    :return: a tuple of:
+        samples - a dict mapping a sample hash to (storage kind, location). kind is "directory" or "packed_shards"
+        shards - the shard files (without the extension)
+    """
+    samples = {}
+    parts: Dict[str, Dict[str, Any]] = {}
+    for sample_hash, path in _iter_directory_sample_files(storage_dir):
+        postfix = os.path.basename(path)[len(sample_hash) :]
+        curr = parts.setdefault(sample_hash, dict(pickle_ext=None, has_hdf5=False))
+        if postfix in _PICKLE_EXTS:
+            curr["pickle_ext"] = postfix
+        elif postfix == ".hdf5":
+            curr["has_hdf5"] = True
+    for sample_hash, curr in parts.items():
+        if curr["pickle_ext"] is not None:  # the pickle is written last
+            location = (os.path.join(storage_dir, sample_hash), curr["has_hdf5"], curr["pickle_ext"])
+            samples[sample_hash] = ("directory", location)
+
+    shards = []
+    for index_filename in sorted(glob(os.path.join(storage_dir, CacheStoragePackedShards.SHARD_PREFIX + "*.idx"))):
+        shard = index_filename[: -len(".idx")]
+        shards.append(shard)
+        data_filename = os.path.abspath(shard + ".bin")
+        with open(index_filename, "rt") as f:
+            for line in f:
+                parts_of_line = line.split()
+                if not line.endswith("\n") or len(parts_of_line) != 3:  # a partially written line
+                    continue
+                location = (data_filename, int(parts_of_line[1]), int(parts_of_line[2]))
+                samples[parts_of_line[0]] = ("packed_shards", location)
+    return samples, shards
+
+
+def _get_incomplete_sample_files(storage_dir: str) -> List[str]:
+    """
+    :return: the files of samples stored by CacheStorageDirectory for which the pickle file (which is written last) is missing
+    """
+    files_per_sample: Dict[str, List[str]] = {}
+    complete = set()
+    for sample_hash, path in _iter_directory_sample_files(storage_dir):
+        files_per_sample.setdefault(sample_hash, []).append(path)
+        if os.path.basename(path)[len(sample_hash) :] in _PICKLE_EXTS:
+            complete.add(sample_hash)
+    return [path for sample_hash, paths in files_per_sample.items() if sample_hash not in complete for path in paths]
+
+
+def _get_referenced_sample_hashes(storage_dir: str, kind: str) -> Set[str]:
+    """
+    :return: the hashes of the samples that were completely processed - referenced by the processed index or by the per sample markers
+    """
+    ans = set()
+    if kind == "checkpoint":
+        for marker in glob(os.path.join(storage_dir, "checkpoint@*.pkl")):
+            num_samples = load_pickle(marker)
+            base = os.path.basename(marker)[: -len(".pkl")]
+            ans.update(f"{base}@{i}" for i in range(num_samples or 0))
+        return ans
+
+    indexed = set()
+    for part_filename in glob(os.path.join(storage_dir, "full_sets_info", PROCESSED_INDEX_PREFIX + "*.pkl.gz")):
+        for orig_sample_hash, (output_info, _, _) in load_pickle(part_filename)["entries"].items():
+            indexed.add(orig_sample_hash)
+            for sample_id in output_info or []:
+                ans.add(SamplesCacher.get_final_sample_id_hash(sample_id))
+    # markers of samples that are not in the processed index (for example, a cache created before it was introduced)
+    for entry in os.scandir(storage_dir):
+        if entry.name.startswith("out_info_for_orig_sample@") and entry.name.endswith(".pkl"):
+            if entry.name[: -len(".pkl")] in indexed:
+                continue
+            for sample_id in load_pickle(entry.path) or []:
+                ans.add(SamplesCacher.get_final_sample_id_hash(sample_id))
+    return ans
+
+
+def _iter_index_files(storage_dir: str) -> Iterator[Tuple[str, str]]:
+    """
+    :return: an iterator of (kind, path) of the index files that record the locations of the samples. kind is "samples_index" or "processed"
+    """
+    full_sets_info = os.path.join(storage_dir, "full_sets_info")
+    for path in sorted(glob(os.path.join(full_sets_info, "samples_index@*.pkl.gz"))):
+        if not path.endswith(TEMP_FILE_POSTFIX):
+            yield "samples_index", path
+    for path in sorted(glob(os.path.join(full_sets_info, PROCESSED_INDEX_PREFIX + "*.pkl.gz"))):
+        yield "processed", path
+
+
+def _is_tiered_location(location: Any) -> bool:
+    """
+    CacheStorageTiered locations are (name in the fast tier, location in the slow tier)
+    """
+    return len(location) == 2 and isinstance(location[1], tuple)
+
+
+def _location_exists(location: Any) -> bool:
+    if _is_tiered_location(location):
+        return _location_exists(location[1])
+    if len(location) == 3 and isinstance(location[1], int) and not isinstance(location[1], bool):  # packed shards
+        data_filename, offset, length = location
+        return os.path.isfile(data_filename) and os.path.getsize(data_filename) >= offset + length
+    extension_less, has_hdf5 = location[:2]
+    pickle_ext = location[2] if len(location) > 2 else ".pkl.gz"
+    return os.path.isfile(extension_less + pickle_ext) and (not has_hdf5 or os.path.isfile(extension_less + ".hdf5"))
+
+
+def _verify_index_locations(storage_dir: str) -> List[Tuple[str, str]]:
+    failures = []
+    for kind, path in _iter_index_files(storage_dir):
+        content = load_pickle(path)
+        if kind == "samples_index":
+            locations = content
+        else:
+            locations = {}
+            for _, curr_locations, _ in content["entries"].values():
+                locations.update(curr_locations)
+        for sample_id, location in locations.items():
+            if not _location_exists(location):
+                failures.append((f"sample {sample_id} in {path}", f"location {location} does not exist"))
+    return failures
+
+
+def _update_index_locations(storage_dir: str, new_locations: Dict[str, Any]) -> None:
+    """
+    Replaces the recorded locations of the samples with their new locations (keyed by the sample hash)
+    """
+
+    def _update(locations: Dict[Any, Any]) -> Dict[Any, Any]:
+        ans = {}
+        for sample_id, location in locations.items():
+            new_location = new_locations.get(SamplesCacher.get_final_sample_id_hash(sample_id), None)
+            if new_location is None:
+                ans[sample_id] = location
+            elif _is_tiered_location(location):
+                ans[sample_id] = (location[0], new_location)
+            else:
+                ans[sample_id] = new_location
+        return ans
+
+    for kind, path in _iter_index_files(storage_dir):
+        content = load_pickle(path)
+        if kind == "samples_index":
+            content = _update(content)
+        else:
+            content["entries"] = {
+                orig_sample_hash: (output_info, _update(locations), scalars)
+                for orig_sample_hash, (output_info, locations, scalars) in content["entries"].items()
+            }
+        save_pickle_safe(content, path, compress=True)
+
+
+def _repack_storage_dir(
+    storage_dir: str,
+    samples: Dict[str, Tuple[str, Any]],
+    max_shard_size_bytes: int,
+    codec: str,
+    codec_level: Optional[int],
+    memmap_keys: Optional[Sequence[str]],
+) -> Dict[str, Any]:
+    """
+    :return: a dict mapping sample hash to its new location
+    """
+    storage = CacheStoragePackedShards(
+        max_shard_size_bytes=max_shard_size_bytes, codec=codec, codec_level=codec_level, memmap_keys=memmap_keys
+    )
+    new_locations = {}
+    for sample_hash, (kind, location) in samples.items():
+        sample = _get_storage(kind).load_sample_from_location(location)
+        new_locations[sample_hash] = storage.save_sample(storage_dir, sample_hash, sample)
+    storage.flush()
+    return new_locations
+
+
+# storage instances used for reading, created once per process
+_READ_STORAGES = {}
+
+
+def _get_storage(kind: str) -> Any:
+    if kind not in _READ_STORAGES:
+        _READ_STORAGES[kind] = CacheStorageDirectory() if kind == "directory" else CacheStoragePackedShards()
+    return _READ_STORAGES[kind]
+
+
+def _verify_sample_worker(args: Tuple[str, str, Any]) -> Optional[str]:
+    """
+    :return: None if the sample is valid, otherwise a description of the error
+    """
+    _, kind, location = args
+    try:
+        _get_storage(kind).load_sample_from_location(location)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
@@ -0,0 +1,959 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from abc import abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import atexit
+import getpass
+import os
+import pickle
+import struct
+import sys
+import threading
+import hashlib
+import mmap
+import tempfile
+from glob import glob
+from glob import escape as glob_escape
+import numpy as np
+
+from fuse.utils.ndict import NDict
+from fuse.data.utils.sample import get_sample_id_key, get_initial_sample_id_key
+from fuse.utils.file_io.file_io import (
+    load_hdf5,
+    save_hdf5_safe,
+    load_pickle,
+    save_pickle_safe,
+    get_randomized_postfix_name,
+    compress_bytes,
+    decompress_bytes,
+    COMPRESSION_CODECS_EXTENSIONS,
+    G_host_name,
+)
+from fuse.data.datasets.caching.object_caching_handlers import _object_requires_hdf5_recurse
+
+"""
+Storage backends used by SamplesCacher to persist the final (output of the static pipeline) samples.
+A storage backend only decides *how* a single sample is written to and read from a cache directory,
+SamplesCacher is still responsible for the directories logic (read/write dirs, pipeline hash dirs) and the caching flow.
+
+Two backends are available:
+CacheStorageDirectory - the default. Each sample is stored in its own files: [sample_hash].pkl.gz and optionally [sample_hash].hdf5
+CacheStoragePackedShards - many samples are appended into large shard files, with a per-shard offset index.
+    Useful when the cache holds a very large amount of samples and/or is located on a network filesystem,
+    in which handling many small files is slow.
+
+CacheStorageTiered wraps any of them (the "slow tier", for example, on a shared network filesystem) with a bounded "fast tier" directory
+(for example, on a node-local SSD). Samples are copied to the fast tier when read, and the least recently used samples are evicted from it.
+CacheStorageSharedMemory is a tiered storage whose fast tier is in shared memory, and whose samples arrays are memory mapped (not copied) when read.
+
+All of the backends support prefetch() - warming the OS page cache (or the fast tier) for samples that are about to be read.
+
+Both backends support configuring the compression codec ("none", "gzip", "lz4" or "zstd") and level.
+The codec is recorded with every stored sample (in the file extension or in the record header), so readers always pick the right decoder.
+Use fuse/data/datasets/caching/codecs_benchmark.py to compare the size and decoding throughput of the codecs on your own samples.
+
+Both backends support "memmap_keys" - numpy arrays stored under those keys are kept uncompressed and loaded as np.memmap views.
+The OS page cache then shares a single copy of the data between all of the DataLoader workers,
+and reading only part of such array (for example, a crop) touches only the relevant pages.
+"""
+
+
+def _key_matches(key: str, keys: Sequence[str]) -> bool:
+    """
+    checks if key is one of keys or a sub key of one of them (for example "data.input.img" matches "data.input")
+    """
+    for k in keys:
+        if key == k or key.startswith(k + "."):
+            return True
+    return False
+
+
+def _is_memmap_compatible(value: Any) -> bool:
+    return isinstance(value, np.ndarray) and not value.dtype.hasobject and value.ndim > 0 and value.size > 0
+
+
+def _read_at(f: Any, offset: int, size: int) -> bytes:
+    """
+    Reads from a specific offset of a file without moving the file position, so a file object can be shared between threads
+    """
+    if hasattr(os, "pread"):
+        return os.pread(f.fileno(), size, offset)
+    with _READ_AT_LOCK:
+        f.seek(offset)
+        return f.read(size)
+
+
+_READ_AT_LOCK = threading.Lock()
+PAGE_CACHE_READ_CHUNK_SIZE = 2**20
+
+
+def _read_file_into_page_cache(f: Any, offset: int = 0, length: Optional[int] = None) -> None:
+    """
+    Reads (and discards) a file or a range of it, so it will be found in the OS page cache when it's read again.
+    Reading is used rather than posix_fadvise(), which is ignored by some network filesystems.
+    :param f: a filename or an open binary file
+    """
+    if isinstance(f, str):
+        try:
+            with open(f, "rb") as opened:
+                _read_file_into_page_cache(opened, offset, length)
+        except FileNotFoundError:
+            pass  # will be handled when the sample is loaded
+        return
+
+    buffer = bytearray(PAGE_CACHE_READ_CHUNK_SIZE)
+    f.seek(offset)
+    remaining = length
+    while remaining is None or remaining > 0:
+        view = memoryview(buffer) if remaining is None else memoryview(buffer)[: min(remaining, len(buffer))]
+        read = f.readinto(view)
+        if not read:
+            break
+        if remaining is not None:
+            remaining -= read
+
+
+def is_key_selected(key: str, keys: Optional[Sequence[str]]) -> bool:
+    """
+    Checks if a (flat) key of a cached sample was requested.
+    A requested key can be either the key itself or a prefix of it (a sub-dict, for example "data.input").
+    The sample id keys are always selected.
+    :param keys: the requested keys, None means all keys
+    """
+    if keys is None:
+        return True
+    if key == get_sample_id_key() or key == get_initial_sample_id_key():
+        return True
+    return _key_matches(key, keys)
+
+
+def select_sample_keys(sample: NDict, keys: Optional[Sequence[str]]) -> NDict:
+    """
+    returns a (shallow) subset of sample with only the keys selected by is_key_selected()
+    """
+    if keys is None:
+        return sample
+    return NDict({k: v for k, v in sample.items() if is_key_selected(k, keys)}, already_flat=True)
+
+
+class _KeysSeparatedSample:
+    """
+    The pickled part of a cached sample, in which each value is pickled separately,
+    this way, loading a subset of the keys does not require unpickling the rest of the values.
+    """
+
+    def __init__(self, sample: NDict, hdf5_keys: List[str], npy_keys: Sequence[str] = ()):
+        """
+        :param sample: the values to pickle
+        :param hdf5_keys: the keys stored in the hdf5 part of the sample (if any)
+        :param npy_keys: the keys stored in separate .npy files (see memmap_keys)
+        """
+        self.pickled_values = {k: pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL) for k, v in sample.items()}
+        self.hdf5_keys = hdf5_keys
+        self.npy_keys = list(npy_keys)
+
+    def to_sample(self, keys: Optional[Sequence[str]] = None) -> NDict:
+        return NDict(
+            {k: pickle.loads(v) for k, v in self.pickled_values.items() if is_key_selected(k, keys)}, already_flat=True
+        )
+
+
+class CacheStorageBase:
+    """
+    Base class for SamplesCacher storage backends.
+    Note - an instance is copied (pickled) into each multiprocessing worker, so avoid storing unpicklable state (such as open files) without handling it.
+
+    A "location" is a small picklable, backend specific, description of where a stored sample can be found.
+    SamplesCacher persists the locations of all samples in an index, so loading a sample does not require searching for it.
+    """
+
+    @abstractmethod
+    def save_sample(self, write_dir: str, sample_hash: str, sample: NDict) -> Any:
+        """
+        Stores a single final sample
+        :param write_dir: the directory to write into
+        :param sample_hash: a unique string identifying the sample (see SamplesCacher.get_final_sample_id_hash)
+        :param sample: the sample to store. Note - the backend is allowed to modify it (for example, pop keys out of it)
+        :return: the location of the stored sample
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def locate(self, read_dirs: List[str], sample_hash: str) -> Any:
+        """
+        Searches for a stored sample
+        :param read_dirs: the directories to search in, in the provided order
+        :param sample_hash: a unique string identifying the sample (see SamplesCacher.get_final_sample_id_hash)
+        :return: the location of the sample or None if it was not found in any of read_dirs
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_sample_from_location(self, location: Any, keys: Optional[Sequence[str]] = None) -> NDict:
+        """
+        Loads a single final sample from a known location
+        :param location: as returned by save_sample() or locate()
+        :param keys: optionally, a subset of keys to load. A backend may ignore it and return the full sample.
+        Raises FileNotFoundError if the location no longer exists (for example, the cache was moved)
+        """
+        raise NotImplementedError
+
+    def load_sample(
+        self, read_dirs: List[str], sample_hash: str, keys: Optional[Sequence[str]] = None
+    ) -> Optional[NDict]:
+        """
+        Searches for a single final sample and loads it
+        :param read_dirs: the directories to search in, in the provided order
+        :param sample_hash: a unique string identifying the sample (see SamplesCacher.get_final_sample_id_hash)
+        :param keys: optionally, a subset of keys to load. A backend may ignore it and return the full sample.
+        :return: the loaded sample or None if it was not found in any of read_dirs
+        """
+        location = self.locate(read_dirs, sample_hash)
+        if location is None:
+            return None
+        return self.load_sample_from_location(location, keys)
+
+    def prefetch(self, location: Any) -> None:
+        """
+        A hint that the sample will be loaded soon - warms the relevant cache (for example, the OS page cache) in advance.
+        Called from background threads (see SamplesCacher.prefetch_sample), so it should not modify state that is not thread safe.
+        The default implementation does nothing.
+        :param location: as returned by save_sample() or locate()
+        """
+        pass
+
+    def flush(self) -> None:
+        """
+        Called by SamplesCacher when a caching session is done. Override if the backend buffers writes or keeps state that should be refreshed.
+        """
+        pass
+
+
+class CacheStorageDirectory(CacheStorageBase):
+    """
+    Default storage - a sample is stored in [sample_hash].pkl.gz (the extension depends on the codec),
+    and large numpy arrays (see _object_requires_hdf5_recurse) are stored separately in [sample_hash].hdf5
+    Each value of the pickled part is pickled separately, and only the requested hdf5 datasets are read, so loading a subset of the keys is cheap.
+    Arrays stored under memmap_keys are stored uncompressed in [sample_hash]@[key].npy instead.
+    A location is a tuple: (path without extension, whether an hdf5 part exists, the extension of the pickled part)
+    """
+
+    def __init__(
+        self,
+        memmap_keys: Optional[Sequence[str]] = None,
+        memmap_mode: str = "c",
+        codec: str = "gzip",
+        codec_level: Optional[int] = None,
+        hdf5_blosc_kwargs: Optional[dict] = None,
+    ):
+        """
+        :param memmap_keys: optional, keys (or prefixes of keys) of numpy arrays to store uncompressed and load as np.memmap.
+        :param memmap_mode: the mode used to open the memory mapped arrays, see numpy.memmap.
+            The default, "c" (copy-on-write), allows ops to modify the loaded array in place without modifying the cache.
+        :param codec: the codec used to compress the pickled part of the sample, one of "none", "gzip", "lz4", "zstd"
+        :param codec_level: optional compression level, None for the codec default
+        :param hdf5_blosc_kwargs: optional arguments for hdf5plugin.Blosc used for the hdf5 part - cname (sub codec), clevel and shuffle.
+        """
+        if codec not in COMPRESSION_CODECS_EXTENSIONS:
+            raise Exception(
+                f"unsupported codec {codec}, supported codecs are {list(COMPRESSION_CODECS_EXTENSIONS.keys())}"
+            )
+        self._memmap_keys = memmap_keys
+        self._memmap_mode = memmap_mode
+        self._codec = codec
+        self._codec_level = codec_level
+        self._hdf5_blosc_kwargs = hdf5_blosc_kwargs
+        self._pickle_ext = ".pkl" + COMPRESSION_CODECS_EXTENSIONS[codec]
+        # the extensions to search for, starting with the one of the configured codec
+        self._search_pickle_exts = [self._pickle_ext] + [
+            ".pkl" + ext for ext in COMPRESSION_CODECS_EXTENSIONS.values() if ".pkl" + ext != self._pickle_ext
+        ]
+
+    def save_sample(self, write_dir: str, sample_hash: str, sample: NDict) -> Tuple[str, bool, str]:
+        extension_less = os.path.join(write_dir, sample_hash)
+        # keys are removed below, avoid modifying the caller's sample
+        sample = sample.clone(deepcopy=False)
+
+        npy_keys = []
+        if self._memmap_keys is not None:
+            npy_keys = [k for k, v in sample.items() if _key_matches(k, self._memmap_keys) and _is_memmap_compatible(v)]
+            for k in npy_keys:
+                npy_filename = f"{extension_less}@{k}.npy"
+                scrambed_filename = get_randomized_postfix_name(npy_filename)
+                with open(scrambed_filename, "wb") as f:
+                    np.save(f, np.ascontiguousarray(sample.pop(k)), allow_pickle=False)
+                os.rename(scrambed_filename, npy_filename)
+
+        requiring_hdf5_keys = _object_requires_hdf5_recurse(sample)
+        if len(requiring_hdf5_keys) > 0:
+            requiring_hdf5_dict = sample.get_multi(requiring_hdf5_keys)
+            requiring_hdf5_dict = requiring_hdf5_dict.flatten()
+
+            save_hdf5_safe(extension_less + ".hdf5", blosc_kwargs=self._hdf5_blosc_kwargs, **requiring_hdf5_dict)
+
+            # remove all hdf5 entries from the sample_dict that will be pickled
+            for k in requiring_hdf5_dict:
+                _ = sample.pop(k)
+
+        save_pickle_safe(
+            _KeysSeparatedSample(sample, requiring_hdf5_keys, npy_keys),
+            extension_less + self._pickle_ext,
+            codec=self._codec,
+            codec_level=self._codec_level,
+        )
+        return (extension_less, len(requiring_hdf5_keys) > 0, self._pickle_ext)
+
+    def locate(self, read_dirs: List[str], sample_hash: str) -> Optional[Tuple[str, bool, str]]:
+        for curr_read_dir in read_dirs:
+            extension_less = os.path.join(curr_read_dir, sample_hash)
+            for pickle_ext in self._search_pickle_exts:
+                if os.path.isfile(extension_less + pickle_ext):
+                    return (extension_less, os.path.isfile(extension_less + ".hdf5"), pickle_ext)
+
+        return None
+
+    def load_sample_from_location(self, location: Tuple[str, bool, str], keys: Optional[Sequence[str]] = None) -> NDict:
+        extension_less, has_hdf5 = location[:2]
+        pickle_ext = location[2] if len(location) > 2 else ".pkl.gz"
+        pickled_part = load_pickle(extension_less + pickle_ext)
+        if isinstance(pickled_part, _KeysSeparatedSample):
+            loaded_sample = pickled_part.to_sample(keys)
+            hdf5_keys = pickled_part.hdf5_keys
+            for k in getattr(pickled_part, "npy_keys", []):
+                if is_key_selected(k, keys):
+                    loaded_sample[k] = np.load(f"{extension_less}@{k}.npy", mmap_mode=self._memmap_mode)
+        else:  # stored in the previous format - a plain dict
+            loaded_sample = NDict(pickled_part)
+            hdf5_keys = None
+
+        if has_hdf5:
+            if keys is None or hdf5_keys is None:
+                loaded_sample.merge(load_hdf5(extension_less + ".hdf5"))
+            else:
+                custom_extract = {k: None for k in hdf5_keys if is_key_selected(k, keys)}
+                if len(custom_extract) > 0:
+                    loaded_sample.merge(load_hdf5(extension_less + ".hdf5", custom_extract=custom_extract))
+
+        return select_sample_keys(loaded_sample, keys)
+
+    def prefetch(self, location: Tuple[str, bool, str]) -> None:
+        extension_less, has_hdf5 = location[:2]
+        pickle_ext = location[2] if len(location) > 2 else ".pkl.gz"
+        filenames = [extension_less + pickle_ext]
+        if has_hdf5:
+            filenames.append(extension_less + ".hdf5")
+        if self._memmap_keys is not None:
+            filenames.extend(glob(glob_escape(extension_less) + "@*.npy"))
+        for filename in filenames:
+            _read_file_into_page_cache(filename)
+
+
+class CacheStoragePackedShards(CacheStorageBase):
+    """
+    Packs many samples into large append-only shard files.
+    Each writing process appends to its own shard file ("shard@[host]_[pid]_[n].bin"),
+    and records the location of every sample in a small text index file next to it ("shard@[host]_[pid]_[n].idx"), one line per sample:
+    [sample_hash] [offset] [length]
+    An index line is written only after the sample bytes were flushed, so a partially written sample is never indexed.
+
+    Loading a sample is a single seek+read, the indices of all shards are read once (lazily) per process.
+    A location is a tuple: (shard filename, offset, length)
+
+    Each sample record starts with a header describing the codec and where each of the (separately pickled and compressed) values is located inside the record:
+    [header length - 8 bytes][pickled header {"codec": codec, "values": {key: (offset in values section, length)}}][values section]
+    When only a subset of keys is requested, only the header and the requested values are read.
+    Arrays stored under memmap_keys are stored as raw bytes (the header entry is then (offset, length, dtype, shape))
+    and are loaded as np.memmap views into the shard file.
+    """
+
+    RECORD_HEADER_LEN_FORMAT = "<Q"
+    RECORD_HEADER_LEN_SIZE = struct.calcsize(RECORD_HEADER_LEN_FORMAT)
+    # the amount of bytes to read when trying to read the header in a single read
+    RECORD_HEADER_READ_SIZE = 2**16
+
+    SHARD_PREFIX = "shard@"
+
+    def __init__(
+        self,
+        max_shard_size_bytes: int = 2**30,
+        codec: str = "none",
+        codec_level: Optional[int] = None,
+        memmap_keys: Optional[Sequence[str]] = None,
+        memmap_mode: str = "c",
+    ):
+        """
+        :param max_shard_size_bytes: once a shard reaches this size, the writing process moves to a new shard file
+        :param codec: the codec used to compress each stored value, one of "none", "gzip", "lz4", "zstd".
+            Default is "none", which is usually preferable for large arrays.
+        :param codec_level: optional compression level, None for the codec default
+        :param memmap_keys: optional, keys (or prefixes of keys) of numpy arrays to store uncompressed and load as np.memmap.
+        :param memmap_mode: the mode used to open the memory mapped arrays, see numpy.memmap.
+            The default, "c" (copy-on-write), allows ops to modify the loaded array in place without modifying the cache.
+        """
+        self._max_shard_size_bytes = max_shard_size_bytes
+        if codec not in COMPRESSION_CODECS_EXTENSIONS:
+            raise Exception(
+                f"unsupported codec {codec}, supported codecs are {list(COMPRESSION_CODECS_EXTENSIONS.keys())}"
+            )
+        self._codec = codec
+        self._codec_level = codec_level
+        self._memmap_keys = memmap_keys
+        self._memmap_mode = memmap_mode
+        self._reset_process_state()
+
+    def _reset_process_state(self) -> None:
+        # writer state
+        self._writer_pid = None
+        self._writer_shard_num = 0
+        self._writer_dir = None
+        self._writer_data_file = None
+        self._writer_index_file = None
+        # reader state
+        self._reader_pid = None
+        self._reader_index: Dict[str, Tuple[str, int, int]] = {}
+        self._reader_indexed_dirs: Dict[str, int] = {}
+        self._reader_files_pid = None
+        self._reader_files = {}
+
+    def __getstate__(self) -> dict:
+        # open files and loaded indices are per process
+        state = self.__dict__.copy()
+        for k in list(state.keys()):
+            if k.startswith("_writer_") or k.startswith("_reader_"):
+                del state[k]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._reset_process_state()
+
+    def _shard_base_name(self) -> str:
+        return f"{CacheStoragePackedShards.SHARD_PREFIX}{G_host_name}_{os.getpid()}_{self._writer_shard_num}"
+
+    def _open_writer(self, write_dir: str) -> None:
+        self._close_writer()
+        self._writer_pid = os.getpid()
+        while True:
+            base = os.path.join(write_dir, self._shard_base_name())
+            if not os.path.exists(base + ".bin"):
+                break
+            self._writer_shard_num += 1
+        self._writer_dir = write_dir
+        self._writer_data_file = open(base + ".bin", "ab")
+        self._writer_index_file = open(base + ".idx", "at")
+
+    def _close_writer(self) -> None:
+        if self._writer_data_file is not None:
+            self._writer_data_file.close()
+            self._writer_index_file.close()
+        self._writer_data_file = None
+        self._writer_index_file = None
+
+    def save_sample(self, write_dir: str, sample_hash: str, sample: NDict) -> Tuple[str, int, int]:
+        if (
+            self._writer_data_file is None
+            or self._writer_pid != os.getpid()
+            or self._writer_dir != write_dir
+            or self._writer_data_file.tell() >= self._max_shard_size_bytes
+        ):
+            if self._writer_pid != os.getpid():
+                # forked - do not touch the parent's files
+                self._writer_data_file = None
+                self._writer_shard_num = 0
+            elif self._writer_data_file is not None:
+                self._writer_shard_num += 1
+            self._open_writer(write_dir)
+
+        record = self._pack_record(sample)
+
+        offset = self._writer_data_file.tell()
+        self._writer_data_file.write(record)
+        self._writer_data_file.flush()
+        self._writer_index_file.write(f"{sample_hash} {offset} {len(record)}\n")
+        self._writer_index_file.flush()
+        return (os.path.abspath(self._writer_data_file.name), offset, len(record))
+
+    def _load_indices(self, read_dirs: List[str]) -> None:
+        if self._reader_pid != os.getpid():
+            self._reader_pid = os.getpid()
+            self._reader_index = {}
+            self._reader_indexed_dirs = {}
+
+        # reversed, so samples found in earlier read dirs will take precedence
+        for curr_read_dir in reversed(read_dirs):
+            for index_filename in sorted(
+                glob(os.path.join(curr_read_dir, CacheStoragePackedShards.SHARD_PREFIX + "*.idx"))
+            ):
+                data_filename = os.path.abspath(index_filename[: -len(".idx")] + ".bin")
+                with open(index_filename, "rt") as f:
+                    for line in f:
+                        parts = line.split()
+                        if not line.endswith("\n") or len(parts) != 3:  # a partially written line
+                            continue
+                        self._reader_index[parts[0]] = (data_filename, int(parts[1]), int(parts[2]))
+            self._reader_indexed_dirs[curr_read_dir] = len(self._reader_index)
+
+    def locate(self, read_dirs: List[str], sample_hash: str) -> Optional[Tuple[str, int, int]]:
+        if self._reader_pid != os.getpid() or any(d not in self._reader_indexed_dirs for d in read_dirs):
+            self._load_indices(read_dirs)
+
+        location = self._reader_index.get(sample_hash, None)
+        if location is None:
+            # might have been written after the indices were loaded
+            self._load_indices(read_dirs)
+            location = self._reader_index.get(sample_hash, None)
+
+        return location
+
+    def load_sample_from_location(self, location: Tuple[str, int, int], keys: Optional[Sequence[str]] = None) -> NDict:
+        if self._reader_files_pid != os.getpid():
+            # file objects are not shared with a parent process
+            self._reader_files_pid = os.getpid()
+            self._reader_files = {}
+
+        data_filename, offset, length = location
+        f = self._reader_files.get(data_filename, None)
+        if f is None:
+            f = open(data_filename, "rb")
+            self._reader_files[data_filename] = f
+
+        len_size = CacheStoragePackedShards.RECORD_HEADER_LEN_SIZE
+        if keys is None and self._memmap_keys is None:
+            data = memoryview(_read_at(f, offset, length))
+        else:
+            data = memoryview(_read_at(f, offset, min(length, CacheStoragePackedShards.RECORD_HEADER_READ_SIZE)))
+        (header_len,) = struct.unpack(CacheStoragePackedShards.RECORD_HEADER_LEN_FORMAT, data[:len_size])
+        if len(data) < len_size + header_len:
+            data = memoryview(data.tobytes() + _read_at(f, offset + len(data), len_size + header_len - len(data)))
+        header = pickle.loads(data[len_size : len_size + header_len])
+        values_start = len_size + header_len
+        codec = header["codec"]
+
+        ans = {}
+        for k, entry in header["values"].items():
+            if not is_key_selected(k, keys):
+                continue
+            pos, value_len = entry[:2]
+            if len(entry) == 4:  # raw array
+                dtype, shape = entry[2:]
+                ans[k] = np.memmap(
+                    data_filename,
+                    dtype=np.dtype(dtype),
+                    mode=self._memmap_mode,
+                    offset=offset + values_start + pos,
+                    shape=shape,
+                )
+                continue
+            if values_start + pos + value_len <= len(data):
+                value_bytes = data[values_start + pos : values_start + pos + value_len]
+            else:
+                value_bytes = _read_at(f, offset + values_start + pos, value_len)
+            value_bytes = decompress_bytes(value_bytes, codec)
+            ans[k] = pickle.loads(value_bytes)
+
+        return NDict(ans, already_flat=True)
+
+    def prefetch(self, location: Tuple[str, int, int]) -> None:
+        data_filename, offset, length = location
+        with open(data_filename, "rb") as f:
+            _read_file_into_page_cache(f, offset, length)
+
+    def _pack_record(self, sample: NDict) -> bytes:
+        header = {}
+        values = []
+        pos = 0
+        for k, v in sample.items():
+            if self._memmap_keys is not None and _key_matches(k, self._memmap_keys) and _is_memmap_compatible(v):
+                v = np.ascontiguousarray(v)
+                value_bytes = v.tobytes()
+                header[k] = (pos, len(value_bytes), v.dtype.str, v.shape)
+                values.append(value_bytes)
+                pos += len(value_bytes)
+                continue
+            value_bytes = compress_bytes(
+                pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL), self._codec, self._codec_level
+            )
+            header[k] = (pos, len(value_bytes))
+            values.append(value_bytes)
+            pos += len(value_bytes)
+
+        header_bytes = pickle.dumps({"codec": self._codec, "values": header}, protocol=pickle.HIGHEST_PROTOCOL)
+        return b"".join(
+            [struct.pack(CacheStoragePackedShards.RECORD_HEADER_LEN_FORMAT, len(header_bytes)), header_bytes] + values
+        )
+
+    def flush(self) -> None:
+        self._close_writer()
+        # force reloading the indices on next read
+        self._reader_pid = None
+
+
+class CacheStorageTiered(CacheStorageBase):
+    """
+    Two tiers storage - a bounded fast tier (typically a node-local SSD) in front of another storage, the slow tier (typically a shared network filesystem).
+    Samples are written only to the slow tier. When a sample is read, it is loaded from the fast tier if it's there,
+    otherwise it's loaded from the slow tier and copied ("promoted") to the fast tier.
+    Once the fast tier exceeds fast_tier_max_bytes, the least recently used samples are evicted from it.
+
+    Each sample is stored in the fast tier as a single uncompressed pickle file.
+    The fast tier directory can be shared by all of the processes of a node (for example, the DataLoader workers).
+    The access time of a sample is recorded in the modification time of its file, so the eviction order is shared by all of the processes as well.
+
+    A location is a tuple: (name of the sample in the fast tier, location in the slow tier)
+    The name includes a token of the build of the cache, stored in the cache directory (see _get_build_token()),
+    so samples of a rebuilt cache are never read from the fast tier copies of the old cache.
+    """
+
+    FAST_TIER_EXT = ".pkl"
+    # created in the cache directory, which is deleted when the cache is rebuilt
+    BUILD_TOKEN_FILENAME = "build_token.txt"
+
+    def __init__(
+        self,
+        fast_tier_dir: str,
+        fast_tier_max_bytes: int,
+        slow_tier_storage: Optional[CacheStorageBase] = None,
+        eviction_target_ratio: float = 0.9,
+    ):
+        """
+        :param fast_tier_dir: the fast tier directory
+        :param fast_tier_max_bytes: the maximal size of the fast tier
+        :param slow_tier_storage: the storage of the slow tier, which is the storage of the cache itself. default is CacheStorageDirectory
+        :param eviction_target_ratio: when evicting, samples are evicted until the size of the fast tier is below eviction_target_ratio*fast_tier_max_bytes
+        """
+        if slow_tier_storage is None:
+            slow_tier_storage = CacheStorageDirectory()
+        self._fast_tier_dir = fast_tier_dir
+        self._fast_tier_max_bytes = fast_tier_max_bytes
+        self._slow_tier_storage = slow_tier_storage
+        self._eviction_target_ratio = eviction_target_ratio
+        # an estimation of the size of the fast tier, initialized (by scanning the directory) on first promotion, per process
+        self._fast_tier_bytes = None
+        self._stats = dict(hits=0, misses=0, prefetches=0, bytes_promoted=0, evictions=0, bytes_evicted=0)
+        # guards self._stats and self._fast_tier_bytes, which are modified also by the prefetching threads
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: the statistics of this process: fast tier hits and misses, samples prefetched into the fast tier, bytes copied to the fast tier, evicted samples and evicted bytes
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def save_sample(self, write_dir: str, sample_hash: str, sample: NDict) -> Tuple[Optional[str], Any]:
+        slow_location = self._slow_tier_storage.save_sample(write_dir, sample_hash, sample)
+        return (self._fast_tier_name(slow_location, [write_dir]), slow_location)
+
+    def locate(self, read_dirs: List[str], sample_hash: str) -> Optional[Tuple[Optional[str], Any]]:
+        slow_location = self._slow_tier_storage.locate(read_dirs, sample_hash)
+        if slow_location is None:
+            return None
+        return (self._fast_tier_name(slow_location, read_dirs), slow_location)
+
+    def load_sample_from_location(
+        self, location: Tuple[Optional[str], Any], keys: Optional[Sequence[str]] = None
+    ) -> NDict:
+        fast_tier_name, slow_location = location
+        if fast_tier_name is None:
+            return self._slow_tier_storage.load_sample_from_location(slow_location, keys)
+        fast_tier_filename = os.path.join(self._fast_tier_dir, fast_tier_name + self.FAST_TIER_EXT)
+        try:
+            sample = self._read_fast_tier(fast_tier_filename)
+            self._touch(fast_tier_filename)
+            self._increment_stat("hits")
+            return select_sample_keys(NDict(sample, already_flat=True), keys)
+        except (FileNotFoundError, EOFError, ValueError, pickle.UnpicklingError):
+            pass  # not promoted yet, evicted, or evicted while reading
+
+        self._increment_stat("misses")
+        sample = self._slow_tier_storage.load_sample_from_location(slow_location)
+        self._promote(fast_tier_filename, sample)
+        return select_sample_keys(sample, keys)
+
+    def prefetch(self, location: Tuple[Optional[str], Any]) -> None:
+        """
+        Copies the sample into the fast tier, if it's not already there
+        """
+        fast_tier_name, slow_location = location
+        if fast_tier_name is None:
+            return
+        fast_tier_filename = os.path.join(self._fast_tier_dir, fast_tier_name + self.FAST_TIER_EXT)
+        if os.path.exists(fast_tier_filename):
+            self._touch(fast_tier_filename)
+            return
+        self._increment_stat("prefetches")
+        sample = self._slow_tier_storage.load_sample_from_location(slow_location)
+        self._promote(fast_tier_filename, sample)
+
+    def flush(self) -> None:
+        self._slow_tier_storage.flush()
+
+    def _increment_stat(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += value
+
+    def _fast_tier_name(self, slow_location: Any, dirs: List[str]) -> Optional[str]:
+        """
+        :param dirs: the directories that might contain the sample
+        :return: the name of the sample in the fast tier, unique per build of the cache.
+            None if the sample is not in one of dirs (or the build token can't be created) - the fast tier is not used for it.
+        """
+        path = slow_location[0] if isinstance(slow_location, tuple) and len(slow_location) > 0 else None
+        if not isinstance(path, str):
+            return None
+        for storage_dir in dirs:
+            if path.startswith(os.path.join(storage_dir, "")):
+                try:
+                    build_token = self._get_build_token(storage_dir)
+                except OSError:
+                    return None  # for example, a read only directory of an older cache
+                return hashlib.md5((str(slow_location) + "@" + build_token).encode("utf-8")).hexdigest()
+        return None
+
+    @staticmethod
+    def _get_build_token(storage_dir: str) -> str:
+        """
+        :return: a random token of the build of the cache in storage_dir, created by the first caller
+        """
+        token_filename = os.path.join(storage_dir, CacheStorageTiered.BUILD_TOKEN_FILENAME)
+        try:
+            with open(token_filename, "rt") as f:
+                build_token = f.read()
+            if build_token:
+                return build_token
+        except FileNotFoundError:
+            pass
+        # processes which create the token concurrently might use different tokens, which only costs fast tier misses
+        build_token = os.urandom(8).hex()
+        scrambled_filename = get_randomized_postfix_name(token_filename)
+        with open(scrambled_filename, "wt") as f:
+            f.write(build_token)
+        os.replace(scrambled_filename, token_filename)
+        return build_token
+
+    @staticmethod
+    def _touch(filename: str) -> None:
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            pass  # evicted by another process
+
+    def _serialize_for_fast_tier(self, sample: dict) -> List[Any]:
+        """
+        :return: a list of bytes-like chunks, that will be written one after the other to the fast tier file
+        """
+        return [pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL)]
+
+    def _read_fast_tier(self, filename: str) -> dict:
+        return load_pickle(filename)
+
+    def _promote(self, fast_tier_filename: str, sample: NDict) -> None:
+        chunks = self._serialize_for_fast_tier(
+            {k: np.array(v) if isinstance(v, np.memmap) else v for k, v in sample.items()}
+        )
+        size = sum(memoryview(chunk).nbytes for chunk in chunks)
+        if size > self._fast_tier_max_bytes:
+            return
+        with self._lock:
+            if self._fast_tier_bytes is None:
+                os.makedirs(self._fast_tier_dir, exist_ok=True)
+                self._fast_tier_bytes = self._scan_fast_tier()[0]
+            if self._fast_tier_bytes + size > self._fast_tier_max_bytes:
+                self._evict(self._fast_tier_max_bytes - size)
+            # reserved before writing, so concurrent promotions do not exceed the limit
+            self._fast_tier_bytes += size
+
+        scrambed_filename = get_randomized_postfix_name(fast_tier_filename)
+        with open(scrambed_filename, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.rename(scrambed_filename, fast_tier_filename)
+        self._increment_stat("bytes_promoted", size)
+
+    def _scan_fast_tier(self) -> Tuple[int, List[Tuple[float, int, str]]]:
+        """
+        :return: the total size of the fast tier and a list of (access time, size, path) of the samples in it
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self._fast_tier_dir):
+            if not entry.name.endswith(self.FAST_TIER_EXT):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        return total, entries
+
+    def _evict(self, max_bytes: int) -> None:
+        """
+        Evicts the least recently used samples, considering also the samples promoted by other processes
+        Must be called while holding self._lock
+        """
+        total, entries = self._scan_fast_tier()
+        if total > max_bytes:
+            target = min(max_bytes, self._eviction_target_ratio * self._fast_tier_max_bytes)
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                total -= size
+                self._stats["evictions"] += 1
+                self._stats["bytes_evicted"] += size
+        self._fast_tier_bytes = total
+
+
+class CacheStorageSharedMemory(CacheStorageTiered):
+    """
+    In-RAM cache of the samples, shared by all of the processes of a machine, for example, by all of the DataLoader workers.
+    Samples are stored, when first read, in a directory in shared memory (by default, under /dev/shm) and are memory mapped when read,
+    so the arrays of a sample are not copied and a single copy is shared by all of the processes.
+    The least recently used samples are evicted once the total size exceeds max_bytes.
+    Small datasets become fully memory resident after the first epoch.
+
+    The arrays are mapped copy-on-write, so modifying them in place affects only the process that modified them.
+
+    Cleanup - the shared memory is not released when the process ends (so it can be reused by the next run).
+    It's released by clear(), by clear_at_exit=True, or by deleting the directory (for example, rm -rf /dev/shm/fuse_samples_cache_[user]).
+    The default directory is per user, and is shared (including the max_bytes budget) by all of the caches of the user on the machine.
+    Pass shm_dir to give a cache its own directory and budget.
+
+    On python 3.7 (no pickle protocol 5), only the numpy arrays which are values of the sample are mapped, other values are unpickled.
+    """
+
+    FAST_TIER_EXT = ".shm"
+    # the alignment of each of the arrays in the file
+    ALIGNMENT = 64
+
+    def __init__(
+        self,
+        max_bytes: int,
+        storage: Optional[CacheStorageBase] = None,
+        shm_dir: Optional[str] = None,
+        clear_at_exit: bool = False,
+    ):
+        """
+        :param max_bytes: the maximal amount of memory to use
+        :param storage: the storage of the cache itself. default is CacheStorageDirectory
+        :param shm_dir: optional, a directory on a memory backed filesystem (tmpfs). default is /dev/shm/fuse_samples_cache_[user]
+        :param clear_at_exit: release the shared memory (see clear()) when the process that created this instance exits
+        """
+        if shm_dir is None:
+            shm_root = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            shm_dir = os.path.join(shm_root, f"fuse_samples_cache_{_get_user_name()}")
+        super().__init__(fast_tier_dir=shm_dir, fast_tier_max_bytes=max_bytes, slow_tier_storage=storage)
+        if clear_at_exit:
+            atexit.register(self.clear)
+
+    def clear(self) -> None:
+        """
+        Releases the shared memory by deleting all of the stored samples
+        """
+        for entry in glob(os.path.join(self._fast_tier_dir, "*" + self.FAST_TIER_EXT)):
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._fast_tier_bytes = None
+
+    def _serialize_for_fast_tier(self, sample: dict) -> List[Any]:
+        arrays = {}
+        if _PICKLE_OUT_OF_BAND_SUPPORTED:
+            # pickle protocol 5 keeps the arrays buffers out of band, so they can be stored as raw (aligned) bytes and mapped when read
+            buffers: List[Any] = []
+            data = pickle.dumps(sample, protocol=5, buffer_callback=buffers.append)
+            raw_buffers = [buffer.raw() for buffer in buffers]
+        else:
+            # the arrays which are values of the sample are stored as raw bytes, and the rest of the sample is pickled
+            sample = dict(sample)
+            raw_buffers = []
+            for k, v in sample.items():
+                if isinstance(v, np.ndarray) and not v.dtype.hasobject:
+                    v = np.ascontiguousarray(v)
+                    arrays[k] = (len(raw_buffers) + 1, v.dtype, v.shape)
+                    raw_buffers.append(memoryview(v.reshape(-1)).cast("B"))
+                    sample[k] = None
+            data = pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL)
+        chunks = [data] + raw_buffers
+        entries = []
+        pos = 0
+        for chunk in chunks:
+            entries.append((pos, chunk.nbytes if isinstance(chunk, memoryview) else len(chunk)))
+            pos += _align(entries[-1][1], CacheStorageSharedMemory.ALIGNMENT)
+        header = pickle.dumps(
+            {"out_of_band": _PICKLE_OUT_OF_BAND_SUPPORTED, "chunks": entries, "arrays": arrays},
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+        header_size = _align(
+            CacheStoragePackedShards.RECORD_HEADER_LEN_SIZE + len(header), CacheStorageSharedMemory.ALIGNMENT
+        )
+        ans = [
+            struct.pack(CacheStoragePackedShards.RECORD_HEADER_LEN_FORMAT, len(header)),
+            header,
+            bytes(header_size - CacheStoragePackedShards.RECORD_HEADER_LEN_SIZE - len(header)),
+        ]
+        for chunk, (_, size) in zip(chunks, entries):
+            ans.append(chunk)
+            ans.append(bytes(_align(size, CacheStorageSharedMemory.ALIGNMENT) - size))
+        return ans
+
+    def _read_fast_tier(self, filename: str) -> dict:
+        with open(filename, "rb") as f:
+            mapped = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+        len_size = CacheStoragePackedShards.RECORD_HEADER_LEN_SIZE
+        (header_len,) = struct.unpack(CacheStoragePackedShards.RECORD_HEADER_LEN_FORMAT, mapped[:len_size])
+        header = pickle.loads(mapped[len_size : len_size + header_len])
+        start = _align(len_size + header_len, CacheStorageSharedMemory.ALIGNMENT)
+        chunks = [mapped[start + pos : start + pos + size] for pos, size in header["chunks"]]
+        if header["out_of_band"]:
+            if not _PICKLE_OUT_OF_BAND_SUPPORTED:
+                raise ValueError(f"{filename} was stored by python 3.8 or later")  # treated as a miss
+            return pickle.loads(chunks[0], buffers=chunks[1:])
+        sample = pickle.loads(chunks[0])
+        for k, (index, dtype, shape) in header["arrays"].items():
+            sample[k] = np.frombuffer(chunks[index], dtype=dtype).reshape(shape)
+        return sample
+
+
+# pickle protocol 5 (out of band buffers) requires python 3.8
+_PICKLE_OUT_OF_BAND_SUPPORTED = sys.version_info >= (3, 8)
+
+
+def _get_user_name() -> str:
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError):  # no user name, for example, in some containers
+        return str(os.getuid()) if hasattr(os, "getuid") else "unknown"
+
+
+def _align(size: int, alignment: int) -> int:
+    return (size + alignment - 1) // alignment * alignment
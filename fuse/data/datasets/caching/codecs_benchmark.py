@@ -0,0 +1,93 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+import pickle
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from fuse.utils.file_io.file_io import compress_bytes, decompress_bytes, COMPRESSION_CODECS_EXTENSIONS
+
+
+DEFAULT_BENCHMARK_CODECS = [("none", None), ("gzip", 1), ("gzip", 6), ("lz4", None), ("zstd", 1), ("zstd", 3)]
+
+
+def benchmark_cache_codecs(
+    samples: Sequence[Any],
+    codecs: Optional[Sequence[Tuple[str, Optional[int]]]] = None,
+    repeats: int = 3,
+) -> pd.DataFrame:
+    """
+    Measures the stored size and the decoding throughput of each codec on the given samples,
+    to help choosing the codec of a cache (see CacheStorageDirectory and CacheStoragePackedShards).
+    Codecs that require a missing optional package are skipped.
+
+    :param samples: samples to benchmark with, typically a few samples produced by the static pipeline
+    :param codecs: list of (codec, level) pairs. level None means the codec default
+    :param repeats: the decoding time is the best out of "repeats" runs
+    :return: a dataframe with a row per codec: size in bytes, compression ratio, encode and decode throughput in MB/s
+    """
+    if codecs is None:
+        codecs = DEFAULT_BENCHMARK_CODECS
+
+    raw = [pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL) for sample in samples]
+    raw_size = sum(len(r) for r in raw)
+    raw_mb = raw_size / 2**20
+
+    rows: List[Dict[str, Any]] = []
+    for codec, level in codecs:
+        if codec not in COMPRESSION_CODECS_EXTENSIONS:
+            raise Exception(
+                f"unsupported codec {codec}, supported codecs are {list(COMPRESSION_CODECS_EXTENSIONS.keys())}"
+            )
+        try:
+            start = time.perf_counter()
+            encoded = [compress_bytes(r, codec, level) for r in raw]
+            encode_time = time.perf_counter() - start
+        except Exception as e:
+            print(f"benchmark_cache_codecs: skipping codec {codec}: {e}")
+            continue
+
+        decode_time = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for e in encoded:
+                pickle.loads(decompress_bytes(e, codec))
+            decode_time = min(decode_time, time.perf_counter() - start)
+
+        size = sum(len(e) for e in encoded)
+        rows.append(
+            dict(
+                codec=codec,
+                level=level,
+                size_bytes=size,
+                ratio=raw_size / max(size, 1),
+                encode_mb_per_sec=raw_mb / max(encode_time, 1e-9),
+                decode_mb_per_sec=raw_mb / max(decode_time, 1e-9),
+            )
+        )
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    # example - a synthetic image-like sample, replace with samples produced by your static pipeline
+    rng = np.random.default_rng(1337)
+    img = np.clip(rng.normal(0.5, 0.1, size=(30, 256, 256)), 0, 1).astype(np.float32)
+    seg = (img > 0.6).astype(np.uint8)
+    print(benchmark_cache_codecs([{"data.img": img, "data.seg": seg}]).to_string(index=False))
@@ -12,15 +12,15 @@ limitations under the License.
 Created on June 30, 2021
 """
 from functools import partial
-from typing import Hashable, List, Optional, Sequence, Union, Callable, Any, Tuple
+import copy
+from typing import Dict, Hashable, List, Optional, Sequence, Union, Callable, Any, Tuple
 
 from fuse.data.pipelines.pipeline_default import PipelineDefault
 from collections import OrderedDict
-from fuse.data.datasets.caching.object_caching_handlers import _object_requires_hdf5_recurse
-from fuse.utils.ndict import NDict
+from fuse.data.datasets.caching.cache_storage import CacheStorageBase, CacheStorageDirectory, select_sample_keys
 import os
 import psutil
-from fuse.utils.file_io.file_io import load_hdf5, save_hdf5_safe, load_pickle, save_pickle_safe
+from fuse.utils.file_io.file_io import load_pickle, save_pickle_safe, get_randomized_postfix_name
 from fuse.data import get_sample_id, create_initial_sample, get_specific_sample_from_potentially_morphed
 import hashlib
 from fuse.utils.file_io import delete_directory_tree
@@ -28,7 +28,20 @@ from glob import glob
 from fuse.utils.multiprocessing.run_multiprocessed import run_multiprocessed, get_from_global_storage
 from fuse.data.datasets.sample_caching_audit import SampleCachingAudit
 from fuse.data.utils.sample import get_initial_sample_id, set_initial_sample_id
+from fuse.data.utils.sample_ids import get_sample_ids_hash
+from fuse.utils.ndict import NDict
 from warnings import warn
+import numpy as np
+import time
+from fuse.data.utils import profiling
+
+# pass as side_table_keys to SamplesCacher to collect all of the scalar values of the samples
+SIDE_TABLE_ALL_SCALARS = "all_scalars"
+
+# prefix of the files (in full_sets_info) that index the already processed original sample ids, see "incremental" in SamplesCacher
+PROCESSED_INDEX_PREFIX = "processed_orig_samples@"
+# once there are more parts, they are merged into a single file
+PROCESSED_INDEX_MAX_PARTS = 16
 
 
 class SamplesCacher:
@@ -43,6 +56,11 @@ class SamplesCacher:
         workers: int = 0,
         verbose=1,
         use_pipeline_hash: Optional[bool] = True,
+        storage: Optional[CacheStorageBase] = None,
+        side_table_keys: Union[None, str, Sequence[str]] = None,
+        incremental: bool = False,
+        checkpoint_op_ids: Optional[Sequence[str]] = None,
+        task_cost: Optional[Callable[[Hashable], float]] = None,
         **audit_kwargs: dict,
     ) -> None:
         """
@@ -61,11 +79,38 @@ class SamplesCacher:
         (for example, code change)
         :param workers: number of multiprocessing workers used when building the cache. Default value is 0 (no multiprocessing)
         :param use_pipeline_hash [Optional]: indicates whether to use a hash of given pipeline for naming its cache dir. Default=True
+        :param storage [Optional]: the storage backend that defines how the samples are written to and read from the cache dirs.
+            Default is CacheStorageDirectory - a file (or two) per sample.
+            Use CacheStoragePackedShards to pack many samples into large shard files, which is much faster for very large caches and network filesystems.
+            Note that the same storage type must be used when reading an existing cache.
+        :param side_table_keys [Optional]: keys of small scalar values (int, float, bool, short str) to collect, while caching, into a columnar "side table".
+            The side table allows to get those values for all of the samples without loading the samples, see get_side_table_values().
+            DatasetDefault.get_multi() uses it automatically, which makes samplers, folds split and export much faster.
+            Pass a list of keys, or SIDE_TABLE_ALL_SCALARS to collect all of the scalar values. A key will be available only if it is a scalar in all of the samples.
+        :param incremental [Optional]: when caching a set of sample ids that was not cached before as a whole,
+            only the original sample ids that were never processed are scheduled to the workers.
+            The already processed ids are found using an index stored in full_sets_info, which is updated after each caching,
+            so adding a few samples to a large cache is fast.
+            A cache that was created without the index (or with incremental=False) is still used - its samples are found by the workers
+            the first time and added to the index.
+            Default=False - all of the sample ids are scheduled and each worker checks whether its sample was already processed,
+            which is how the caches of earlier versions were built.
+        :param checkpoint_op_ids [Optional]: op_ids of the pipeline after which the intermediate states of the samples are stored as well.
+            When the pipeline changes, each sample is processed starting from the last checkpoint which is still valid,
+            that is, a checkpoint after which only ops were changed. For example, after modifying the last op, only the last op will run.
+            A checkpoint is identified by a hash of the ops up to its op_id, so checkpoints are kept when restarting the cache,
+            as long as they are still valid. Checkpoints are stored in [cache dir]/[unique_name]/checkpoints.
+            Typically used after the expensive ops, for example, after loading and decoding the images.
+        :param task_cost [Optional]: a cost hint - a function that gets an original sample id and returns its estimated processing cost,
+            for example the size of its image file. The most expensive samples are scheduled to the workers first,
+            so a few huge samples do not create a long tail at the end of the caching. Must be picklable when the cacher is sent to "spawn" workers.
         :param **audit_kwargs: optional custom kwargs to pass to SampleCachingAudit instance.
             auditing cached samples (usually periodically) is very important, in order to avoid "stale" cached samples.
             To disable pass audit_first_sample=False, audit_rate=None,
             Note that it's not recommended to completely disable it, and at the very least you should use audit_first_sample=True, audit_rate=None
             which only tests the first loaded sample for staleness.
+            By default, the first sample is audited when it's loaded and the following audits run in a background thread,
+            so auditing does not slow down loading the samples. Pass audit_async=True/False to audit all of the samples in the background/when loaded.
             To learn more read SampleCachingAudit doc
         """
         if not isinstance(cache_dirs, list):
@@ -84,6 +129,13 @@ class SamplesCacher:
         else:
             self._read_dirs_logic = custom_read_dirs_callable
 
+        if storage is None:
+            storage = CacheStorageDirectory()
+        self._storage = storage
+        self._side_table_keys = side_table_keys
+        self._incremental = incremental
+        self._task_cost = task_cost
+
         self._pipeline = pipeline
         self._use_pipeline_hash = use_pipeline_hash
 
@@ -98,6 +150,23 @@ class SamplesCacher:
         if self._verbose > 0:
             print(f"pipeline description hash for [{unique_name}] is: {self._pipeline_desc_hash}")
 
+        # directory names (under "checkpoints") of the valid checkpoints, one per checkpoint op_id
+        self._checkpoint_op_ids = []
+        self._checkpoint_names = []
+        if checkpoint_op_ids is not None:
+            pipeline_op_ids = pipeline.get_op_ids()
+            for op_id in checkpoint_op_ids:
+                if op_id not in pipeline_op_ids:
+                    raise Exception(f"checkpoint op_id {op_id} does not exist in pipeline {pipeline.get_name()}")
+            self._checkpoint_op_ids = [op_id for op_id in pipeline_op_ids if op_id in checkpoint_op_ids]
+            for op_id in self._checkpoint_op_ids:
+                prefix_desc = pipeline.get_description(until_op_id=op_id)
+                self._checkpoint_names.append(
+                    f"checkpoint_{op_id}@" + hashlib.md5(prefix_desc.encode("utf-8")).hexdigest()
+                )
+        # each checkpoint is written using its own storage instance, to keep the samples of a checkpoint together (for example, in the same shards)
+        self._checkpoint_storages = [copy.deepcopy(storage) for _ in self._checkpoint_op_ids]
+
         self._restart_cache = restart_cache
         if self._restart_cache:
             self.delete_cache()
@@ -111,6 +180,12 @@ class SamplesCacher:
                 'Multi processing is not active in SamplesCacher. Seting "workers" to the number of your cores usually results in a significant speedup. Debugging, however, is easier with "workers=0".'
             )
 
+        # maps final sample_id to its location in the storage, populated by cache_samples()
+        self._samples_index = None
+        # columnar table of scalar values, populated by cache_samples() if side_table_keys is set
+        self._side_table = None
+        self._side_table_rows = None
+
         self._verify_no_other_pipelines_cache()
 
     def _verify_no_other_pipelines_cache(self) -> None:
@@ -135,19 +210,33 @@ class SamplesCacher:
                     raise Exception(
                         f"Found samples cache for pipeline hash {os.path.basename(found_dir)} which is different from the current loaded pipeline hash {self._pipeline_desc_hash} !!\n"
                         "This is not allowed, you may only use a single pipeline per uniquely named cache.\n"
-                        "You can use 'restart_cache=True' to rebuild the cache or delete the different cache manually.\n"
+                        "You can use 'restart_cache=True' to rebuild the cache or delete the different cache manually,\n"
+                        "or delete only the caches of the previous pipelines (keeping the valid checkpoints) with:\n"
+                        f"python -m fuse.data.cache drop-stale {os.path.dirname(os.path.realpath(found_dir))} --keep {' '.join([self._pipeline_desc_hash] + self._checkpoint_names)}\n"
                         f"Cache full path {os.path.abspath(d)}"
                     )
 
-    def delete_cache(self) -> None:
+    def delete_cache(self, keep_valid_checkpoints: bool = True) -> None:
         """
         Will delete this specific named cache from all read and write dirs
+        :param keep_valid_checkpoints: keep the stored checkpoints that are still valid for the current pipeline (see checkpoint_op_ids in __init__)
         """
         dirs_to_delete = self._get_read_dirs() + [self._get_write_dir()]
         dirs_to_delete = list(set(dirs_to_delete))
         dirs_to_delete = [
             os.path.realpath(os.path.join(x, "..")) for x in dirs_to_delete
         ]  # one dir above the pipeline hash dir
+        if keep_valid_checkpoints and len(self._checkpoint_names) > 0:
+            # delete everything except for the valid checkpoints
+            keep_dirs = set(
+                os.path.join(d, "checkpoints", name) for d in dirs_to_delete for name in self._checkpoint_names
+            )
+            dirs_to_delete = [
+                x
+                for d in dirs_to_delete
+                for x in glob(os.path.join(d, "*")) + glob(os.path.join(d, "checkpoints", "*"))
+                if x not in keep_dirs and x != os.path.join(d, "checkpoints")
+            ]
         print('Due to "delete_cache" call, about to delete the following dirs:')
 
         for del_dir in dirs_to_delete:
@@ -156,7 +245,10 @@ class SamplesCacher:
         print("deleting ... ")
         for del_dir in dirs_to_delete:
             print(f"deleting {os.path.abspath(del_dir)} ...")
-            delete_directory_tree(del_dir)
+            if os.path.isfile(del_dir):
+                os.remove(del_dir)
+            else:
+                delete_directory_tree(del_dir)
 
     def _get_write_dir(self):
         ans = self._write_dir_logic(self._cache_dirs)
@@ -168,6 +260,15 @@ class SamplesCacher:
         ans = [os.path.join(x, self._pipeline_desc_hash) for x in ans]
         return ans
 
+    def _get_checkpoint_write_dir(self, checkpoint_index: int) -> str:
+        ans = self._write_dir_logic(self._cache_dirs)
+        return os.path.join(ans, "checkpoints", self._checkpoint_names[checkpoint_index])
+
+    def _get_checkpoint_read_dirs(self, checkpoint_index: int) -> List[str]:
+        return [
+            os.path.join(x, "checkpoints", self._checkpoint_names[checkpoint_index]) for x in self._read_dirs_logic()
+        ]
+
     def cache_samples(self, orig_sample_ids: List[Any]) -> List[Tuple[str, Union[None, List[str]], str]]:
         """
         Go over all of orig_sample_ids, and cache resulting samples
@@ -180,48 +281,277 @@ class SamplesCacher:
 
         # TODO:
 
-        sample_ids_text = "@".join([str(x) for x in sorted(orig_sample_ids)])
-        samples_ids_hash = hashlib.md5(sample_ids_text.encode("utf-8")).hexdigest()
+        samples_ids_hash = get_sample_ids_hash(orig_sample_ids)
 
         hash_filename = "samples_ids_hash@" + samples_ids_hash + ".pkl.gz"
+        index_filename = "samples_index@" + samples_ids_hash + ".pkl.gz"
+        side_table_filename = "side_table@" + samples_ids_hash + ".pkl.gz"
 
         read_dirs = self._get_read_dirs()
         for curr_read_dir in read_dirs:
             fullpath_filename = os.path.join(curr_read_dir, "full_sets_info", hash_filename)
             if os.path.isfile(fullpath_filename):
                 print(f"entire samples set {hash_filename} already cached. Found {os.path.abspath(fullpath_filename)}")
-                return load_pickle(fullpath_filename)
+                orig_sid_to_final = load_pickle(fullpath_filename)
+                index_fullpath_filename = os.path.join(curr_read_dir, "full_sets_info", index_filename)
+                if os.path.isfile(index_fullpath_filename):
+                    self._samples_index = load_pickle(index_fullpath_filename)
+                else:
+                    # a cache created before the samples index was introduced - build it once
+                    self._samples_index = self._build_samples_index(orig_sid_to_final)
+                    save_pickle_safe(self._samples_index, index_fullpath_filename, compress=True)
+                if self._side_table_keys is not None:
+                    side_table_fullpath_filename = os.path.join(curr_read_dir, "full_sets_info", side_table_filename)
+                    side_table = (
+                        load_pickle(side_table_fullpath_filename)
+                        if os.path.isfile(side_table_fullpath_filename)
+                        else None
+                    )
+                    if side_table is not None and "numpy_columns" in side_table:
+                        self._set_side_table(side_table)
+                    else:
+                        # side_table_keys was not set when this set was cached (or it was saved by an older version,
+                        # which didn't keep the types of the values) - build it once from the cached samples
+                        self._set_side_table(self._build_side_table_from_cache(orig_sid_to_final))
+                        save_pickle_safe(self._side_table, side_table_fullpath_filename, compress=True)
+                return orig_sid_to_final
+
+        orig_sample_hashes = [SamplesCacher.get_orig_sample_id_hash(x) for x in orig_sample_ids]
+        processed, processed_parts = self._load_processed_index(read_dirs) if self._incremental else ({}, [])
+        missing_sample_ids = [x for x, h in zip(orig_sample_ids, orig_sample_hashes) if h not in processed]
+        if self._incremental and self._verbose > 0:
+            print(
+                f"incremental caching: {len(orig_sample_ids) - len(missing_sample_ids)} samples were already processed, processing {len(missing_sample_ids)} samples"
+            )
 
-        orig_sid_to_final = OrderedDict()
-        for_global_storage = {"samples_cacher_instance": self}
-        all_ans = run_multiprocessed(
-            SamplesCacher._cache_worker,
-            orig_sample_ids,
-            workers=self._workers,
-            copy_to_global_storage=for_global_storage,
-            verbose=1,
-            desc="caching",
-        )
+        new_processed = {}
+        if len(missing_sample_ids) > 0:
+            for_global_storage = {"samples_cacher_instance": self}
+            all_ans = run_multiprocessed(
+                SamplesCacher._cache_worker,
+                missing_sample_ids,
+                workers=self._workers,
+                copy_to_global_storage=for_global_storage,
+                verbose=1,
+                desc="caching",
+                task_cost=self._task_cost,
+            )
+            self._storage.flush()
+            for storage in self._checkpoint_storages:
+                storage.flush()
+            new_processed = {
+                SamplesCacher.get_orig_sample_id_hash(x): ans for x, ans in zip(missing_sample_ids, all_ans)
+            }
+            processed.update(new_processed)
 
-        for initial_sample_id, output_sample_ids in zip(orig_sample_ids, all_ans):
+        orig_sid_to_final = OrderedDict()
+        samples_index = {}
+        side_table_values = OrderedDict()
+        for initial_sample_id, orig_sample_hash in zip(orig_sample_ids, orig_sample_hashes):
+            output_sample_ids, locations, scalars = processed[orig_sample_hash]
             orig_sid_to_final[initial_sample_id] = output_sample_ids
+            samples_index.update(locations)
+            if output_sample_ids is not None:
+                for sid in output_sample_ids:
+                    # None marks side table values that were not collected with the current side_table_keys
+                    side_table_values[sid] = None if scalars is None else scalars.get(sid)
 
         write_dir = self._get_write_dir()
 
         set_info_dir = os.path.join(write_dir, "full_sets_info")
         os.makedirs(set_info_dir, exist_ok=True)
 
+        if self._side_table_keys is not None:
+            self._samples_index = samples_index
+            self._complete_side_table_values(side_table_values)
+
+        if self._incremental:
+            self._save_processed_index(set_info_dir, new_processed, processed, processed_parts)
+
         pipeline_desc_file = os.path.join(write_dir, f"pipeline_{self._pipeline_desc_hash}_desc.txt")
         if not os.path.exists(pipeline_desc_file):
             with open(pipeline_desc_file, "wt") as f:
                 f.write(self._pipeline_desc_text)
             print("======== wrote", pipeline_desc_file)
 
+        # the index must be written before the set info, which marks the entire set as cached
+        save_pickle_safe(samples_index, os.path.join(set_info_dir, index_filename), compress=True)
+        self._samples_index = samples_index
+        if self._side_table_keys is not None:
+            self._set_side_table(_create_side_table(side_table_values))
+            save_pickle_safe(self._side_table, os.path.join(set_info_dir, side_table_filename), compress=True)
+
         fullpath_filename = os.path.join(set_info_dir, hash_filename)
         save_pickle_safe(orig_sid_to_final, fullpath_filename, compress=True)
 
         return orig_sid_to_final
 
+    def _load_processed_index(self, read_dirs: List[str]) -> Tuple[Dict[str, tuple], List[str]]:
+        """
+        Loads the index of the already processed original sample ids from all of the read dirs
+        :return: a tuple of:
+         processed - a dict mapping the hash of the original sample id (see get_orig_sample_id_hash) to (output info, locations, scalars)
+          scalars is None if it was collected with different side_table_keys
+         parts - the paths of the loaded index files
+        """
+        processed = {}
+        parts = []
+        for curr_read_dir in reversed(read_dirs):
+            for part_filename in sorted(
+                glob(os.path.join(curr_read_dir, "full_sets_info", PROCESSED_INDEX_PREFIX + "*.pkl.gz"))
+            ):
+                try:
+                    part = load_pickle(part_filename)
+                except FileNotFoundError:
+                    continue  # merged by another process in the meantime, the worker will find the per sample info
+                same_side_table_keys = part["side_table_keys"] == self._side_table_keys
+                for orig_sample_hash, (output_info, locations, scalars) in part["entries"].items():
+                    processed[orig_sample_hash] = (output_info, locations, scalars if same_side_table_keys else None)
+                parts.append(part_filename)
+        return processed, parts
+
+    def _save_processed_index(
+        self, set_info_dir: str, new_processed: Dict[str, tuple], processed: Dict[str, tuple], loaded_parts: List[str]
+    ) -> None:
+        """
+        Adds the newly processed original sample ids to the index (see _load_processed_index).
+        Each call adds a new part, which is safe when multiple processes cache concurrently.
+        When there are too many parts, the parts found in this write dir are merged into one.
+        """
+        part_filename = get_randomized_postfix_name(os.path.join(set_info_dir, PROCESSED_INDEX_PREFIX)) + ".pkl.gz"
+        own_parts = [p for p in loaded_parts if os.path.dirname(p) == set_info_dir]
+        merge = len(own_parts) + 1 > PROCESSED_INDEX_MAX_PARTS
+        if not merge and len(new_processed) == 0:
+            return
+        entries = processed if merge else new_processed
+        save_pickle_safe({"side_table_keys": self._side_table_keys, "entries": entries}, part_filename, compress=True)
+        if merge:
+            for p in own_parts:
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+
+    def _complete_side_table_values(self, side_table_values: Dict[Hashable, Optional[dict]]) -> None:
+        """
+        Collects the side table values of the final samples that were processed with different side_table_keys
+        """
+        missing = [sid for sid, scalars in side_table_values.items() if scalars is None]
+        if len(missing) == 0:
+            return
+        for_global_storage = {"samples_cacher_instance": self}
+        all_ans = run_multiprocessed(
+            SamplesCacher._side_table_worker,
+            missing,
+            workers=self._workers,
+            copy_to_global_storage=for_global_storage,
+            verbose=1,
+            desc="side_table",
+        )
+        side_table_values.update(zip(missing, all_ans))
+
+    def _build_samples_index(self, orig_sid_to_final: dict) -> dict:
+        """
+        Searches for the location of all of the final samples
+        :return: a dict mapping final sample_id to its storage location
+        """
+        read_dirs = self._get_read_dirs()
+        samples_index = {}
+        for output_sample_ids in orig_sid_to_final.values():
+            if output_sample_ids is None:
+                continue
+            for sample_id in output_sample_ids:
+                location = self._storage.locate(read_dirs, SamplesCacher.get_final_sample_id_hash(sample_id))
+                if location is not None:
+                    samples_index[sample_id] = location
+        return samples_index
+
+    def _build_side_table_from_cache(self, orig_sid_to_final: dict) -> dict:
+        final_sample_ids = []
+        for output_sample_ids in orig_sid_to_final.values():
+            if output_sample_ids is not None:
+                final_sample_ids.extend(output_sample_ids)
+        for_global_storage = {"samples_cacher_instance": self}
+        all_ans = run_multiprocessed(
+            SamplesCacher._side_table_worker,
+            final_sample_ids,
+            workers=self._workers,
+            copy_to_global_storage=for_global_storage,
+            verbose=1,
+            desc="side_table",
+        )
+        return _create_side_table(OrderedDict(zip(final_sample_ids, all_ans)))
+
+    @staticmethod
+    def _side_table_worker(sample_id: Hashable) -> dict:
+        cacher = get_from_global_storage("samples_cacher_instance")
+        return cacher._extract_side_table_values(
+            cacher._load_sample_from_cache(sample_id, cacher._side_table_load_keys())
+        )
+
+    def _side_table_load_keys(self) -> Optional[List[str]]:
+        if self._side_table_keys == SIDE_TABLE_ALL_SCALARS:
+            return None
+        return list(self._side_table_keys)
+
+    def _extract_side_table_values(self, sample: NDict) -> dict:
+        """
+        extracts the scalar values that should be stored in the side table from a final sample
+        """
+        if self._side_table_keys is None:
+            return {}
+        if self._side_table_keys == SIDE_TABLE_ALL_SCALARS:
+            keys = sample.keys()
+        else:
+            keys = [k for k in self._side_table_keys if k in sample]
+        ans = {}
+        for k in keys:
+            value = sample[k]
+            if _is_side_table_scalar(value):
+                ans[k] = value
+        return ans
+
+    def _set_side_table(self, side_table: dict) -> None:
+        self._side_table = side_table
+        self._side_table_rows = {sid: row for row, sid in enumerate(side_table["sample_ids"])}
+
+    def get_side_table_keys(self) -> List[str]:
+        """
+        :return: the keys available in the side table (see side_table_keys in __init__)
+        """
+        if self._side_table is None:
+            return []
+        return list(self._side_table["columns"].keys())
+
+    def get_side_table_values(
+        self, sample_ids: Sequence[Hashable], keys: Sequence[str], to_list: bool = False
+    ) -> Optional[Dict[str, Union[np.ndarray, list]]]:
+        """
+        Get scalar values of the specified samples from the side table, without loading the samples.
+        See side_table_keys in __init__
+        :param sample_ids: final sample ids
+        :param keys: the requested keys
+        :param to_list: return a list per key, with the values as they were in the samples (python or numpy scalars)
+        :return: a dictionary mapping each key to a numpy array with a value per sample,
+            or None if the side table is not available or does not include all of the keys.
+        """
+        if self._side_table is None:
+            return None
+        columns = self._side_table["columns"]
+        if any(k not in columns for k in keys):
+            return None
+        try:
+            rows = np.fromiter(
+                (self._side_table_rows[sid] for sid in sample_ids), dtype=np.int64, count=len(sample_ids)
+            )
+        except KeyError:
+            return None
+        values = {k: columns[k][rows] for k in keys}
+        if to_list:
+            numpy_columns = self._side_table["numpy_columns"]
+            values = {k: list(v) if k in numpy_columns else v.tolist() for k, v in values.items()}
+        return values
+
     @staticmethod
     def get_final_sample_id_hash(sample_id):
         """
@@ -256,41 +586,165 @@ class SamplesCacher:
         """
         :param sample_id: the sample_id of the sample to load
         :param keys: optionally, provide a subset of the keys to load in this sample.
-        This is useful for speeding up loading.
+        This is useful for speeding up loading. A key may also be a prefix of keys (for example "data.input").
+        The sample id keys are always loaded.
         """
 
+        start_time = time.perf_counter()
         sample_from_cache = self._load_sample_from_cache(sample_id, keys)
+        profiling.record("cache.load_sample", time.perf_counter() - start_time)
         audit_required = self._audit.update()
 
         if audit_required:
             initial_sample_id = get_initial_sample_id(sample_from_cache)
-            fresh_sample = self._load_sample_using_pipeline(initial_sample_id, keys)
-            fresh_sample = get_specific_sample_from_potentially_morphed(fresh_sample, sample_id)
-
-            self._audit.audit(sample_from_cache, fresh_sample)
+            if self._audit.is_async():
+                # the sample is reloaded in the background, as the returned sample might be modified by the caller
+                self._audit.submit(sample_id, partial(self._load_samples_for_audit, sample_id, initial_sample_id, keys))
+            else:
+                fresh_sample = self._load_fresh_sample_for_audit(sample_id, initial_sample_id, keys)
+                self._audit.audit(sample_from_cache, fresh_sample)
 
         return sample_from_cache
 
+    def prefetch_sample(self, sample_id: Hashable) -> None:
+        """
+        A hint that the sample is about to be loaded - warms the OS page cache (or the RAM / fast tier cache, depending on the storage) for it.
+        Thread safe, usually called from a background thread, see fuse.data.utils.samplers.PrefetchingSampler.
+        :param sample_id: the sample_id of the sample that will be loaded
+        """
+        location = None
+        if self._samples_index is not None:
+            location = self._samples_index.get(sample_id, None)
+        if location is None:
+            location = self._storage.locate(self._get_read_dirs(), SamplesCacher.get_final_sample_id_hash(sample_id))
+        if location is not None:
+            self._storage.prefetch(location)
+
+    def _load_fresh_sample_for_audit(
+        self, sample_id: Hashable, initial_sample_id: Hashable, keys: Optional[Sequence[str]]
+    ) -> NDict:
+        fresh_sample = self._load_sample_using_pipeline(initial_sample_id, keys)
+        fresh_sample = get_specific_sample_from_potentially_morphed(fresh_sample, sample_id)
+        return select_sample_keys(fresh_sample, keys)
+
+    def _load_samples_for_audit(
+        self, sample_id: Hashable, initial_sample_id: Hashable, keys: Optional[Sequence[str]]
+    ) -> Tuple[NDict, NDict]:
+        """
+        :return: a tuple of (the cached sample, the freshly processed sample)
+        """
+        return self._load_sample_from_cache(sample_id, keys), self._load_fresh_sample_for_audit(
+            sample_id, initial_sample_id, keys
+        )
+
     def _load_sample_using_pipeline(self, sample_id: Hashable, keys: Optional[Sequence[str]] = None):
         sample_dict = create_initial_sample(sample_id)
         result_sample = self._pipeline(sample_dict)
         return result_sample
 
+    def _load_sample_using_checkpoints(self, orig_sample_id: Hashable) -> Union[None, NDict, List[NDict]]:
+        """
+        Runs the pipeline starting from the last stored checkpoint of the sample (see checkpoint_op_ids in __init__),
+        and stores the states of the sample in the following checkpoints.
+        """
+        samples = [create_initial_sample(orig_sample_id)]
+        start_after_op_id = None
+        next_checkpoint_index = 0
+        for checkpoint_index in reversed(range(len(self._checkpoint_op_ids))):
+            found, checkpoint_samples = self._load_checkpoint(checkpoint_index, orig_sample_id)
+            if found:
+                samples = checkpoint_samples
+                start_after_op_id = self._checkpoint_op_ids[checkpoint_index]
+                next_checkpoint_index = checkpoint_index + 1
+                break
+
+        for checkpoint_index in range(next_checkpoint_index, len(self._checkpoint_op_ids)):
+            until_op_id = self._checkpoint_op_ids[checkpoint_index]
+            samples = self._run_pipeline_part(samples, start_after_op_id, until_op_id)
+            self._save_checkpoint(checkpoint_index, orig_sample_id, samples)
+            start_after_op_id = until_op_id
+
+        samples = self._run_pipeline_part(samples, start_after_op_id, None)
+        if samples is not None and len(samples) == 1:
+            return samples[0]
+        return samples
+
+    def _run_pipeline_part(
+        self, samples: Optional[List[NDict]], start_after_op_id: Optional[str], until_op_id: Optional[str]
+    ) -> Optional[List[NDict]]:
+        """
+        Runs the ops after start_after_op_id and up to until_op_id (including) on each of the samples
+        :return: the list of the resulting samples, or None if the sample was dropped
+        """
+        if samples is None:
+            return None
+        ans = []
+        for sample in samples:
+            result = self._pipeline(sample, until_op_id=until_op_id, start_after_op_id=start_after_op_id)
+            if result is None:
+                # keep the behavior of the entire pipeline - dropping one of the samples drops all of them
+                return None
+            if isinstance(result, list):
+                ans.extend(result)
+            else:
+                ans.append(result)
+        return ans
+
+    def _save_checkpoint(self, checkpoint_index: int, orig_sample_id: Hashable, samples: Optional[List[NDict]]) -> None:
+        write_dir = self._get_checkpoint_write_dir(checkpoint_index)
+        os.makedirs(write_dir, exist_ok=True)
+        checkpoint_hash = SamplesCacher._get_checkpoint_hash(orig_sample_id)
+        if samples is not None:
+            storage = self._checkpoint_storages[checkpoint_index]
+            for i, sample in enumerate(samples):
+                storage.save_sample(write_dir, f"{checkpoint_hash}@{i}", sample)
+        # written last, marks the checkpoint of this sample as complete
+        save_pickle_safe(None if samples is None else len(samples), os.path.join(write_dir, checkpoint_hash + ".pkl"))
+
+    def _load_checkpoint(self, checkpoint_index: int, orig_sample_id: Hashable) -> Tuple[bool, Optional[List[NDict]]]:
+        """
+        :return: a tuple of: whether the checkpoint of the sample was found, and the stored samples (None if the sample was dropped)
+        """
+        read_dirs = self._get_checkpoint_read_dirs(checkpoint_index)
+        checkpoint_hash = SamplesCacher._get_checkpoint_hash(orig_sample_id)
+        storage = self._checkpoint_storages[checkpoint_index]
+        for curr_read_dir in read_dirs:
+            fn = os.path.join(curr_read_dir, checkpoint_hash + ".pkl")
+            if not os.path.isfile(fn):
+                continue
+            num_samples = load_pickle(fn)
+            if num_samples is None:
+                return True, None
+            samples = [storage.load_sample(read_dirs, f"{checkpoint_hash}@{i}") for i in range(num_samples)]
+            if any(sample is None for sample in samples):
+                return False, None
+            return True, samples
+        return False, None
+
+    @staticmethod
+    def _get_checkpoint_hash(orig_sample_id: Hashable) -> str:
+        return "checkpoint@" + SamplesCacher.get_orig_sample_id_hash(orig_sample_id).split("@")[-1]
+
     def _load_sample_from_cache(self, sample_id: Hashable, keys: Optional[Sequence[str]] = None):
         """
-        TODO: add comments
+        Loads a sample from the cache.
+        Uses the samples index (created by cache_samples) to avoid searching for the sample in the read dirs,
+        and falls back to searching if the sample is not indexed or the indexed location no longer exists.
         """
+        if self._samples_index is not None:
+            location = self._samples_index.get(sample_id, None)
+            if location is not None:
+                try:
+                    return self._storage.load_sample_from_location(location, keys)
+                except FileNotFoundError:
+                    pass  # stale index, for example, the cache was moved
+
         read_dirs = self._get_read_dirs()
         sample_hash = SamplesCacher.get_final_sample_id_hash(sample_id)
 
-        for curr_read_dir in read_dirs:
-            extension_less = os.path.join(curr_read_dir, sample_hash)
-            if os.path.isfile(extension_less + ".pkl.gz"):
-                loaded_sample = NDict(load_pickle(extension_less + ".pkl.gz"))
-                if os.path.isfile(extension_less + ".hdf5"):
-                    loaded_sample_hdf5_part = load_hdf5(extension_less + ".hdf5")
-                    loaded_sample.merge(loaded_sample_hdf5_part)
-                return loaded_sample
+        loaded_sample = self._storage.load_sample(read_dirs, sample_hash, keys)
+        if loaded_sample is not None:
+            return loaded_sample
 
         raise Exception(f"Expected to find a cached sample for sample_id={sample_id} but could not find any!")
 
@@ -300,11 +754,15 @@ class SamplesCacher:
         ans = cacher._cache(orig_sample_id)
         return ans
 
-    def _cache(self, orig_sample_id: Any):
+    def _cache(self, orig_sample_id: Any) -> Tuple[Union[None, List[Hashable]], dict, dict]:
         """
         :param orig_sample_id: the original sample id, which was provided as the input to the pipeline
-        :param sample: the result of the pipeline - can be None if it was dropped, a dictionary in the typical standard case,
-         and a list of dictionaries in case the sample was split into multiple samples (ops are allowed to do that during the static part of the processing)
+        :return: a tuple of:
+         output info - None if the sample was dropped, otherwise the list of final sample ids
+         (an op is allowed to split a sample into multiple samples during the static part of the processing)
+         locations - a dict mapping each of the final sample ids to its location in the storage
+         scalars - a dict mapping each of the final sample ids to its side table values (see side_table_keys in __init__),
+          None if side_table_keys is not set and the sample was already processed
         """
 
         write_dir = self._get_write_dir()
@@ -318,10 +776,18 @@ class SamplesCacher:
         for curr_read_dir in read_dirs:
             fn = os.path.join(curr_read_dir, was_processed_fn)
             if os.path.isfile(fn):
-                ans = load_pickle(fn)
-                return ans
-
-        result_sample = self._load_sample_using_pipeline(orig_sample_id)
+                output_info = load_pickle(fn)
+                scalars = None if self._side_table_keys is None else {}
+                if scalars is not None and output_info is not None:
+                    for sid in output_info:
+                        sample = self._load_sample_from_cache(sid, self._side_table_load_keys())
+                        scalars[sid] = self._extract_side_table_values(sample)
+                return output_info, self._build_samples_index({orig_sample_id: output_info}), scalars
+
+        if len(self._checkpoint_op_ids) > 0:
+            result_sample = self._load_sample_using_checkpoints(orig_sample_id)
+        else:
+            result_sample = self._load_sample_using_pipeline(orig_sample_id)
 
         if isinstance(result_sample, dict):
             result_sample = [result_sample]
@@ -337,32 +803,60 @@ class SamplesCacher:
                 f"Unsupported sample type, got {type(result_sample)}. Supported types are dict, list-of-dicts and None."
             )
 
+        locations = {}
+        scalars = {}
         if result_sample is not None:
             output_info = []
             for curr_sample in result_sample:
                 curr_sample_id = get_sample_id(curr_sample)
                 output_info.append(curr_sample_id)
                 output_sample_hash = SamplesCacher.get_final_sample_id_hash(curr_sample_id)
-
-                requiring_hdf5_keys = _object_requires_hdf5_recurse(curr_sample)
-                if len(requiring_hdf5_keys) > 0:
-                    requiring_hdf5_dict = curr_sample.get_multi(requiring_hdf5_keys)
-                    requiring_hdf5_dict = requiring_hdf5_dict.flatten()
-
-                    hdf5_filename = os.path.join(write_dir, output_sample_hash + ".hdf5")
-                    save_hdf5_safe(hdf5_filename, **requiring_hdf5_dict)
-
-                    # remove all hdf5 entries from the sample_dict that will be pickled
-                    for k in requiring_hdf5_dict:
-                        _ = curr_sample.pop(k)
-
-                save_pickle_safe(curr_sample, os.path.join(write_dir, output_sample_hash + ".pkl.gz"), compress=True)
+                scalars[curr_sample_id] = self._extract_side_table_values(curr_sample)
+                locations[curr_sample_id] = self._storage.save_sample(write_dir, output_sample_hash, curr_sample)
         else:
             output_info = None
             # requiring_hdf5_keys = None
 
         save_pickle_safe(output_info, os.path.join(write_dir, was_processed_fn))
-        return output_info
+        return output_info, locations, scalars
+
+
+def _is_side_table_scalar(value: Any, max_str_len: int = 256) -> bool:
+    if isinstance(value, str):
+        return len(value) <= max_str_len
+    return isinstance(value, (bool, int, float, np.number, np.bool_))
+
+
+def _create_side_table(sample_scalars: Dict[Hashable, dict]) -> dict:
+    """
+    Converts scalar values per sample to a columnar table
+    :param sample_scalars: maps final sample id to a dict of scalar values
+    :return: a dict with "sample_ids" - a list of the final sample ids, "columns" - a dict mapping key to a numpy array of values, a value per sample,
+        and "numpy_columns" - the keys whose values are numpy scalars (the rest are python values).
+        Only keys available in all of the samples are included.
+        A column with values of mixed types is stored as an object array, to keep the original values (e.g. int and float).
+    """
+    sample_ids = list(sample_scalars.keys())
+    common_keys = None
+    for values in sample_scalars.values():
+        common_keys = set(values.keys()) if common_keys is None else common_keys.intersection(values.keys())
+    if common_keys is None:
+        common_keys = set()
+
+    columns = {}
+    numpy_columns = set()
+    for k in sorted(common_keys):
+        values = [sample_scalars[sid][k] for sid in sample_ids]
+        value_types = set(type(v) for v in values)
+        if len(value_types) == 1:
+            columns[k] = np.asarray(values)
+            if issubclass(value_types.pop(), np.generic):
+                numpy_columns.add(k)
+        else:  # avoid implicit conversion (e.g. int to float or numbers to strings)
+            columns[k] = np.empty(len(values), dtype=object)
+            columns[k][:] = values
+
+    return {"sample_ids": sample_ids, "columns": columns, "numpy_columns": numpy_columns}
 
 
 def _get_available_write_location(cache_dirs: List[str], max_allowed_used_space=None):
@@ -0,0 +1,184 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import os
+import tempfile
+import time
+import unittest
+from glob import glob
+from typing import List, Union
+
+import numpy as np
+
+from fuse.data import get_sample_id
+from fuse.data.cache import main
+from fuse.data.datasets.caching.cache_maintenance import (
+    drop_stale,
+    list_caches,
+    reclaim_temp_files,
+    repack,
+    verify_caches,
+)
+from fuse.data.datasets.caching.cache_storage import CacheStoragePackedShards
+from fuse.data.datasets.caching.samples_cacher import SamplesCacher
+from fuse.data.ops.op_base import OpBase
+from fuse.data.pipelines.pipeline_default import PipelineDefault
+from fuse.utils.ndict import NDict
+
+
+class OpFakeLoad(OpBase):
+    def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+        index = int(get_sample_id(sample_dict).split("_")[-1])
+        sample_dict["data.img"] = np.arange(1000, dtype=np.float32) * index
+        sample_dict["data.label"] = index % 2
+        return sample_dict
+
+
+class OpAdd(OpBase):
+    def __init__(self, value: float):
+        super().__init__()
+        self._value = value
+
+    def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+        sample_dict["data.img"] = sample_dict["data.img"] + self._value
+        return sample_dict
+
+
+class TestCacheMaintenance(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, "cache")
+        self.sample_ids = [f"case_{i}" for i in range(6)]
+
+    def _create_cacher(self, value: float, storage: CacheStoragePackedShards = None) -> SamplesCacher:
+        pl = PipelineDefault("test_pipeline", [(OpFakeLoad(), {}), (OpAdd(value), {})], op_ids=["load", "add"])
+        return SamplesCacher(
+            "test_cache", pl, self.cache_dir, checkpoint_op_ids=["load"], storage=storage, audit_first_sample=False
+        )
+
+    def test_list_and_drop_stale(self):
+        cacher = self._create_cacher(1.0)
+        cacher.cache_samples(self.sample_ids)
+        cacher.delete_cache()  # keeps the valid checkpoints
+        cacher = self._create_cacher(2.0)
+        cacher.cache_samples(self.sample_ids)
+        valid_dir = cacher._get_write_dir()
+        keep = [cacher._pipeline_desc_hash] + cacher._checkpoint_names
+        # a leftover of a previous pipeline, the most recently modified one - which must not make it valid
+        stale_dir = os.path.join(self.cache_dir, "test_cache", "hash_0")
+        os.makedirs(stale_dir)
+        os.utime(stale_dir, (time.time() + 3600, time.time() + 3600))
+
+        # unknown which of the pipeline hash dirs is valid
+        df = list_caches([self.cache_dir])
+        self.assertEqual(list(df["kind"]), ["pipeline", "pipeline", "checkpoint"])
+        self.assertEqual(list(df["stale"]), [None, None, False])
+        with self.assertRaises(Exception):
+            drop_stale([self.cache_dir], dry_run=True)
+        self.assertTrue(os.path.isdir(stale_dir))
+
+        df = list_caches([self.cache_dir], keep=keep)
+        self.assertEqual(list(df["stale"]), [True, False, False])
+        self.assertEqual(list(df["num_samples"]), [0, 6, 6])
+        self.assertGreater(df["size_bytes"][1], 6 * 4000)
+
+        self.assertEqual(drop_stale([self.cache_dir], keep=keep, dry_run=True), [stale_dir])
+        self.assertTrue(os.path.isdir(stale_dir))
+        self.assertEqual(main(["drop-stale", self.cache_dir, "--keep"] + keep), 0)
+        self.assertFalse(os.path.isdir(stale_dir))
+        self.assertTrue(os.path.isdir(valid_dir))
+        self.assertEqual(drop_stale([self.cache_dir]), [])
+
+    def test_drop_stale_for_new_pipeline(self):
+        cacher = self._create_cacher(1.0)
+        cacher.cache_samples(self.sample_ids)
+        old_dir = cacher._get_write_dir()
+        # the error reports the valid dirs of the new pipeline, which are not cached yet
+        with self.assertRaises(Exception) as context:
+            self._create_cacher(2.0)
+        keep = str(context.exception).split("--keep ")[1].split("\n")[0].split(" ")
+        self.assertTrue(keep[0].startswith("hash_"))
+
+        self.assertEqual(drop_stale([self.cache_dir], keep=keep), [old_dir])
+        self.assertEqual(len(glob(os.path.join(self.cache_dir, "test_cache", "checkpoints", "*"))), 1)
+        cacher = self._create_cacher(2.0)
+        cacher.cache_samples(self.sample_ids)
+        self.assertEqual(list(list_caches([self.cache_dir])["stale"]), [False, False])
+
+    def test_verify_and_reclaim(self):
+        cacher = self._create_cacher(1.0)
+        cacher.cache_samples(self.sample_ids)
+        self.assertEqual(verify_caches([self.cache_dir]), [])
+
+        hash_dir = cacher._get_write_dir()
+        # a partial write, a sample which was written without its marker (interrupted caching), and a corrupted sample
+        temp_file = os.path.join(hash_dir, "out_sample_id@" + "0" * 32 + ".pkl.gz" + "1" * 32 + ".scramlbed")
+        orphan_file = os.path.join(hash_dir, "out_sample_id@" + "1" * 32 + ".pkl.gz")
+        for filename in [temp_file, orphan_file]:
+            with open(filename, "wb") as f:
+                f.write(b"partial")
+        sample_file = glob(os.path.join(hash_dir, "out_sample_id@*.pkl.gz"))[0]
+        if sample_file == orphan_file:
+            sample_file = glob(os.path.join(hash_dir, "out_sample_id@*.pkl.gz"))[1]
+        with open(sample_file, "r+b") as f:
+            f.seek(20)
+            f.write(b"corrupted")
+        failures = verify_caches([self.cache_dir], workers=2)
+        failed_hashes = sorted(desc.split(" ")[0] for desc, _ in failures)
+        self.assertEqual(
+            failed_hashes, sorted(os.path.basename(f)[: -len(".pkl.gz")] for f in [orphan_file, sample_file])
+        )
+        self.assertEqual(main(["verify", self.cache_dir]), 1)
+
+        # recently modified files are expected to be kept
+        self.assertEqual(reclaim_temp_files([self.cache_dir])[0], [])
+        for filename in [temp_file, orphan_file]:
+            os.utime(filename, (0, 0))
+        files, total_bytes = reclaim_temp_files([self.cache_dir])
+        self.assertEqual(sorted(files), sorted([temp_file, orphan_file]))
+        self.assertEqual(total_bytes, 2 * len(b"partial"))
+        self.assertFalse(os.path.exists(temp_file))
+        self.assertTrue(os.path.exists(sample_file))
+
+    def test_repack(self):
+        cacher = self._create_cacher(1.0)
+        cacher.cache_samples(self.sample_ids)
+        expected = [cacher.load_sample(sid) for sid in self.sample_ids]
+
+        self.assertEqual(len(repack([self.cache_dir], dry_run=True)), 2)
+        repacked = repack([self.cache_dir])
+        self.assertEqual([info["num_samples"] for info in repacked], [6, 6])
+        self.assertEqual(len(glob(os.path.join(cacher._get_write_dir(), "out_sample_id@*"))), 0)
+        # already packed
+        self.assertEqual(repack([self.cache_dir]), [])
+        self.assertEqual(verify_caches([self.cache_dir]), [])
+        df = list_caches([self.cache_dir])
+        self.assertEqual(list(df["storage"]), ["packed_shards", "packed_shards"])
+
+        # both the samples index and the checkpoints are expected to be found in the shards
+        for value in [1.0, 3.0]:
+            cacher = self._create_cacher(value, storage=CacheStoragePackedShards())
+            cacher.cache_samples(self.sample_ids)
+            for sid, expected_sample in zip(self.sample_ids, expected):
+                sample = cacher.load_sample(sid)
+                self.assertTrue(np.array_equal(sample["data.img"], expected_sample["data.img"] + value - 1.0))
+                self.assertEqual(sample["data.label"], expected_sample["data.label"])
+            cacher.delete_cache()
+
+
+if __name__ == "__main__":
+    unittest.main()
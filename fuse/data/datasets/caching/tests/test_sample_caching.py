@@ -16,6 +16,7 @@ limitations under the License.
 """
 
 import unittest
+from unittest import mock
 
 from fuse.utils.rand.seed import Seed
 from fuse.data.pipelines.pipeline_default import PipelineDefault
@@ -23,9 +24,20 @@ from fuse.data import get_sample_id, create_initial_sample
 import numpy as np
 import tempfile
 import os
+import getpass
+import pickle
+from glob import glob
 from fuse.data.ops.op_base import OpBase
 from typing import List, Union
+from fuse.data.datasets.caching import cache_storage, samples_cacher
 from fuse.data.datasets.caching.samples_cacher import SamplesCacher
+from fuse.data.datasets.caching.cache_storage import (
+    CacheStoragePackedShards,
+    CacheStorageDirectory,
+    CacheStorageSharedMemory,
+    CacheStorageTiered,
+)
+from fuse.data.datasets.caching.codecs_benchmark import benchmark_cache_codecs
 
 from fuse.utils.ndict import NDict
 
@@ -55,6 +67,16 @@ class OpFakeLoad(OpBase):
         return sample_dict
 
 
+class OpScaleImg(OpBase):
+    def __init__(self, factor: float):
+        super().__init__()
+        self._factor = factor
+
+    def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+        sample_dict["data.cc.img"] = sample_dict["data.cc.img"] * self._factor
+        return sample_dict
+
+
 class TestSampleCaching(unittest.TestCase):
     """
     Test sample caching
@@ -113,6 +135,445 @@ class TestSampleCaching(unittest.TestCase):
         pl = PipelineDefault("example_pipeline", pipeline_desc)
         self.assertRaises(Exception, SamplesCacher, "unittests_cache", pl, cache_dirs, restart_cache=False)
 
+    def test_cache_samples_packed_shards(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_e"),
+        ]
+
+        pipeline_desc = [
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        for workers in [0, 2]:
+            cacher = SamplesCacher(
+                "unittests_cache",
+                pl,
+                cache_dirs,
+                restart_cache=True,
+                workers=workers,
+                storage=CacheStoragePackedShards(max_shard_size_bytes=10**6),
+            )
+            cacher.cache_samples(orig_sample_ids)
+
+            write_dir = cacher._get_write_dir()
+            shards = [f for f in os.listdir(write_dir) if f.startswith(CacheStoragePackedShards.SHARD_PREFIX)]
+            self.assertGreater(len(shards), 0)
+            self.assertFalse(any(f.endswith(".pkl.gz") for f in os.listdir(write_dir)))
+
+            sample = cacher.load_sample("case_1")
+            expected = _generate_sample_1()
+            self.assertTrue(np.array_equal(sample["data.cc.img"], expected["data.cc.img"]))
+            self.assertEqual(sample["data.cc.dicom_tags"], expected["data.cc.dicom_tags"])
+            sample = cacher.load_sample("case_4_subcase_2")
+            expected = _generate_sample_2(42)
+            self.assertTrue(np.array_equal(sample["data.mlo.seg"], expected["data.mlo.seg"]))
+            self.assertEqual(get_sample_id(sample), "case_4_subcase_2")
+
+    def test_samples_index(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_f"),
+            os.path.join(tmpdir, "cache_g"),
+        ]
+
+        pipeline_desc = [
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        for storage in [None, CacheStoragePackedShards()]:
+            cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True, storage=storage)
+            cacher.cache_samples(orig_sample_ids)
+
+            # loading an already cached set of samples should load the index as well
+            cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=False, storage=storage)
+            cacher.cache_samples(orig_sample_ids)
+            self.assertEqual(
+                set(cacher._samples_index.keys()), {"case_1", "case_2", "case_4_subcase_1", "case_4_subcase_2"}
+            )
+
+            # no filesystem probing is expected when loading an indexed sample
+            with mock.patch("os.path.isfile", side_effect=AssertionError("unexpected os.path.isfile call")):
+                sample = cacher.load_sample("case_4_subcase_1")
+            self.assertEqual(get_sample_id(sample), "case_4_subcase_1")
+
+    def test_load_sample_keys(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_h"),
+        ]
+
+        pipeline_desc = [
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        for storage in [None, CacheStoragePackedShards(), CacheStoragePackedShards(codec="gzip")]:
+            cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True, storage=storage)
+            cacher.cache_samples(orig_sample_ids)
+
+            sample = cacher.load_sample("case_2", keys=["data.gt_labels_style_1", "data.cc"])
+            self.assertEqual(
+                set(sample.keys()),
+                {
+                    "data.sample_id",
+                    "data.initial_sample_id",
+                    "data.gt_labels_style_1",
+                    "data.cc.img",
+                    "data.cc.seg",
+                    "data.cc.dicom_tags",
+                },
+            )
+            expected = _generate_sample_2()
+            self.assertTrue(np.array_equal(sample["data.cc.img"], expected["data.cc.img"]))
+            self.assertEqual(sample["data.gt_labels_style_1"], expected["data.gt_labels_style_1"])
+
+            full_sample = cacher.load_sample("case_2")
+            self.assertIn("data.mlo.img", full_sample)
+
+    def test_memmap_keys(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_i"),
+        ]
+
+        pipeline_desc = [
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        for storage in [
+            CacheStorageDirectory(memmap_keys=["data.cc"]),
+            CacheStoragePackedShards(memmap_keys=["data.cc"]),
+        ]:
+            cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True, storage=storage)
+            cacher.cache_samples(orig_sample_ids)
+
+            expected = _generate_sample_1()
+            sample = cacher.load_sample("case_1")
+            self.assertIsInstance(sample["data.cc.img"], np.memmap)
+            self.assertIsInstance(sample["data.cc.seg"], np.memmap)
+            self.assertNotIsInstance(sample["data.mlo.img"], np.memmap)
+            self.assertTrue(np.array_equal(sample["data.cc.img"], expected["data.cc.img"]))
+            self.assertTrue(np.array_equal(sample["data.mlo.seg"], expected["data.mlo.seg"]))
+            self.assertEqual(sample["data.cc.dicom_tags"], expected["data.cc.dicom_tags"])
+
+            # modifying the loaded array is not expected to modify the cache
+            sample["data.cc.img"][:] = 0
+            sample = cacher.load_sample("case_1", keys=["data.cc.img"])
+            self.assertTrue(np.array_equal(sample["data.cc.img"], expected["data.cc.img"]))
+            self.assertNotIn("data.cc.seg", sample)
+
+    def test_codecs(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        pipeline_desc = [
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        for codec in ["none", "gzip", "lz4", "zstd"]:
+            for storage in [
+                CacheStorageDirectory(codec=codec, hdf5_blosc_kwargs=dict(cname="zstd", clevel=3)),
+                CacheStoragePackedShards(codec=codec, codec_level=1),
+            ]:
+                cache_dirs = [os.path.join(tmpdir, f"cache_j_{codec}_{type(storage).__name__}")]
+                cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True, storage=storage)
+                cacher.cache_samples(orig_sample_ids)
+
+                expected = _generate_sample_2()
+                sample = cacher.load_sample("case_2")
+                self.assertTrue(np.array_equal(sample["data.cc.img"], expected["data.cc.img"]))
+                self.assertEqual(sample["data.mlo.dicom_tags"], expected["data.mlo.dicom_tags"])
+
+                # the codec is recorded with the stored samples, so a reader with a different codec can read them
+                reader_storage = type(storage)()
+                reader = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=False, storage=reader_storage)
+                reader.cache_samples(orig_sample_ids)
+                sample = reader.load_sample("case_4_subcase_1", keys=["data.gt_labels_style_1"])
+                self.assertEqual(sample["data.gt_labels_style_1"], _generate_sample_1(41)["data.gt_labels_style_1"])
+
+        self.assertRaises(Exception, CacheStorageDirectory, codec="banana")
+
+    def test_incremental_caching(self):
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_k"),
+        ]
+        pipeline_desc = [
+            (OpFakeLoad(), {}),
+        ]
+        pl = PipelineDefault("example_pipeline", pipeline_desc)
+
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True, incremental=True)
+        cacher.cache_samples(["case_1", "case_3"])
+
+        cacher = SamplesCacher(
+            "unittests_cache", pl, cache_dirs, restart_cache=False, side_table_keys=["data.sample_id"], incremental=True
+        )
+        with mock.patch.object(samples_cacher, "run_multiprocessed", wraps=samples_cacher.run_multiprocessed) as mocked:
+            orig_sid_to_final = cacher.cache_samples(["case_1", "case_2", "case_3", "case_4"])
+        # only the new sample ids are expected to be processed, and the side table values of the rest are collected
+        self.assertEqual(mocked.call_args_list[0][0][1], ["case_2", "case_4"])
+        self.assertEqual(mocked.call_args_list[1][0][1], ["case_1"])
+        self.assertEqual(orig_sid_to_final["case_3"], None)
+        self.assertEqual(orig_sid_to_final["case_4"], ["case_4_subcase_1", "case_4_subcase_2"])
+        self.assertEqual(
+            list(cacher.get_side_table_values(["case_1", "case_4_subcase_2"], ["data.sample_id"])["data.sample_id"]),
+            ["case_1", "case_4_subcase_2"],
+        )
+        sample = cacher.load_sample("case_2")
+        self.assertTrue(np.array_equal(sample["data.cc.img"], _generate_sample_2()["data.cc.img"]))
+
+        # all of the sample ids are already processed
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=False, incremental=True)
+        with mock.patch.object(samples_cacher, "run_multiprocessed", side_effect=AssertionError("unexpected")):
+            orig_sid_to_final = cacher.cache_samples(["case_4", "case_2"])
+        self.assertEqual(orig_sid_to_final["case_2"], ["case_2"])
+
+    def test_already_processed_samples(self):
+        tmpdir = tempfile.mkdtemp()
+        pl = PipelineDefault("example_pipeline", [(OpFakeLoad(), {})])
+
+        # not incremental - the already processed samples are found by the per sample info
+        cache_dirs = [os.path.join(tmpdir, "cache_not_incremental")]
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True, incremental=False)
+        cacher.cache_samples(["case_1"])
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=False, incremental=False)
+        orig_sid_to_final = cacher.cache_samples(["case_1", "case_2"])
+        self.assertEqual(orig_sid_to_final["case_1"], ["case_1"])
+        self.assertEqual(orig_sid_to_final["case_2"], ["case_2"])
+        # no index is written
+        sets_info_files = glob(os.path.join(cache_dirs[0], "unittests_cache", "*", "full_sets_info", "*"))
+        self.assertFalse(
+            any(os.path.basename(f).startswith(samples_cacher.PROCESSED_INDEX_PREFIX) for f in sets_info_files)
+        )
+
+        # an incremental cacher uses a cache that was built without the index
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=False, incremental=True)
+        with mock.patch.object(samples_cacher, "run_multiprocessed", wraps=samples_cacher.run_multiprocessed) as mocked:
+            orig_sid_to_final = cacher.cache_samples(["case_1", "case_2", "case_3"])
+        self.assertEqual(mocked.call_args_list[0][0][1], ["case_1", "case_2", "case_3"])
+        self.assertEqual(orig_sid_to_final["case_2"], ["case_2"])
+        self.assertEqual(orig_sid_to_final["case_3"], None)
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=False, incremental=True)
+        with mock.patch.object(samples_cacher, "run_multiprocessed", side_effect=AssertionError("unexpected")):
+            orig_sid_to_final = cacher.cache_samples(["case_3", "case_1"])
+        self.assertEqual(orig_sid_to_final["case_1"], ["case_1"])
+        self.assertEqual(orig_sid_to_final["case_3"], None)
+
+        # a cache created before the index of the processed samples was introduced
+        cache_dirs = [os.path.join(tmpdir, "cache_legacy")]
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True, incremental=True)
+        cacher.cache_samples(["case_1", "case_4"])
+        sets_info_files = glob(os.path.join(cache_dirs[0], "unittests_cache", "*", "full_sets_info", "*"))
+        self.assertGreater(len(sets_info_files), 0)
+        for filename in sets_info_files:
+            os.remove(filename)
+        for side_table_keys in [None, ["data.sample_id"]]:
+            cacher = SamplesCacher(
+                "unittests_cache",
+                pl,
+                cache_dirs,
+                restart_cache=False,
+                side_table_keys=side_table_keys,
+                incremental=True,
+            )
+            orig_sid_to_final = cacher.cache_samples(["case_1", "case_2", "case_4"])
+            self.assertEqual(orig_sid_to_final["case_4"], ["case_4_subcase_1", "case_4_subcase_2"])
+        self.assertEqual(
+            list(cacher.get_side_table_values(["case_4_subcase_1", "case_2"], ["data.sample_id"])["data.sample_id"]),
+            ["case_4_subcase_1", "case_2"],
+        )
+
+    def test_checkpoints(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_l"),
+        ]
+
+        for storage in [CacheStorageDirectory(), CacheStoragePackedShards()]:
+            pl = PipelineDefault(
+                "example_pipeline", [(OpFakeLoad(), {}), (OpScaleImg(2.0), {})], op_ids=["load", "scale"]
+            )
+            cacher = SamplesCacher(
+                "unittests_cache", pl, cache_dirs, restart_cache=True, storage=storage, checkpoint_op_ids=["load"]
+            )
+            cacher.cache_samples(orig_sample_ids)
+            sample = cacher.load_sample("case_2")
+            self.assertTrue(np.allclose(sample["data.cc.img"], _generate_sample_2()["data.cc.img"] * 2.0))
+
+            # modify the last op - the samples are expected to be processed starting from the checkpoint
+            pl = PipelineDefault(
+                "example_pipeline", [(OpFakeLoad(), {}), (OpScaleImg(3.0), {})], op_ids=["load", "scale"]
+            )
+            self.assertRaises(Exception, SamplesCacher, "unittests_cache", pl, cache_dirs, restart_cache=False)
+            cacher = SamplesCacher(
+                "unittests_cache",
+                pl,
+                cache_dirs,
+                restart_cache=True,
+                storage=storage,
+                checkpoint_op_ids=["load"],
+                audit_first_sample=False,
+                audit_rate=None,
+            )
+            with mock.patch.object(OpFakeLoad, "__call__", side_effect=AssertionError("unexpected loading")):
+                orig_sid_to_final = cacher.cache_samples(orig_sample_ids)
+            self.assertIsNone(orig_sid_to_final["case_3"])
+            self.assertEqual(orig_sid_to_final["case_4"], ["case_4_subcase_1", "case_4_subcase_2"])
+            sample = cacher.load_sample("case_4_subcase_2")
+            self.assertTrue(np.allclose(sample["data.cc.img"], _generate_sample_2(42)["data.cc.img"] * 3.0))
+
+            # modifying the first op invalidates the checkpoint
+            pl = PipelineDefault(
+                "example_pipeline", [(OpFakeLoad(), {"unused": 1}), (OpScaleImg(3.0), {})], op_ids=["load", "scale"]
+            )
+            cacher = SamplesCacher(
+                "unittests_cache", pl, cache_dirs, restart_cache=True, storage=storage, checkpoint_op_ids=["load"]
+            )
+            self.assertEqual(os.listdir(os.path.join(cache_dirs[0], "unittests_cache", "checkpoints")), [])
+
+    def test_tiered_storage(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_m"),
+        ]
+        fast_tier_dir = os.path.join(tmpdir, "fast_tier")
+        pl = PipelineDefault("example_pipeline", [(OpFakeLoad(), {})])
+
+        # enough for a single sample
+        storage = CacheStorageTiered(
+            fast_tier_dir, fast_tier_max_bytes=40 * 2**20, slow_tier_storage=CacheStoragePackedShards()
+        )
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True, storage=storage)
+        cacher.cache_samples(orig_sample_ids)
+
+        expected = _generate_sample_1()
+        for _ in range(3):
+            sample = cacher.load_sample("case_1")
+            self.assertTrue(np.array_equal(sample["data.cc.img"], expected["data.cc.img"]))
+        self.assertEqual(storage.get_stats()["misses"], 1)
+        self.assertEqual(storage.get_stats()["hits"], 2)
+        self.assertEqual(len(os.listdir(fast_tier_dir)), 1)
+
+        sample = cacher.load_sample("case_2", keys=["data.gt_labels_style_1"])
+        self.assertEqual(sample["data.gt_labels_style_1"], _generate_sample_2()["data.gt_labels_style_1"])
+        sample = cacher.load_sample("case_2", keys=["data.gt_labels_style_1"])
+        stats = storage.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (3, 2, 1))
+        self.assertEqual(len(os.listdir(fast_tier_dir)), 1)
+
+        # a located sample (e.g. in a cache without an index) is expected to have the same name in the fast tier
+        sample_hash = SamplesCacher.get_final_sample_id_hash("case_2")
+        location = cacher._samples_index["case_2"]
+        self.assertEqual(storage.locate(cacher._get_read_dirs(), sample_hash), location)
+
+        # a rebuilt cache is not expected to use the fast tier copies of the previous cache
+        storage = CacheStorageTiered(
+            fast_tier_dir, fast_tier_max_bytes=40 * 2**20, slow_tier_storage=CacheStoragePackedShards()
+        )
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True, storage=storage)
+        cacher.cache_samples(orig_sample_ids)
+        self.assertNotEqual(storage.locate(cacher._get_read_dirs(), sample_hash)[0], location[0])
+        cacher.load_sample("case_2")
+        self.assertEqual(storage.get_stats()["misses"], 1)
+
+    def test_shared_memory_storage(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_s"),
+        ]
+        pl = PipelineDefault("example_pipeline", [(OpFakeLoad(), {})])
+
+        storage = CacheStorageSharedMemory(max_bytes=100 * 2**20, shm_dir=os.path.join(tmpdir, "shm"))
+        cacher = SamplesCacher("unittests_cache", pl, cache_dirs, restart_cache=True, storage=storage)
+        cacher.cache_samples(orig_sample_ids)
+
+        expected = _generate_sample_1()
+        for _ in range(2):
+            sample = cacher.load_sample("case_1")
+            self.assertTrue(np.array_equal(sample["data.cc.img"], expected["data.cc.img"]))
+            self.assertEqual(sample["data.cc.dicom_tags"], expected["data.cc.dicom_tags"])
+        self.assertEqual((storage.get_stats()["hits"], storage.get_stats()["misses"]), (1, 1))
+        # the arrays are expected to be mapped, and modifications to be private to the reader
+        self.assertIsNotNone(sample["data.cc.img"].base)
+        sample["data.cc.img"][:] = 0
+        sample = cacher.load_sample("case_1")
+        self.assertTrue(np.array_equal(sample["data.cc.img"], expected["data.cc.img"]))
+
+        storage.clear()
+        cacher.load_sample("case_1")
+        self.assertEqual(storage.get_stats()["misses"], 2)
+
+        # the default directory is per user
+        default_dir = CacheStorageSharedMemory(max_bytes=2**20)._fast_tier_dir
+        self.assertEqual(os.path.basename(default_dir), f"fuse_samples_cache_{getpass.getuser()}")
+
+    def test_shared_memory_storage_without_pickle5(self):
+        # python 3.7 - the arrays are stored raw without pickle protocol 5
+        tmpdir = tempfile.mkdtemp()
+        pl = PipelineDefault("example_pipeline", [(OpFakeLoad(), {})])
+        storage = CacheStorageSharedMemory(max_bytes=100 * 2**20, shm_dir=os.path.join(tmpdir, "shm"))
+        cacher = SamplesCacher(
+            "unittests_cache", pl, os.path.join(tmpdir, "cache"), restart_cache=True, storage=storage
+        )
+        cacher.cache_samples(["case_1", "case_2"])
+
+        expected = _generate_sample_1()
+        with mock.patch.object(cache_storage, "_PICKLE_OUT_OF_BAND_SUPPORTED", False), mock.patch(
+            "pickle.dumps", wraps=pickle.dumps
+        ) as dumps:
+            for _ in range(2):
+                sample = cacher.load_sample("case_1")
+                self.assertTrue(set(expected.keys()) <= set(sample.keys()))
+                self.assertTrue(np.array_equal(sample["data.cc.img"], expected["data.cc.img"]))
+                self.assertEqual(sample["data.cc.dicom_tags"], expected["data.cc.dicom_tags"])
+            self.assertTrue(all("buffer_callback" not in call.kwargs for call in dumps.call_args_list))
+        self.assertEqual((storage.get_stats()["hits"], storage.get_stats()["misses"]), (1, 1))
+        self.assertIsNotNone(sample["data.cc.img"].base)
+        sample["data.cc.img"][:] = 0
+        sample = cacher.load_sample("case_1")
+        self.assertTrue(np.array_equal(sample["data.cc.img"], expected["data.cc.img"]))
+
+    def test_prefetch(self):
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        tmpdir = tempfile.mkdtemp()
+        pl = PipelineDefault("example_pipeline", [(OpFakeLoad(), {})])
+        for slow_tier_storage in [CacheStorageDirectory(memmap_keys=["data.cc.img"]), CacheStoragePackedShards()]:
+            storage = CacheStorageTiered(
+                os.path.join(tmpdir, "fast_tier"),
+                fast_tier_max_bytes=100 * 2**20,
+                slow_tier_storage=slow_tier_storage,
+            )
+            cacher = SamplesCacher(
+                "unittests_cache", pl, [os.path.join(tmpdir, "cache_p")], restart_cache=True, storage=storage
+            )
+            cacher.cache_samples(orig_sample_ids)
+
+            # warming the page cache of the slow tier is expected to work as well
+            slow_tier_storage.prefetch(cacher._samples_index["case_1"][1])
+            cacher.prefetch_sample("case_1")
+            cacher.prefetch_sample("case_1")
+            sample = cacher.load_sample("case_1")
+            self.assertTrue(np.array_equal(sample["data.cc.img"], _generate_sample_1()["data.cc.img"]))
+            stats = storage.get_stats()
+            self.assertEqual((stats["prefetches"], stats["hits"], stats["misses"]), (1, 1, 0))
+
+    def test_benchmark_cache_codecs(self):
+        df = benchmark_cache_codecs([_generate_sample_2()], codecs=[("none", None), ("gzip", 1)], repeats=1)
+        self.assertEqual(list(df["codec"]), ["none", "gzip"])
+        self.assertLess(df["size_bytes"][1], df["size_bytes"][0])
+
     def tearDown(self):
         pass
 
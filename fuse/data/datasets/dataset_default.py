@@ -16,7 +16,7 @@ Created on June 30, 2021
 
 """
 
-from typing import Dict, Hashable, List, Optional, Sequence, Union, Any
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Union, Any
 
 from warnings import warn
 from fuse.data.datasets.dataset_base import DatasetBase
@@ -29,10 +29,13 @@ from fuse.utils.multiprocessing.run_multiprocessed import (
     get_from_global_storage,
 )
 from fuse.data import get_sample_id, create_initial_sample, get_specific_sample_from_potentially_morphed
-import copy
 from collections import OrderedDict
 import numpy as np
 from operator import itemgetter
+import time
+import uuid
+from fuse.data.utils import profiling
+from fuse.data.utils.sample_ids import SampleIdsArray, copy_sample_ids
 
 
 class DatasetDefault(DatasetBase):
@@ -43,9 +46,12 @@ class DatasetDefault(DatasetBase):
         dynamic_pipeline: Optional[PipelineDefault] = None,
         cacher: Optional[SamplesCacher] = None,
         allow_uncached_sample_morphing: bool = False,
+        batch_collate_fn: Optional[Callable] = None,
     ):
         """
         :param sample_ids: list of sample_ids included in dataset. Or:
+                - A SampleIdsArray (see fuse.data.utils.sample_ids) - a compact representation of integer or string sample ids.
+                    recommended for datasets with millions of samples - shared without copying by the dataset and subset().
                 - An integer that describes only the size of the dataset. This is useful in massive datasets
                     (for example 100M samples). In such case, multiple functionalities will not be supported, mainly -
                     cacher, allow_uncached_sample_morphing and get_all_sample_ids
@@ -58,6 +64,10 @@ class DatasetDefault(DatasetBase):
                                 changing it will NOT trigger recaching of the static_pipeline part.
         :param cacher: optional SamplesCacher instance which will be used for caching samples to speed up samples loading
         :param allow_uncached_sample_morphing:  when enabled, allows an Op, to return None, or to return multiple samples (in a list)
+        :param batch_collate_fn: optional, enables batch mode - a collate function (typically CollateDefault()) used by __getitems__().
+                                In batch mode, the ops at the end of the dynamic pipeline that support batch mode (see OpBase.supports_batch())
+                                are applied once on the collated batch instead of once per sample.
+                                The DataLoader then gets an already collated batch - CollateDefault passes it through as is.
 
         """
         super().__init__()
@@ -79,6 +89,7 @@ class DatasetDefault(DatasetBase):
 
         # self._orig_sample_ids = sample_ids
         self._allow_uncached_sample_morphing = allow_uncached_sample_morphing
+        self._batch_collate_fn = batch_collate_fn
 
         # verify unique names for dynamic pipelines
         if dynamic_pipeline is not None and static_pipeline is not None:
@@ -109,7 +120,7 @@ class DatasetDefault(DatasetBase):
 
         self._static_pipeline = static_pipeline
         self._dynamic_pipeline = dynamic_pipeline
-        self._orig_sample_ids = copy.deepcopy(sample_ids)
+        self._orig_sample_ids = copy_sample_ids(sample_ids)
 
         self._created = False
 
@@ -155,14 +166,30 @@ class DatasetDefault(DatasetBase):
 
         if self._output_sample_ids_info is not None:  # sample morphing is allowed
             self._final_sample_ids = []
+            morphed = False
             for orig_sid, out_sids in self._output_sample_ids_info.items():
                 if out_sids is None:
+                    morphed = True
                     continue
+                if len(out_sids) != 1 or out_sids[0] != orig_sid:
+                    morphed = True
                 self._final_sample_ids.extend(out_sids)
+            if isinstance(self._orig_sample_ids, SampleIdsArray):
+                # keep the compact representation, unless the morphed sample ids can't be represented by it
+                if not morphed:
+                    self._final_sample_ids = self._orig_sample_ids
+                elif SampleIdsArray.is_supported(self._final_sample_ids):
+                    self._final_sample_ids = SampleIdsArray.from_iterable(self._final_sample_ids)
         else:
             self._final_sample_ids = self._orig_sample_ids
 
         self._orig_sample_ids = None  # should not be use after create. use self._final_sample_ids instead
+
+        # resolve the ops once, instead of per sample (see PipelineDefault.compile())
+        self._static_pipeline_compiled = self._static_pipeline.compile()
+        self._dynamic_pipeline_compiled = self._dynamic_pipeline.compile()
+        # identifies the state of the dataset, used to reuse the copy of the dataset in persistent pool workers (see get_multi())
+        self._state_id = uuid.uuid4().hex
         self._created = True
 
     def get_all_sample_ids(self) -> List[Any]:
@@ -172,7 +199,7 @@ class DatasetDefault(DatasetBase):
         if self._sample_ids_mode != "explicit":
             raise Exception("get_all_sample_ids is not supported when constructed with non explicit sample_ids")
 
-        return copy.deepcopy(self._final_sample_ids)
+        return copy_sample_ids(self._final_sample_ids)
 
     def __getitem__(self, item: Union[int, Hashable]) -> NDict:
         """
@@ -197,7 +224,75 @@ class DatasetDefault(DatasetBase):
         """
         if not self._created:
             raise Exception("you must first call create()")
+        start_time = time.perf_counter()
+
+        # get collect marker info
+        collect_marker_info = self._get_collect_marker_info(collect_marker_name)
+
+        sample = self._get_static_sample(item, collect_marker_info["static_keys_deps"])
+
+        sample = self._dynamic_pipeline_compiled(sample, until_op_id=collect_marker_info["op_id"])
+
+        if not isinstance(sample, dict):
+            raise Exception(
+                f"The final output of dataset static (+optional dynamic) pipelines is expected to be a dict. Instead got {type(sample)}"
+            )
+
+        # get just required keys
+        if keys is not None:
+            sample = sample.get_multi(keys)
+
+        profiling.record("dataset.getitem", time.perf_counter() - start_time)
+        return sample
+
+    def __getitems__(self, items: Sequence[Union[int, Hashable]]) -> Union[List[NDict], NDict]:
+        """
+        Get a batch of samples, used by the DataLoader when batching is enabled.
+        :param items: sample indices or sample ids
+        :return: a list of sample_dicts, or if batch mode is enabled (see batch_collate_fn), the collated batch_dict
+        """
+        if self._batch_collate_fn is None:
+            return [self[item] for item in items]
+
+        if not self._created:
+            raise Exception("you must first call create()")
+        start_time = time.perf_counter()
+
+        op_ids = self._dynamic_pipeline.get_op_ids()
+        batch_start_index = self._dynamic_pipeline.get_batch_start_index()
+
+        # apply per sample the ops that do not support batch mode
+        samples = []
+        for item in items:
+            sample = self._get_static_sample(item)
+            if batch_start_index > 0:
+                sample = self._dynamic_pipeline_compiled(sample, until_op_id=op_ids[batch_start_index - 1])
+            if not isinstance(sample, dict):
+                raise Exception(
+                    f"The final output of dataset static (+optional dynamic) pipelines is expected to be a dict. Instead got {type(sample)}"
+                )
+            samples.append(sample)
+
+        batch_dict = self._batch_collate_fn(samples)
+
+        # apply the rest of the ops once on the entire batch
+        if batch_start_index < len(op_ids):
+            batch_dict = self._dynamic_pipeline.call_batch(
+                batch_dict,
+                None,
+                [{}] * len(samples),
+                start_after_op_id=op_ids[batch_start_index - 1] if batch_start_index > 0 else None,
+            )
 
+        profiling.record("dataset.getitems", time.perf_counter() - start_time)
+        return batch_dict
+
+    def _get_static_sample(self, item: Union[int, Hashable], static_keys_deps: Optional[Sequence[str]] = None) -> NDict:
+        """
+        Get the output of the static pipeline, read from cache if possible
+        :param item: either int representing sample index or sample_id
+        :param static_keys_deps: Optional, the keys to read from the cache
+        """
         # get sample id
         if self._sample_ids_mode != "explicit":
             sample_id = item
@@ -210,17 +305,14 @@ class DatasetDefault(DatasetBase):
         else:
             sample_id = self._final_sample_ids[item]
 
-        # get collect marker info
-        collect_marker_info = self._get_collect_marker_info(collect_marker_name)
-
         # read sample
         if self._cacher is not None:
-            sample = self._cacher.load_sample(sample_id, collect_marker_info["static_keys_deps"])
+            sample = self._cacher.load_sample(sample_id, static_keys_deps)
 
         if self._cacher is None:
             if not self._allow_uncached_sample_morphing:
                 sample = create_initial_sample(sample_id)
-                sample = self._static_pipeline(sample)
+                sample = self._static_pipeline_compiled(sample)
                 if not isinstance(sample, dict):
                     raise Exception(
                         f'By default when caching is disabled sample morphing is not allowed, and the output of the static pipeline is expected to be a dict. Instead got {type(sample)}. You can use "allow_uncached_sample_morphing=True" to allow this, but be aware it is slow and should be used only for debugging'
@@ -228,24 +320,28 @@ class DatasetDefault(DatasetBase):
             else:
                 orig_sid = self._final_sid_to_orig_sid[sample_id]
                 sample = create_initial_sample(orig_sid)
-                sample = self._static_pipeline(sample)
+                sample = self._static_pipeline_compiled(sample)
 
                 assert sample is not None
                 sample = get_specific_sample_from_potentially_morphed(sample, sample_id)
 
-        sample = self._dynamic_pipeline(sample, until_op_id=collect_marker_info["op_id"])
-
-        if not isinstance(sample, dict):
-            raise Exception(
-                f"The final output of dataset static (+optional dynamic) pipelines is expected to be a dict. Instead got {type(sample)}"
-            )
-
-        # get just required keys
-        if keys is not None:
-            sample = sample.get_multi(keys)
-
         return sample
 
+    def prefetch(self, items: Sequence[Union[int, Hashable]]) -> None:
+        """
+        A hint that the given items are about to be read - warms the cache of the samples (see SamplesCacher.prefetch_sample).
+        Does nothing when the dataset is not cached.
+        Blocking, usually called from a background thread, see fuse.data.utils.samplers.PrefetchingSampler.
+        :param items: sample indices or sample ids
+        """
+        if not self._created:
+            raise Exception("you must first call create()")
+        if self._cacher is None:
+            return
+        for item in items:
+            sample_id = self._final_sample_ids[item] if isinstance(item, (int, np.integer)) else item
+            self._cacher.prefetch_sample(sample_id)
+
     def _get_multi_multiprocess_func(self, args: Any) -> Any:
         sid, kwargs = args
         return self.getitem(sid, **kwargs)
@@ -266,18 +362,30 @@ class DatasetDefault(DatasetBase):
         verbose: int = 1,
         mp_context: Optional[str] = None,
         desc: str = "dataset_default.get_multi",
+        persistent_pool: bool = False,
+        chunksize: Union[int, str] = 1,
+        shared_memory_results: bool = False,
         **kwargs: Any,
     ) -> List[Dict]:
         """
         See super class
         :param workers: number of processes to read the data. set to 0 to not use multi processing (useful when debugging).
         :param mp_context: "fork", "spawn", "thread" or None for multiprocessing default
+        :param persistent_pool: reuse warm worker processes, which keep a copy of the dataset between calls (see run_multiprocessed()).
+                                Recommended when get_multi() is called repeatedly, for example by samplers of multiple folds.
+        :param chunksize: the number of samples sent to a worker at once, or "guided" (see run_multiprocessed())
+        :param shared_memory_results: return the large numpy arrays of the samples from the workers through shared memory (see run_multiprocessed())
         """
         if items is None:
             sample_ids = list(range(len(self)))
         else:
             sample_ids = items
 
+        # try first to collect the values from the cacher side table, without loading the samples
+        list_sample_dict = self._get_multi_from_side_table(sample_ids, **kwargs)
+        if list_sample_dict is not None:
+            return list_sample_dict
+
         for_global_storage = {"dataset_default_get_multi_dataset": self, "dataset_default_get_multi_kwargs": kwargs}
 
         list_sample_dict = run_multiprocessed(
@@ -288,9 +396,41 @@ class DatasetDefault(DatasetBase):
             verbose=verbose,
             mp_context=mp_context,
             desc=desc,
+            chunksize=chunksize,
+            persistent_pool=persistent_pool,
+            global_storage_key=f"dataset_default_get_multi@{self._state_id}@{kwargs!r}",
+            shared_memory_results=shared_memory_results,
         )
         return list_sample_dict
 
+    def _get_multi_from_side_table(
+        self,
+        items: Sequence[Union[int, Hashable]],
+        collect_marker_name: Optional[str] = None,
+        keys: Optional[Sequence[str]] = None,
+    ) -> Optional[List[Dict]]:
+        """
+        Get the required keys of multiple samples from the cacher side table (see side_table_keys in SamplesCacher).
+        Supported only when the dynamic pipeline (or the part of it that runs until the collect marker) can't modify the values.
+        :return: list of sample dicts or None if not supported
+        """
+        if self._cacher is None or keys is None or self._sample_ids_mode != "explicit":
+            return None
+
+        collect_marker_info = self._get_collect_marker_info(collect_marker_name)
+        for op, op_id in zip(self._dynamic_pipeline.ops, self._dynamic_pipeline._op_ids):
+            if not isinstance(op, OpCollectMarker):
+                return None
+            if op_id == collect_marker_info["op_id"]:
+                break
+
+        sample_ids = [self._final_sample_ids[item] if isinstance(item, (int, np.integer)) else item for item in items]
+        values = self._cacher.get_side_table_values(sample_ids, keys, to_list=True)
+        if values is None:
+            return None
+
+        return [NDict({k: values[k][i] for k in keys}) for i in range(len(sample_ids))]
+
     def __len__(self) -> int:
         if not self._created:
             raise Exception("you must first call create()")
@@ -342,7 +482,7 @@ class DatasetDefault(DatasetBase):
 
         # find the required collect markers and extract the info
         collect_marker_info = None
-        for (op, _), op_id in reversed(zip(self._dynamic_pipeline.ops_and_kwargs, self._dynamic_pipeline._op_ids)):
+        for op, op_id in reversed(list(zip(self._dynamic_pipeline.ops, self._dynamic_pipeline._op_ids))):
             if isinstance(op, OpCollectMarker):
                 collect_marker_info_cur = op.get_info()
                 if collect_marker_info_cur["name"] == collect_marker_name:
@@ -388,4 +528,8 @@ class DatasetDefault(DatasetBase):
             raise Exception("you must first call create()")
 
         # grab the specified data
-        self._final_sample_ids = itemgetter(*indices)(self._final_sample_ids)
+        if isinstance(self._final_sample_ids, SampleIdsArray):
+            self._final_sample_ids = self._final_sample_ids.take(indices)
+        else:
+            self._final_sample_ids = itemgetter(*indices)(self._final_sample_ids)
+        self._state_id = uuid.uuid4().hex
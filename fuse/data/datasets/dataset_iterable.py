@@ -0,0 +1,208 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import random
+from glob import glob
+from itertools import islice
+from typing import Callable, Hashable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+
+from fuse.data import create_initial_sample
+from fuse.data.pipelines.pipeline_default import PipelineDefault
+from fuse.utils.ndict import NDict
+
+
+class DatasetIterable(IterableDataset):
+    """
+    Streaming variant of DatasetDefault, for massive or unbounded sets of samples.
+    The sample ids are pulled from a generator or from a sharded manifest, and the static and dynamic pipelines are applied on the fly.
+    The full list of sample ids is never materialized in memory.
+
+    The work is split between the DDP ranks and the DataLoader workers - each sample id is processed by exactly one of them.
+    Sample morphing is supported - the static and dynamic pipelines may drop a sample (return None) or split it (return a list).
+    Caching is not supported, as the sample ids are not known in advance.
+    Note - the DDP ranks might get a slightly different number of samples, make sure the training loop tolerates it (for example by limiting the number of steps per epoch).
+
+    Example:
+        def sample_ids_generator():
+            for chunk in pd.read_csv("huge_table.csv", usecols=["sample_id"], chunksize=100000):
+                yield from chunk["sample_id"]
+
+        dataset = DatasetIterable(sample_ids_generator, static_pipeline=static_pipeline, dynamic_pipeline=dynamic_pipeline, shuffle_buffer_size=10000)
+        dl = DataLoader(dataset, batch_size=32, num_workers=8, collate_fn=CollateDefault())
+    """
+
+    def __init__(
+        self,
+        sample_ids: Union[Callable[[], Iterable[Hashable]], Iterable[Hashable], None] = None,
+        static_pipeline: Optional[PipelineDefault] = None,
+        dynamic_pipeline: Optional[PipelineDefault] = None,
+        manifest_files: Union[str, Sequence[str], None] = None,
+        shuffle_buffer_size: int = 0,
+        seed: Optional[int] = None,
+    ):
+        """
+        :param sample_ids: the source of sample ids - either a function that returns an iterator (for example a generator function),
+                           called once per epoch in each of the workers, or a re-iterable object (for example range(10**8)).
+                           Each worker iterates over the entire source and keeps its share (round robin), so it's expected to be cheap.
+        :param static_pipeline: static_pipeline - applied on each sample, not cached
+        :param dynamic_pipeline: dynamic_pipeline - applied sequentially after the static_pipeline
+        :param manifest_files: alternatively to sample_ids - a glob pattern or a list of text files, each line in a file is a sample id.
+                               When there are at least as many files as workers, each worker reads only its own files.
+        :param shuffle_buffer_size: shuffle the sample ids using a buffer of the specified size. set to 0 to disable shuffling.
+                                    a larger buffer results in a better shuffling, at the cost of memory.
+        :param seed: seed of the shuffling, the order is reproducible given the same seed, epoch (see set_epoch()) and number of workers.
+                     None for a non-deterministic order.
+        """
+        super().__init__()
+        if (sample_ids is None) == (manifest_files is None):
+            raise Exception("Error: expecting exactly one of sample_ids and manifest_files")
+
+        if isinstance(manifest_files, str):
+            manifest_files = sorted(glob(manifest_files))
+            if len(manifest_files) == 0:
+                raise Exception("Error: no manifest files found")
+
+        if static_pipeline is None:
+            static_pipeline = PipelineDefault("dummy_static_pipeline", ops_and_kwargs=[])
+        if dynamic_pipeline is None:
+            dynamic_pipeline = PipelineDefault("dummy_dynamic_pipeline", ops_and_kwargs=[])
+
+        self._sample_ids = sample_ids
+        self._manifest_files = manifest_files
+        self._static_pipeline = static_pipeline
+        self._dynamic_pipeline = dynamic_pipeline
+        self._shuffle_buffer_size = shuffle_buffer_size
+        self._seed = seed
+        # kept in shared memory - the DataLoader workers get a copy of the dataset,
+        # and with persistent_workers=True the copy is not recreated in each epoch
+        self._epoch = torch.zeros((), dtype=torch.int64).share_memory_()
+
+    @property
+    def static_pipeline(self) -> PipelineDefault:
+        return self._static_pipeline
+
+    @property
+    def dynamic_pipeline(self) -> PipelineDefault:
+        return self._dynamic_pipeline
+
+    def set_epoch(self, epoch: int) -> None:
+        """
+        Sets the epoch, used to draw a different shuffling order in each epoch (similar to DistributedSampler.set_epoch())
+        Call it before iterating over the DataLoader - also applies to the already running workers (persistent_workers=True).
+        """
+        self._epoch.fill_(epoch)
+
+    def __iter__(self) -> Iterator[NDict]:
+        shard_index, num_shards = self._get_shard()
+        static_pipeline = self._static_pipeline.compile()
+        dynamic_pipeline = self._dynamic_pipeline.compile()
+
+        sample_ids = self._iter_sample_ids(shard_index, num_shards)
+        if self._shuffle_buffer_size > 0:
+            if self._seed is None:
+                rng = random.Random()
+            else:
+                rng = random.Random(hash((self._seed, int(self._epoch), shard_index)))
+            sample_ids = DatasetIterable._shuffle(sample_ids, self._shuffle_buffer_size, rng)
+
+        for sample_id in sample_ids:
+            samples = static_pipeline(create_initial_sample(sample_id))
+            for sample in DatasetIterable._as_list(samples):
+                yield from DatasetIterable._as_list(dynamic_pipeline(sample))
+
+    def summary(self) -> str:
+        sum = ""
+        sum += f"Class = {type(self)}\n"
+        sum += f"Source = {'manifest files' if self._manifest_files is not None else 'sample_ids'}\n"
+        sum += f"Shuffle buffer size = {self._shuffle_buffer_size}\n"
+        sum += f"Static Pipeline = {self._static_pipeline}\n"
+        sum += f"Dynamic Pipeline = {self._dynamic_pipeline}\n"
+        return sum
+
+    def _iter_sample_ids(self, shard_index: int, num_shards: int) -> Iterator[Hashable]:
+        """
+        Iterates over the sample ids of the specified shard
+        """
+        if self._manifest_files is not None:
+            if len(self._manifest_files) >= num_shards:
+                # split the files between the shards
+                for filename in self._manifest_files[shard_index::num_shards]:
+                    yield from DatasetIterable._read_manifest(filename)
+                return
+            sample_ids = (sample_id for f in self._manifest_files for sample_id in DatasetIterable._read_manifest(f))
+        elif callable(self._sample_ids):
+            sample_ids = self._sample_ids()
+        else:
+            sample_ids = iter(self._sample_ids)
+
+        # round robin
+        yield from islice(sample_ids, shard_index, None, num_shards)
+
+    @staticmethod
+    def _read_manifest(filename: str) -> Iterator[str]:
+        with open(filename, "r") as f:
+            for line in f:
+                sample_id = line.strip()
+                if sample_id:
+                    yield sample_id
+
+    @staticmethod
+    def _get_shard() -> Tuple[int, int]:
+        """
+        :return: the index of the current shard (DDP rank and DataLoader worker) and the total number of shards
+        """
+        rank, world_size = 0, 1
+        if dist.is_available() and dist.is_initialized():
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+
+        worker_info = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+
+        return rank * num_workers + worker_id, world_size * num_workers
+
+    @staticmethod
+    def _shuffle(items: Iterator[Hashable], buffer_size: int, rng: random.Random) -> Iterator[Hashable]:
+        """
+        Approximate shuffling of a stream using a buffer of a fixed size
+        """
+        buffer: List[Hashable] = []
+        for item in items:
+            if len(buffer) < buffer_size:
+                buffer.append(item)
+                continue
+            index = rng.randrange(buffer_size)
+            yield buffer[index]
+            buffer[index] = item
+
+        rng.shuffle(buffer)
+        yield from buffer
+
+    @staticmethod
+    def _as_list(samples: Union[None, dict, List[dict]]) -> List[dict]:
+        if samples is None:
+            return []
+        if isinstance(samples, list):
+            return samples
+        if isinstance(samples, dict):
+            return [samples]
+        raise Exception(
+            f"Error: the output of the pipelines is expected to be a dict, a list of dicts or None, got {type(samples)}"
+        )
@@ -1,5 +1,11 @@
-from typing import Optional
+from typing import Any, Callable, List, Optional, Tuple
 from time import time
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+import numpy as np
+import torch
 from deepdiff import DeepDiff
 from fuse.data import get_sample_id
 
@@ -16,6 +22,12 @@ SampleCachingAudit(audit_first_sample=True,audit_rate=None)
 #another audit usage example - in this case the first sample will be audited, and also one sample every 20 minutes
 SampleCachingAudit(audit_first_sample=True, audit_rate=20, audit_units='minutes')
 )
+
+#auditing all of the samples in a background thread, so loading the samples is not slowed down. A stale cache is reported through the callback.
+SampleCachingAudit(audit_rate=20, audit_async=True, audit_callback=lambda sample_id, mismatches: ...)
+
+#auditing all of the samples when they are loaded, an exception is raised for a stale cache
+SampleCachingAudit(audit_rate=20, audit_async=False)
 """
 
 
@@ -25,6 +37,10 @@ class SampleCachingAudit:
         audit_first_sample: bool = True,
         audit_rate: Optional[int] = 30,
         audit_units: str = "minutes",
+        audit_comparison: str = "fast",
+        audit_async: Optional[bool] = None,
+        audit_max_pending: int = 1,
+        audit_callback: Optional[Callable[[Any, Optional[List[str]]], None]] = None,
         **audit_diff_kwargs: Optional[dict],
     ):
         """
@@ -35,11 +51,22 @@ class SampleCachingAudit:
         Will be ignored if no cacher is provided.
         :param audit_units: the units in which audit_rate will be used. Supported options are ['minutes', 'samples']
         Will be ignored if no cacher is provided.
-        :param **audit_diff_kwargs: optionally, pass custom kwargs to DeepDiff comparison.
+        :param audit_comparison: how the cached and the fresh samples are compared. Supported options are:
+            "fast" - compares the samples key by key, numpy arrays and tensors are compared with np.allclose. see compare_samples()
+            "deepdiff" - uses DeepDiff, much slower for samples with large arrays.
+        :param audit_async: if True, the fresh sample is processed and compared in a background thread,
+            so the audit does not slow down loading the samples. The result is reported through audit_callback,
+            or logged if audit_callback is not provided. If False, the audit runs when loading the sample and an exception is raised for a stale sample.
+            The default (None) audits the first sample synchronously, so a stale cache fails fast, and the following (periodic) audits in a background thread.
+        :param audit_max_pending: the maximal number of background audits, an audit is skipped when there are already audit_max_pending pending audits.
+        :param audit_callback: optional, called with (sample_id, mismatches) after each background audit. mismatches is None if the cached sample is valid,
+            otherwise a list of strings describing the mismatches.
+        :param **audit_diff_kwargs: optionally, pass custom kwargs to the comparison.
         This is useful if, for example, you want small epsilon differences to be ignored.
         In such case, you can provide math_epsilon=1e-9 to avoid throwing exception for small differences
+        The "fast" comparison supports math_epsilon (used as the absolute tolerance) and ignore_nan_inequality.
 
-        See their documentation here to learn about additional possible flags: https://zepworks.com/deepdiff/current/
+        See DeepDiff documentation here to learn about additional possible flags: https://zepworks.com/deepdiff/current/
         Important - as a default, we pass ignore_nan_inequality=True, as we think it's the most reasonable comparison strategy suitable for caches.
         You can use ignore_nan_inequality=False if you prefer the original default behavior (which considers NaN to not be equal NaN)
 
@@ -50,6 +77,9 @@ class SampleCachingAudit:
         _audit_unit_options = ["minutes", "samples", None]
         if audit_units not in _audit_unit_options:
             raise Exception(f"audit_units must be one of {_audit_unit_options}")
+        _audit_comparison_options = ["fast", "deepdiff"]
+        if audit_comparison not in _audit_comparison_options:
+            raise Exception(f"audit_comparison must be one of {_audit_comparison_options}")
         self._audit_rate = audit_rate
         self._audit_first_sample = audit_first_sample
         self._audited_so_far = 0
@@ -60,6 +90,36 @@ class SampleCachingAudit:
         if self._audit_units == "minutes":
             self._prev_time = time()
         self._audit_diff_kwargs = audit_diff_kwargs
+        self._audit_comparison = audit_comparison
+        self._audit_async = audit_async
+        self._audit_max_pending = audit_max_pending
+        self._audit_callback = audit_callback
+        self._reset_background_state()
+
+    def _reset_background_state(self) -> None:
+        # created lazily, per process
+        self._executor = None
+        self._executor_pid = None
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for k in ["_executor", "_executor_pid", "_pending", "_pending_lock"]:
+            del state[k]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._reset_background_state()
+
+    def is_async(self) -> bool:
+        """
+        :return: whether the next audit should run in a background thread (see audit_async in __init__)
+        """
+        if self._audit_async is None:
+            return self._audited_so_far > 0
+        return self._audit_async
 
     def update(self) -> bool:
         """
@@ -88,16 +148,138 @@ class SampleCachingAudit:
                 return True
         return False
 
+    def compare(self, cached_sample: dict, fresh_sample: dict) -> Optional[List[str]]:
+        """
+        :return: None if the samples match, otherwise a list of strings describing the mismatches
+        """
+        if self._audit_comparison == "deepdiff":
+            diff = DeepDiff(cached_sample, fresh_sample, **self._audit_diff_kwargs)
+            return [str(diff)] if len(diff) > 0 else None
+        mismatches = compare_samples(
+            cached_sample,
+            fresh_sample,
+            atol=self._audit_diff_kwargs.get("math_epsilon", None) or 0.0,
+            equal_nan=self._audit_diff_kwargs["ignore_nan_inequality"],
+        )
+        return mismatches if len(mismatches) > 0 else None
+
     def audit(self, cached_sample, fresh_sample):
-        diff = DeepDiff(cached_sample, fresh_sample, **self._audit_diff_kwargs)
+        mismatches = self.compare(cached_sample, fresh_sample)
         self._audited_so_far += 1
-        if len(diff) > 0:
-            msg = f"""Error! During AUDIT found a mismatch between cached_sample and loaded sample.\n"
+        if mismatches is not None:
+            msg = _stale_sample_message(get_sample_id(fresh_sample))
+            raise Exception(msg + f"diff = {mismatches}" + msg)
+
+    def submit(self, sample_id: Any, load_samples_func: Callable[[], Tuple[dict, dict]]) -> bool:
+        """
+        Audits a sample in a background thread (see audit_async in __init__)
+        :param load_samples_func: a function that returns a tuple of (cached sample, fresh sample), called in the background thread
+        :return: True if the audit was submitted, False if it was skipped because there are too many pending audits
+        """
+        # counted on submission, to avoid submitting the first sample multiple times
+        self._audited_so_far += 1
+        with self._pending_lock:
+            if self._pending >= self._audit_max_pending:
+                return False
+            self._pending += 1
+        if self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sample_caching_audit")
+            self._executor_pid = os.getpid()
+        self._executor.submit(self._background_audit, sample_id, load_samples_func)
+        return True
+
+    def _background_audit(self, sample_id: Any, load_samples_func: Callable[[], Tuple[dict, dict]]) -> None:
+        try:
+            cached_sample, fresh_sample = load_samples_func()
+            mismatches = self.compare(cached_sample, fresh_sample)
+        except Exception as e:
+            mismatches = [f"audit failed: {e}"]
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
+
+        if self._audit_callback is not None:
+            self._audit_callback(sample_id, mismatches)
+        elif mismatches is not None:
+            msg = _stale_sample_message(sample_id)
+            logging.getLogger("Fuse").error(msg + f"diff = {mismatches}")
+
+    def wait(self) -> None:
+        """
+        Waits for the pending background audits to complete
+        """
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._executor_pid = None
+
+
+def compare_samples(
+    cached_sample: dict, fresh_sample: dict, atol: float = 0.0, rtol: float = 0.0, equal_nan: bool = True
+) -> List[str]:
+    """
+    Fast comparison of two (flat) samples, key by key.
+    numpy arrays and tensors are compared by shape, dtype and np.allclose, other values are compared recursively
+    :return: a list of strings describing the mismatches, empty if the samples match
+    """
+    mismatches = []
+    cached_keys = set(cached_sample.keys())
+    fresh_keys = set(fresh_sample.keys())
+    for k in sorted(cached_keys - fresh_keys):
+        mismatches.append(f"{k}: missing in the fresh sample")
+    for k in sorted(fresh_keys - cached_keys):
+        mismatches.append(f"{k}: missing in the cached sample")
+    for k in cached_sample.keys():
+        if k in fresh_keys:
+            _compare_values(k, cached_sample[k], fresh_sample[k], atol, rtol, equal_nan, mismatches)
+    return mismatches
+
+
+def _compare_values(
+    key: str, cached: Any, fresh: Any, atol: float, rtol: float, equal_nan: bool, mismatches: List[str]
+) -> None:
+    if isinstance(cached, torch.Tensor) and isinstance(fresh, torch.Tensor):
+        cached = cached.detach().cpu().numpy()
+        fresh = fresh.detach().cpu().numpy()
+    if isinstance(cached, np.ndarray) or isinstance(fresh, np.ndarray):
+        if type(cached) != type(fresh) and not (isinstance(cached, np.ndarray) and isinstance(fresh, np.ndarray)):
+            mismatches.append(f"{key}: type {type(cached)} != {type(fresh)}")
+        elif cached.shape != fresh.shape or cached.dtype != fresh.dtype:
+            mismatches.append(f"{key}: shape/dtype {cached.shape}/{cached.dtype} != {fresh.shape}/{fresh.dtype}")
+        elif cached.dtype.kind in "fc":
+            if not np.allclose(cached, fresh, atol=atol, rtol=rtol, equal_nan=equal_nan):
+                mismatches.append(f"{key}: max abs diff {np.nanmax(np.abs(cached - fresh))}")
+        elif not np.array_equal(cached, fresh):
+            mismatches.append(f"{key}: array values differ")
+        return
+    if isinstance(cached, dict) and isinstance(fresh, dict):
+        for k in set(cached.keys()) | set(fresh.keys()):
+            if k not in cached or k not in fresh:
+                mismatches.append(f"{key}.{k}: missing")
+            else:
+                _compare_values(f"{key}.{k}", cached[k], fresh[k], atol, rtol, equal_nan, mismatches)
+        return
+    if isinstance(cached, (list, tuple)) and isinstance(fresh, (list, tuple)):
+        if type(cached) != type(fresh) or len(cached) != len(fresh):
+            mismatches.append(f"{key}: {type(cached)} of length {len(cached)} != {type(fresh)} of length {len(fresh)}")
+            return
+        for i, (c, f) in enumerate(zip(cached, fresh)):
+            _compare_values(f"{key}[{i}]", c, f, atol, rtol, equal_nan, mismatches)
+        return
+    if isinstance(cached, float) and isinstance(fresh, float):
+        if not np.isclose(cached, fresh, atol=atol, rtol=rtol, equal_nan=equal_nan):
+            mismatches.append(f"{key}: {cached} != {fresh}")
+        return
+    if type(cached) != type(fresh) or cached != fresh:
+        mismatches.append(f"{key}: {cached} != {fresh}")
+
+
+def _stale_sample_message(sample_id: Any) -> str:
+    return f"""Error! During AUDIT found a mismatch between cached_sample and loaded sample.\n"
                 "Please reset your cache.\n"
                 "Note - this can happen if a change in your (static) pipeline Ops is not expressed in the calculated hash function.\n"
                 "There are several reasons that can cause this, for example, you are calling, from within your op external code.\n"
                 "This is perfectly fine to do, just make sure you reset your cache after such change.\n"
                 "Gladly, the Audit feature caught this stale cache state! :)\n"
-                f"sample id in which this staleness was caught: {get_sample_id(fresh_sample)}\n"
-                'NOTE: if small changes between the saved cached and the live-loaded/processed sample are ok for your use case, you can set a tolerance epsilon like this: audit_diff_kwargs={"math_epsilon":1e-9}'"""
-            raise Exception(msg + f"diff = {diff}" + msg)
+                f"sample id in which this staleness was caught: {sample_id}\n"
+                'NOTE: if small changes between the saved cached and the live-loaded/processed sample are ok for your use case, you can set a tolerance epsilon like this: audit_diff_kwargs={{"math_epsilon":1e-9}}'"""
@@ -16,6 +16,7 @@ limitations under the License.
 """
 
 import unittest
+from unittest import mock
 
 from fuse.utils.rand.seed import Seed
 
@@ -27,9 +28,28 @@ import tempfile
 import os
 from fuse.data.ops.op_base import OpBase
 from typing import List, Union, Optional
-from fuse.data.datasets.caching.samples_cacher import SamplesCacher
+from fuse.data.datasets.caching.samples_cacher import SamplesCacher, SIDE_TABLE_ALL_SCALARS
+from fuse.data.ops.ops_common import OpCollectMarker
 from fuse.data.datasets.dataset_default import DatasetDefault
+from fuse.data.ops.ops_cast import OpToTensor
+from fuse.data.utils.collates import CollateDefault
 from fuse.utils.ndict import NDict
+from fuse.utils.multiprocessing import shutdown_persistent_pools
+import torch
+from torch.utils.data import DataLoader
+
+
+class OpAddScalars(OpBase):
+    """
+    Adds scalars of different types - used to test the side table
+    """
+
+    def __call__(self, sample_dict: NDict) -> NDict:
+        index = int(get_sample_id(sample_dict)[5])
+        sample_dict["data.mixed"] = index if index % 2 == 0 else index + 0.5
+        sample_dict["data.float32"] = np.float32(index / 3)
+        sample_dict["data.flag"] = index > 1
+        return sample_dict
 
 
 class OpFakeLoad(OpBase):
@@ -75,6 +95,20 @@ class OpPrintContents(OpBase):
         return sample_dict
 
 
+class OpFakeLoadImage(OpBase):
+    def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+        index = int(get_sample_id(sample_dict).split("_")[-1])
+        sample_dict["data.img"] = np.full((3, 4), index, dtype=np.float64)
+        sample_dict["data.label"] = index % 2
+        return sample_dict
+
+
+class OpAddValue(OpBase):
+    def __call__(self, sample_dict: NDict, value: float) -> Union[None, dict, List[dict]]:
+        sample_dict["data.img"] = sample_dict["data.img"] + value
+        return sample_dict
+
+
 class TestDatasetDefault(unittest.TestCase):
     """
     Test sample caching
@@ -213,6 +247,127 @@ class TestDatasetDefault(unittest.TestCase):
         self.assertEqual(sample_from_cached["data"]["cc"]["img"].sum(), 50012.88698394645)
         banana = 123
 
+    def test_get_multi_side_table(self):
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_a"),
+        ]
+
+        static_pl = PipelineDefault("static_pipeline", [(OpFakeLoad(), {})])
+        dynamic_pl = PipelineDefault(
+            "dynamic_pipeline",
+            [
+                (OpCollectMarker(name="sampler", static_key_deps=["data.initial_sample_id"]), {}),
+                (OpPrintContents(), {}),
+            ],
+        )
+
+        orig_sample_ids = ["case_1", "case_2", "case_3", "case_4"]
+        cacher = SamplesCacher(
+            "dataset_test_cache", static_pl, cache_dirs, restart_cache=True, side_table_keys=SIDE_TABLE_ALL_SCALARS
+        )
+        ds = DatasetDefault(orig_sample_ids, static_pl, dynamic_pipeline=dynamic_pl, cacher=cacher)
+        ds.create()
+        self.assertIn("data.initial_sample_id", cacher.get_side_table_keys())
+
+        keys = ["data.sample_id", "data.initial_sample_id"]
+        expected = [ds.getitem(i, keys=keys) for i in range(len(ds))]
+
+        # the values are expected to be collected without loading any sample
+        with mock.patch.object(cacher, "load_sample", side_effect=AssertionError("unexpected sample loading")):
+            collected = ds.get_multi(keys=keys, collect_marker_name="sampler", workers=0)
+            self.assertEqual(collected, expected)
+            # the full dynamic pipeline might modify the values, so the side table can't be used
+            self.assertRaises(AssertionError, ds.get_multi, keys=keys, workers=0)
+
+        # the side table should be reloaded (and not recreated) for an already cached set of samples
+        cacher = SamplesCacher(
+            "dataset_test_cache", static_pl, cache_dirs, restart_cache=False, side_table_keys=["data.sample_id"]
+        )
+        ds = DatasetDefault(orig_sample_ids, static_pl, dynamic_pipeline=dynamic_pl, cacher=cacher)
+        ds.create()
+        with mock.patch.object(cacher, "load_sample", side_effect=AssertionError("unexpected sample loading")):
+            collected = ds.get_multi(keys=["data.sample_id"], collect_marker_name="sampler", workers=0)
+        self.assertEqual([s["data.sample_id"] for s in collected], ds.get_all_sample_ids())
+
+    def test_get_multi_side_table_types(self):
+        tmpdir = tempfile.mkdtemp()
+        static_pl = PipelineDefault("static_pipeline", [(OpFakeLoad(), {}), (OpAddScalars(), {})])
+        dynamic_pl = PipelineDefault(
+            "dynamic_pipeline", [(OpCollectMarker(name="sampler", static_key_deps=["data.mixed"]), {})]
+        )
+        cacher = SamplesCacher(
+            "dataset_test_cache",
+            static_pl,
+            [os.path.join(tmpdir, "cache_a")],
+            restart_cache=True,
+            side_table_keys=SIDE_TABLE_ALL_SCALARS,
+        )
+        ds = DatasetDefault(["case_1", "case_2", "case_4"], static_pl, dynamic_pipeline=dynamic_pl, cacher=cacher)
+        ds.create()
+
+        keys = ["data.mixed", "data.float32", "data.flag"]
+        expected = [ds.getitem(i, keys=keys) for i in range(len(ds))]
+        with mock.patch.object(cacher, "load_sample", side_effect=AssertionError("unexpected sample loading")):
+            collected = ds.get_multi(keys=keys, collect_marker_name="sampler", workers=0)
+        self.assertEqual(collected, expected)
+        for collected_sample, expected_sample in zip(collected, expected):
+            for key in keys:
+                self.assertIs(type(collected_sample[key]), type(expected_sample[key]))
+
+    def test_batch_mode(self):
+        static_pl = PipelineDefault("static_pipeline", [(OpFakeLoadImage(), {})])
+        dynamic_pl = PipelineDefault(
+            "dynamic_pipeline",
+            [
+                (OpAddValue(), dict(value=1.0)),  # does not support batch mode - applied per sample
+                (OpToTensor(), dict(key="data.img", dtype=torch.float32)),
+                (OpCollectMarker(name="sampler", static_key_deps=["data.label"]), {}),
+            ],
+        )
+        self.assertEqual(dynamic_pl.get_batch_start_index(), 1)
+
+        sample_ids = [f"case_{i}" for i in range(10)]
+        ds_per_sample = DatasetDefault(sample_ids, static_pl, dynamic_pipeline=dynamic_pl)
+        ds_per_sample.create()
+        ds_batch = DatasetDefault(sample_ids, static_pl, dynamic_pipeline=dynamic_pl, batch_collate_fn=CollateDefault())
+        ds_batch.create()
+
+        self.assertIsInstance(ds_per_sample.__getitems__([0, 1]), list)
+        batch_dict = ds_batch.__getitems__([0, 1])
+        self.assertEqual(batch_dict["data.img"].shape, (2, 3, 4))
+        self.assertEqual(batch_dict["data.img"].dtype, torch.float32)
+
+        for ds in [ds_per_sample, ds_batch]:
+            dl = DataLoader(ds, batch_size=4, collate_fn=CollateDefault())
+            batches = list(dl)
+            self.assertEqual([len(b["data.sample_id"]) for b in batches], [4, 4, 2])
+            for batch_index, batch in enumerate(batches):
+                for i, sid in enumerate(batch["data.sample_id"]):
+                    index = batch_index * 4 + i
+                    self.assertEqual(sid, sample_ids[index])
+                    self.assertTrue(torch.equal(batch["data.img"][i], torch.full((3, 4), index + 1.0)))
+                self.assertTrue(torch.is_tensor(batch["data.label"]))
+
+    def test_get_multi_persistent_pool(self):
+        static_pl = PipelineDefault("static_pipeline", [(OpFakeLoadImage(), {})])
+        sample_ids = [f"case_{i}" for i in range(20)]
+        ds = DatasetDefault(sample_ids, static_pl)
+        ds.create()
+        try:
+            for _ in range(2):
+                collected = ds.get_multi(
+                    keys=["data.label"], workers=2, verbose=0, persistent_pool=True, chunksize="guided"
+                )
+                self.assertEqual([s["data.label"] for s in collected], [i % 2 for i in range(20)])
+
+            # the workers should not use the previous copy of the dataset
+            ds.subset(list(range(1, 20, 2)))
+            collected = ds.get_multi(keys=["data.label"], workers=2, verbose=0, persistent_pool=True)
+            self.assertEqual([s["data.label"] for s in collected], [1] * 10)
+        finally:
+            shutdown_persistent_pools()
+
     def tearDown(self):
         pass
 
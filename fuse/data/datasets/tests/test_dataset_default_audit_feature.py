@@ -28,6 +28,7 @@ from fuse.data.ops.op_base import OpBase
 from typing import List, Union
 from fuse.data.datasets.caching.samples_cacher import SamplesCacher
 from fuse.data.datasets.dataset_default import DatasetDefault
+from fuse.data.datasets.sample_caching_audit import SampleCachingAudit, compare_samples
 
 
 class OpFakeLoad(OpBase):
@@ -212,6 +213,76 @@ class TestDatasetDefault(unittest.TestCase):
 
         banana = 123
 
+    def test_audit_async(self):
+        tmpdir = tempfile.mkdtemp()
+        cache_dirs = [
+            os.path.join(tmpdir, "cache_c"),
+        ]
+        static_pl = PipelineDefault("static_pipeline", [(OpFakeLoad(), {})])
+        ForMonkeyPatching.identity_transform = lambda x: x  # might be left modified by another test
+
+        audit_results = []
+        cacher = SamplesCacher(
+            "dataset_default_audit_async_test_cache",
+            static_pl,
+            cache_dirs,
+            restart_cache=True,
+            audit_rate=1,
+            audit_units="samples",
+            audit_async=True,
+            audit_callback=lambda sample_id, mismatches: audit_results.append((sample_id, mismatches)),
+        )
+        ds_cached = DatasetDefault(["case_1", "case_2"], static_pl, cacher=cacher)
+        ds_cached.create(num_workers=0)
+
+        sample = ds_cached[0]
+        # modifying the returned sample is not expected to affect the audit
+        sample["data.cc.img"][:] = 0
+        cacher._audit.wait()
+        self.assertEqual(audit_results, [("case_1", None)])
+
+        def small_change(sample_dict):
+            sample_dict["data"]["cc"]["img"][5, 50, 50] += 0.001
+            return sample_dict
+
+        ForMonkeyPatching.identity_transform = small_change
+        try:
+            # a stale sample is reported by the callback, and does not raise an exception
+            ds_cached[1]
+            cacher._audit.wait()
+        finally:
+            ForMonkeyPatching.identity_transform = lambda x: x  # return it to previous state
+        self.assertEqual(audit_results[1][0], "case_2")
+        self.assertEqual(len(audit_results[1][1]), 1)
+        self.assertIn("data.cc.img", audit_results[1][1][0])
+
+    def test_audit_async_default(self):
+        audit = SampleCachingAudit(audit_rate=1, audit_units="samples")
+        # the first sample is audited synchronously - a stale cache raises an exception
+        self.assertTrue(audit.update())
+        self.assertFalse(audit.is_async())
+        audit.audit(NDict({"data.sample_id": "a", "x": 1}), NDict({"data.sample_id": "a", "x": 1}))
+        # the periodic audits run in a background thread
+        self.assertTrue(audit.update())
+        self.assertTrue(audit.is_async())
+        self.assertFalse(SampleCachingAudit(audit_async=False).is_async())
+        self.assertTrue(SampleCachingAudit(audit_async=True).is_async())
+
+    def test_compare_samples(self):
+        sample = NDict(_generate_sample_1())
+        same_sample = NDict(_generate_sample_1())
+        self.assertEqual(compare_samples(sample, same_sample), [])
+
+        same_sample["data.cc.img"][0, 0, 0] += 1e-12
+        self.assertEqual(len(compare_samples(sample, same_sample)), 1)
+        self.assertEqual(compare_samples(sample, same_sample, atol=1e-9), [])
+
+        same_sample["data.cc.dicom_tags"][-1] = "apple"
+        same_sample["data.mlo.seg"] = same_sample["data.mlo.seg"].astype(np.int32)
+        del same_sample["data.clinical_info_input"]
+        mismatches = compare_samples(sample, same_sample, atol=1e-9)
+        self.assertEqual(len(mismatches), 3)
+
     def tearDown(self):
         pass
 
@@ -0,0 +1,139 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import os
+import tempfile
+import unittest
+from typing import List, Union
+from unittest import mock
+
+from torch.utils.data import DataLoader
+
+from fuse.data import create_initial_sample, get_sample_id
+from fuse.data.datasets.dataset_iterable import DatasetIterable
+from fuse.data.ops.op_base import OpBase
+from fuse.data.pipelines.pipeline_default import PipelineDefault
+from fuse.data.utils.collates import CollateDefault
+from fuse.utils.ndict import NDict
+
+
+class OpFakeLoad(OpBase):
+    """
+    drops the samples with index % 10 == 9 and splits the samples with index % 10 == 0
+    """
+
+    def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+        index = int(get_sample_id(sample_dict))
+        if index % 10 == 9:
+            return None
+        sample_dict["data.index"] = index
+        if index % 10 == 0:
+            sample_2 = create_initial_sample(index, f"{index}_split")
+            sample_2["data.index"] = index
+            return [sample_dict, sample_2]
+        return sample_dict
+
+
+class OpDouble(OpBase):
+    def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+        sample_dict["data.double"] = sample_dict["data.index"] * 2
+        return sample_dict
+
+
+def sample_ids_generator():
+    for index in range(100):
+        yield str(index)
+
+
+class TestDatasetIterable(unittest.TestCase):
+    def setUp(self):
+        self.static_pl = PipelineDefault("static", [(OpFakeLoad(), {})])
+        self.dynamic_pl = PipelineDefault("dynamic", [(OpDouble(), {})])
+        self.expected_sample_ids = sorted(
+            [str(i) for i in range(100) if i % 10 != 9] + [f"{i}_split" for i in range(0, 100, 10)]
+        )
+
+    def _iterate(self, ds: DatasetIterable, num_workers: int) -> List[dict]:
+        dl = DataLoader(ds, batch_size=4, num_workers=num_workers, collate_fn=CollateDefault())
+        samples = []
+        for batch in dl:
+            for sid, index, double in zip(batch["data.sample_id"], batch["data.index"], batch["data.double"]):
+                self.assertEqual(double, index * 2)
+                samples.append(sid)
+        return samples
+
+    def test_generator(self):
+        ds = DatasetIterable(sample_ids_generator, self.static_pl, self.dynamic_pl)
+        for num_workers in [0, 2]:
+            samples = self._iterate(ds, num_workers)
+            self.assertEqual(sorted(samples), self.expected_sample_ids)
+
+        # a re-iterable object
+        ds = DatasetIterable(range(20), self.static_pl, self.dynamic_pl)
+        self.assertEqual(len(list(ds)), 20)
+
+    def test_manifest(self):
+        tmpdir = tempfile.mkdtemp()
+        for file_index in range(4):
+            with open(os.path.join(tmpdir, f"manifest_{file_index}.txt"), "w") as f:
+                f.write("\n".join(str(i) for i in range(file_index * 25, (file_index + 1) * 25)) + "\n\n")
+
+        ds = DatasetIterable(
+            static_pipeline=self.static_pl,
+            dynamic_pipeline=self.dynamic_pl,
+            manifest_files=os.path.join(tmpdir, "manifest_*.txt"),
+        )
+        # both splitting the files between the workers and reading all of the files by all of the workers
+        for num_workers in [0, 2, 3]:
+            samples = self._iterate(ds, num_workers)
+            self.assertEqual(sorted(samples), self.expected_sample_ids)
+
+    def test_shuffle_and_ddp(self):
+        ds = DatasetIterable(range(1000), shuffle_buffer_size=100, seed=1234)
+        sample_ids = [get_sample_id(s) for s in ds]
+        self.assertEqual(sorted(sample_ids), list(range(1000)))
+        self.assertNotEqual(sample_ids, list(range(1000)))
+        self.assertEqual(sample_ids, [get_sample_id(s) for s in ds])
+        ds.set_epoch(1)
+        self.assertNotEqual(sample_ids, [get_sample_id(s) for s in ds])
+
+        # each of the ranks is expected to get its own share
+        all_sample_ids = []
+        for rank in range(3):
+            with mock.patch("torch.distributed.is_initialized", return_value=True), mock.patch(
+                "torch.distributed.get_rank", return_value=rank
+            ), mock.patch("torch.distributed.get_world_size", return_value=3):
+                all_sample_ids += [get_sample_id(s) for s in ds]
+        self.assertEqual(sorted(all_sample_ids), list(range(1000)))
+
+    def test_set_epoch_persistent_workers(self):
+        ds = DatasetIterable(range(100), shuffle_buffer_size=50, seed=1234)
+        dl = DataLoader(ds, batch_size=None, num_workers=2, persistent_workers=True)
+        epochs = []
+        for epoch in range(3):
+            ds.set_epoch(epoch % 2)
+            epochs.append([get_sample_id(sample) for sample in dl])
+        self.assertNotEqual(epochs[0], epochs[1])
+        self.assertEqual(epochs[0], epochs[2])
+
+    def test_errors(self):
+        self.assertRaises(Exception, DatasetIterable)
+        self.assertRaises(Exception, DatasetIterable, range(10), manifest_files="/non/existing/*.txt")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,9 @@
 import inspect
+import re
+import sys
+from functools import lru_cache
+from types import CodeType
 from typing import Callable, Any, Type, Optional, Sequence
-from inspect import stack
 import warnings
 from fuse.utils.file_io.file_io import load_pickle, save_pickle_safe
 import os
@@ -28,26 +31,60 @@ def get_function_call_str(func, *_args, **_kwargs) -> str:
     args_flat_str += "@" + str(
         inspect.getmodule(func)
     )  # adding full (including scope) name of the function, for the case of multiple functions with the same name
-    args_flat_str += "@" + inspect.getsource(func)  # considering the source code (first level of it...)
+    code = getattr(inspect.unwrap(getattr(func, "__func__", func)), "__code__", None)
+    # considering the source code (first level of it...)
+    args_flat_str += "@" + (get_code_source(code) if code is not None else inspect.getsource(func))
 
     return args_flat_str
 
 
+@lru_cache(maxsize=None)
+def get_code_source(code: CodeType) -> str:
+    """
+    Memoized inspect.getsource() of a code object (of a function or a method).
+    Reading and parsing the source file is by far the most expensive part of building the hashable description of an op,
+    and it only needs to happen once per function per process.
+    """
+    return inspect.getsource(code)
+
+
 def value_to_string(val: Any, warn_on_types: Optional[Sequence] = None) -> str:
     """
     Used by default in several caching related hash builders.
     Ignores <...> string as they usually change between different runs
     (for example, due to pointing to a specific memory address)
+    Objects that implement get_hashable_string_representation() (for example, ops passed to other ops) are described by it,
+    also when they are contained in a list, tuple or dict.
     """
     if warn_on_types is not None:
         if isinstance(val, tuple(list(warn_on_types))):
             warnings.warn(
                 f"type {type(val)} is possibly participating in hashing, this is usually not optimal performance wise."
             )
+    if hasattr(val, "get_hashable_string_representation"):
+        return val.get_hashable_string_representation()
+    if isinstance(val, (list, tuple, dict)) and _contains_hashable_objects(val):
+        if isinstance(val, dict):
+            return "{" + ", ".join(f"{k}: {value_to_string(v)}" for k, v in val.items()) + "}"
+        return "[" + ", ".join(value_to_string(v) for v in val) + "]"
     ans = str(val)
     if ans.startswith("<"):
         return ""
-    return str(val)
+    # drop memory addresses of objects nested in containers
+    return _MEMORY_ADDRESS_PATTERN.sub("", ans)
+
+
+_MEMORY_ADDRESS_PATTERN = re.compile(r" at 0x[0-9a-fA-F]+")
+
+
+def _contains_hashable_objects(val: Any) -> bool:
+    values = val.values() if isinstance(val, dict) else val
+    for v in values:
+        if hasattr(v, "get_hashable_string_representation"):
+            return True
+        if isinstance(v, (list, tuple, dict)) and _contains_hashable_objects(v):
+            return True
+    return False
 
 
 def convert_func_call_into_kwargs_only(func: Callable, *args, **kwargs) -> dict:
@@ -75,6 +112,7 @@ def get_callers_string_description(
     expected_function_name: str,
     value_to_string_func: Callable = value_to_string,
     ignore_first_frames=3,  # one for this function, one for HashableCallable, and one for OpBase
+    include_source: bool = True,
 ):
     """
     iterates on the callstack, and accumulates a string representation of the callers args.
@@ -102,17 +140,27 @@ def get_callers_string_description(
         stack frames in a different function name will be skipped,
         pass None for not requiring anything
     :param value_to_string_func: allows to provide a custom function for converting values to strings
-    :param
+    :param include_source: include the source code of the callers
     """
 
     str_desc = ""
+    curr_frame = None
+    curr_locals = None
+    frame = None
     try:
-        curr_stack = stack()
-        curr_locals = None
         # note: frame 0 is this function, frame 1 is whoever called this (and wanted to know about its callers),
         # so both frames 0+1 are skipped.
-        for i in range(ignore_first_frames, min(len(curr_stack), max_look_up + ignore_first_frames)):
-            curr_locals = curr_stack[i].frame.f_locals
+        # walking the frames directly is much faster than inspect.stack(), which reads the source context of every frame in the stack
+        try:
+            curr_frame = sys._getframe(ignore_first_frames)
+        except ValueError:  # the stack is not deep enough
+            curr_frame = None
+        for _ in range(max_look_up):
+            if curr_frame is None:
+                break
+            frame = curr_frame
+            curr_frame = curr_frame.f_back
+            curr_locals = frame.f_locals
             if expected_class is not None:
                 if "self" not in curr_locals:
                     continue
@@ -120,19 +168,20 @@ def get_callers_string_description(
                     continue
 
             if expected_function_name is not None:
-                if expected_function_name != str(curr_stack[i].function):
+                if expected_function_name != frame.f_code.co_name:
                     continue
 
             curr_str = ".".join(
                 [
                     str(curr_locals["self"].__module__),  # module is probably not needed as class already contains it
                     str(curr_locals["self"].__class__),
-                    str(curr_stack[i].function),
+                    frame.f_code.co_name,
                 ]
             )
 
-            curr_str += inspect.getsource(curr_stack[i].frame)
-            for k, d in curr_stack[i].frame.f_locals.items():
+            if include_source:
+                curr_str += get_code_source(frame.f_code)
+            for k, d in curr_locals.items():
                 if "self" == k:
                     continue
                 if k.startswith("__"):
@@ -142,8 +191,10 @@ def get_callers_string_description(
             str_desc += curr_str
 
     finally:
+        # avoid reference cycles through the frames
         del curr_locals
-        del curr_stack
+        del curr_frame
+        del frame
 
     return str_desc
 
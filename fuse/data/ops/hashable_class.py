@@ -1,4 +1,4 @@
-from typing import Callable
+from typing import Any, Callable, Dict, Optional, Union
 from fuse.data.ops import get_function_call_str
 from fuse.data.ops.caching_tools import get_callers_string_description, value_to_string
 
@@ -10,6 +10,14 @@ class HashableClass:
     # expected signature: foo(val:Any) -> str
     VALUE_TO_STRING_FUNC: Callable = value_to_string
 
+    # opt-in: set to an int or a str in a class to describe it by its name, version and __init__ args instead of by its source code.
+    # bump it whenever a change in the class should invalidate caches created with it.
+    # it is not inherited - a subclass that does not set it is described by its source code.
+    cache_version: Optional[Union[int, str]] = None
+
+    # memoized string representation of __call__, per __call__ function (see get_hashable_string_representation)
+    _CALL_STR_REPRESENTATIONS: Dict[Any, str] = {}
+
     def __init__(self):
         """
         when init is called, a string representation of the caller(s) init args are recorded.
@@ -18,13 +26,24 @@ class HashableClass:
         # the following is used to extract callers args, for __init__ calls up the stack of classes inheirting from OpBase
         # this way it can happen in the base class and then anyone creating new Ops will typically only need to add
         # super().__init__ in their __init__ implementation
-        self._stored_init_str_representation = get_callers_string_description(
+        cache_version = self._get_own_cache_version()
+        init_str_representation = get_callers_string_description(
             max_look_up=4,
             expected_class=HashableClass,
             expected_function_name="__init__",
             value_to_string_func=HashableClass.VALUE_TO_STRING_FUNC,
-            ignore_first_frames=3,
+            ignore_first_frames=2,  # one for get_callers_string_description, and one for this function
+            include_source=cache_version is None,
         )
+        if cache_version is not None:
+            init_str_representation = f"cache_version@{cache_version}@{init_str_representation}"
+        self._stored_init_str_representation = init_str_representation
+
+    def _get_own_cache_version(self) -> Optional[Union[int, str]]:
+        """
+        :return: cache_version if it's set by the class itself (and not by a base class), otherwise None
+        """
+        return type(self).__dict__.get("cache_version", None)
 
     def __setattr__(self, name, value):
         """
@@ -56,8 +75,19 @@ class HashableClass:
 
         if not hasattr(self, "_stored_init_str_representation"):
             raise Exception(HashableClass._MISSING_SUPER_INIT_ERR_MSG)
-        call_repr = get_function_call_str(
-            self.__call__,
-        )
+
+        cache_version = self._get_own_cache_version()
+        if cache_version is not None:
+            call_repr = f"cache_version@{cache_version}"
+        else:
+            # the representation depends only on the function, so it's computed once per class
+            call_func = getattr(self.__call__, "__func__", None)
+            call_repr = HashableClass._CALL_STR_REPRESENTATIONS.get(call_func, None)
+            if call_repr is None:
+                call_repr = get_function_call_str(
+                    self.__call__,
+                )
+                if call_func is not None:
+                    HashableClass._CALL_STR_REPRESENTATIONS[call_func] = call_repr
 
         return f"init_{self._stored_init_str_representation}@call_{call_repr}"
@@ -16,8 +16,10 @@ limitations under the License.
 Created on June 30, 2021
 
 """
-from typing import Union, List, Optional
+from typing import Any, Union, List, Optional
 from abc import abstractmethod
+import numpy as np
+import torch
 from fuse.data.utils.sample import get_sample_id
 from fuse.utils.ndict import NDict
 from fuse.data.ops.hashable_class import HashableClass
@@ -46,6 +48,25 @@ class OpBase(HashableClass):
         """
         raise NotImplementedError
 
+    def supports_batch(self) -> bool:
+        """
+        Override and return True in ops that implement call_batch().
+        Used by DatasetDefault in batch mode (see batch_collate_fn) to run the op once on a collated batch, instead of once per sample.
+        """
+        return False
+
+    def call_batch(self, batch_dict: NDict, op_id: Optional[str], per_sample_kwargs: List[dict]) -> NDict:
+        """
+        Applies the op on a batch of samples at once. Implemented only by ops for which supports_batch() returns True.
+        The result is expected to be identical (up to the random values drawn) to applying the op on each of the samples and collating them.
+        :param batch_dict: the collated samples (see CollateDefault) - tensors and numpy arrays are stacked along a new first dimension
+        :param op_id: see OpReversibleBase.__call__()
+        :param per_sample_kwargs: the kwargs of the op, a dict per sample in the batch. Usually all are the same dict,
+            but they might be different, for example, when the kwargs were drawn per sample by OpSample.
+        :return: the modified batch_dict
+        """
+        raise NotImplementedError
+
 
 class OpReversibleBase(OpBase):
     """
@@ -124,6 +145,59 @@ def op_call(op: OpBase, sample_dict: NDict, op_id: str, **kwargs):
         raise
 
 
+def op_call_batch(op: OpBase, batch_dict: NDict, op_id: str, per_sample_kwargs: List[dict]) -> NDict:
+    try:
+        return op.call_batch(batch_dict, op_id=op_id, per_sample_kwargs=per_sample_kwargs)
+    except:
+        print(
+            "************************************************************************************************************************************\n"
+            + f"error in call_batch method of op={op}, op_id={op_id} - more details below"
+            + "*************************************************************************************************************************************\n"
+        )
+        raise
+
+
+def get_batch_kwarg(per_sample_kwargs: List[dict], name: str, default: Any = None) -> Any:
+    """
+    Helper for call_batch() implementations, for kwargs that must be the same for all of the samples (for example, a key)
+    :return: the value of kwarg name (or default if not specified)
+    """
+    values = [kwargs.get(name, default) for kwargs in per_sample_kwargs]
+    for value in values[1:]:
+        if not _values_equal(value, values[0]):
+            raise Exception(
+                f"Error: expecting the same value of {name} for all of the samples in a batch, got {values}"
+            )
+    return values[0]
+
+
+def get_batch_param(
+    per_sample_kwargs: List[dict], name: str, like: torch.Tensor, default: Any = None, index: Optional[int] = None
+) -> Any:
+    """
+    Helper for call_batch() implementations, for numeric kwargs that might be different per sample (for example, drawn by OpSample)
+    :param like: the batch tensor the param will be applied on
+    :param index: optional, take the element index of a sequence kwarg (for example, the lower bound of a range)
+    :return: the value if it's the same for all of the samples (or None if not specified),
+        otherwise a tensor of the per sample values, with a shape that broadcasts with like - [batch_size, 1, 1, ...]
+    """
+    values = [kwargs.get(name, default) for kwargs in per_sample_kwargs]
+    if index is not None:
+        values = [value[index] if value is not None else None for value in values]
+    if all(_values_equal(value, values[0]) for value in values[1:]):
+        return values[0]
+    if any(value is None for value in values):
+        raise Exception(f"Error: {name} is specified just for some of the samples in a batch")
+    dtype = like.dtype if like.is_floating_point() else torch.float32
+    return torch.tensor(values, dtype=dtype, device=like.device).reshape([len(values)] + [1] * (like.dim() - 1))
+
+
+def _values_equal(a: Any, b: Any) -> bool:
+    if isinstance(a, (np.ndarray, torch.Tensor)) or isinstance(b, (np.ndarray, torch.Tensor)):
+        return a is b
+    return a == b
+
+
 def op_reverse(op, sample_dict: NDict, key_to_reverse: str, key_to_follow: str, op_id: Optional[str]):
     if isinstance(op, OpReversibleBase):
         try:
@@ -3,7 +3,7 @@ from typing import List, Optional, Sequence, Union
 
 from fuse.utils.rand.param_sampler import RandBool, draw_samples_recursively
 
-from fuse.data.ops.op_base import OpBase, OpReversibleBase, op_call, op_reverse
+from fuse.data.ops.op_base import OpBase, OpReversibleBase, op_call, op_call_batch, op_reverse
 from fuse.data.ops.ops_common import OpRepeat
 
 from fuse.utils.ndict import NDict
@@ -70,6 +70,16 @@ class OpSample(OpReversibleBase):
         sampled_kwargs = draw_samples_recursively(kwargs)
         return op_call(self._op, sample_dict, op_id, **sampled_kwargs)
 
+    def supports_batch(self) -> bool:
+        return self._op.supports_batch()
+
+    def call_batch(self, batch_dict: NDict, op_id: Optional[str], per_sample_kwargs: List[dict]) -> NDict:
+        """
+        See super class. The values are drawn separately per sample, as in the per sample flow.
+        """
+        sampled_kwargs = [draw_samples_recursively(kwargs) for kwargs in per_sample_kwargs]
+        return op_call_batch(self._op, batch_dict, op_id, sampled_kwargs)
+
     def reverse(self, sample_dict: NDict, key_to_reverse: str, key_to_follow: str, op_id: Optional[str]) -> dict:
         """
         See super class
@@ -18,7 +18,7 @@ Created on June 30, 2021
 """
 from abc import abstractmethod
 from typing import Any, List, Optional, Sequence, Union
-from fuse.data.ops.op_base import OpReversibleBase
+from fuse.data.ops.op_base import OpReversibleBase, get_batch_kwarg
 import numpy as np
 
 from fuse.data import OpBase
@@ -185,6 +185,26 @@ class OpToTensor(OpCast):
     def _cast(self, value: Any, dtype: Optional[torch.dtype] = None, device: Optional[torch.device] = None) -> Tensor:
         return Cast.to_tensor(value, dtype, device)
 
+    def supports_batch(self) -> bool:
+        return True
+
+    def call_batch(self, batch_dict: NDict, op_id: Optional[str], per_sample_kwargs: List[dict]) -> NDict:
+        """
+        See super class
+        Note - the default collate already converts numpy arrays and numbers into tensors, so reversing the op on a batch keeps the tensor type.
+        """
+        key = get_batch_kwarg(per_sample_kwargs, "key")
+        dtype = get_batch_kwarg(per_sample_kwargs, "dtype")
+        device = get_batch_kwarg(per_sample_kwargs, "device")
+        keys = [key] if isinstance(key, str) else key
+
+        for key_name in keys:
+            value = batch_dict[key_name]
+            batch_dict[f"{op_id}_{key_name}"] = [type(value).__name__] * len(per_sample_kwargs)
+            batch_dict[key_name] = Cast.to_tensor(value, dtype, device)
+
+        return batch_dict
+
 
 class OpToNumpy(OpCast):
     """
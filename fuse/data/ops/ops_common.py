@@ -4,7 +4,7 @@ from typing import Any, Callable, Dict, List, Optional, OrderedDict, Sequence, T
 from fuse.data.key_types import TypeDetectorBase
 import copy
 from enum import Enum
-from .op_base import OpBase, OpReversibleBase, op_call, op_reverse  # DataType,
+from .op_base import OpBase, OpReversibleBase, op_call, op_call_batch, op_reverse  # DataType,
 from fuse.data.patterns import Patterns
 from fuse.utils.ndict import NDict
 import numpy as np
@@ -68,6 +68,25 @@ class OpRepeat(OpReversibleBase):
 
         return sample_dict
 
+    def supports_batch(self) -> bool:
+        return self._op.supports_batch()
+
+    def call_batch(self, batch_dict: NDict, op_id: Optional[str], per_sample_kwargs: List[dict]) -> NDict:
+        """
+        See super class
+        """
+        for step_index, step_kwargs_to_add in enumerate(self._kwargs_per_step_to_add):
+            step_per_sample_kwargs = []
+            for kwargs in per_sample_kwargs:
+                step_kwargs = copy.copy(kwargs)
+                step_kwargs.update(step_kwargs_to_add)
+                step_per_sample_kwargs.append(step_kwargs)
+            full_step_id = f"{op_id}_{step_index}"
+            batch_dict[full_step_id + "_debug_info.op_name"] = [self._op.__class__.__name__] * len(per_sample_kwargs)
+            batch_dict = op_call_batch(self._op, batch_dict, full_step_id, step_per_sample_kwargs)
+
+        return batch_dict
+
     def reverse(self, sample_dict: NDict, key_to_reverse: str, key_to_follow: str, op_id: Optional[str]) -> dict:
         """
         See super class
@@ -358,6 +377,12 @@ class OpCollectMarker(OpReversibleBase):
     def __call__(self, sample_dict: dict, op_id: Optional[str], **kwargs: Any) -> Union[None, dict, List[dict]]:
         return sample_dict
 
+    def supports_batch(self) -> bool:
+        return True
+
+    def call_batch(self, batch_dict: NDict, op_id: Optional[str], per_sample_kwargs: List[dict]) -> NDict:
+        return batch_dict
+
     def reverse(self, sample_dict: dict, key_to_reverse: str, key_to_follow: str, op_id: Optional[str]) -> dict:
         return sample_dict
 
@@ -1,14 +1,82 @@
 import unittest
+from unittest import mock
 
-from typing import Union, List
+import inspect
+from typing import Any, Callable, Type, Union, List
 from fuse.utils.ndict import NDict
 
+from fuse.data.ops import caching_tools, hashable_class
+from fuse.data.ops.caching_tools import convert_func_call_into_kwargs_only, value_to_string
+from fuse.data.ops.ops_common import OpKeepKeypaths, OpLookup, OpRepeat, OpSet, OpToOneHot
 from fuse.data.ops.op_base import OpBase, op_call
+from fuse.data.pipelines.pipeline_default import PipelineDefault
 from fuse.data.key_types import DataTypeBasic
 from fuse.data import create_initial_sample
 from fuse.data.key_types_for_testing import DataTypeForTesting, type_detector_for_testing
 
 
+def _reference_callers_string_description(
+    max_look_up: int,
+    expected_class: Type,
+    expected_function_name: str,
+    value_to_string_func: Callable = value_to_string,
+    ignore_first_frames: int = 3,
+    include_source: bool = True,
+) -> str:
+    """
+    get_callers_string_description() without the memoization - inspect.stack() and inspect.getsource() of each frame
+    """
+    str_desc = ""
+    curr_stack = inspect.stack()
+    for i in range(ignore_first_frames, min(len(curr_stack), max_look_up + ignore_first_frames)):
+        curr_locals = curr_stack[i].frame.f_locals
+        if expected_class is not None:
+            if "self" not in curr_locals:
+                continue
+            if not isinstance(curr_locals["self"], expected_class):
+                continue
+        if expected_function_name is not None:
+            if expected_function_name != str(curr_stack[i].function):
+                continue
+        curr_str = ".".join(
+            [str(curr_locals["self"].__module__), str(curr_locals["self"].__class__), str(curr_stack[i].function)]
+        )
+        if include_source:
+            curr_str += inspect.getsource(curr_stack[i].frame)
+        for k, d in curr_stack[i].frame.f_locals.items():
+            if "self" == k:
+                continue
+            if k.startswith("__"):
+                continue
+            curr_str += "@" + str(k) + "@" + value_to_string_func(d)
+        str_desc += curr_str
+    return str_desc
+
+
+def _reference_function_call_str(func: Callable, *_args: Any, **_kwargs: Any) -> str:
+    """
+    get_function_call_str() without the memoization
+    """
+    kwargs = convert_func_call_into_kwargs_only(func, *_args, **_kwargs)
+    args_flat_str = func.__name__ + "@"
+    args_flat_str += "@".join(["{}@{}".format(str(k), value_to_string(kwargs[k])) for k in sorted(kwargs.keys())])
+    args_flat_str += "@" + str(inspect.getmodule(func))
+    args_flat_str += "@" + inspect.getsource(func)
+    return args_flat_str
+
+
+def _create_pipeline() -> PipelineDefault:
+    return PipelineDefault(
+        "test_pipeline",
+        [
+            (OpLookup(map={"a": 1, "b": 2}, not_exist_error=False), dict(key_in="data.x", key_out="data.y")),
+            (OpToOneHot(num_classes=3), dict(key_in="data.y", key_out="data.one_hot")),
+            (OpRepeat(OpSet(), [dict(key="data.a"), dict(key="data.b")]), dict(value=5)),
+            (OpKeepKeypaths(), dict(keys=["data.one_hot", "data.a"])),
+        ],
+    )
+
+
 class TestOpBase(unittest.TestCase):
     def test_for_type_detector(self):
         td = type_detector_for_testing
@@ -48,6 +116,68 @@ class TestOpBase(unittest.TestCase):
             [DataTypeForTesting.IMAGE_FOR_TESTING],
         )
 
+    def test_hashable_string_representation(self):
+        class OpImpBase(OpBase):
+            def __init__(self):
+                super().__init__()
+
+        class OpImp(OpImpBase):
+            def __init__(self, a: int, b: str = "x"):
+                super().__init__()
+
+            def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+                return sample_dict
+
+        class OpImpVersioned(OpImp):
+            cache_version = 2
+
+        class OpImpVersionedChild(OpImpVersioned):
+            pass
+
+        self.assertEqual(OpImp(1).get_hashable_string_representation(), OpImp(1).get_hashable_string_representation())
+        self.assertNotEqual(
+            OpImp(1).get_hashable_string_representation(), OpImp(2).get_hashable_string_representation()
+        )
+        self.assertIn("def __init__", OpImp(1).get_hashable_string_representation())
+
+        # the source code is read only once, and not at all for ops with a cache_version
+        OpImp(1).get_hashable_string_representation()
+        with mock.patch.object(inspect, "getsource", side_effect=AssertionError("unexpected getsource")):
+            with mock.patch.object(inspect, "stack", side_effect=AssertionError("unexpected stack")):
+                OpImp(3).get_hashable_string_representation()
+                versioned_repr = OpImpVersioned(1, b="y").get_hashable_string_representation()
+        self.assertIn("cache_version@2", versioned_repr)
+        self.assertIn("@b@y", versioned_repr)
+        self.assertNotIn("def __init__", versioned_repr)
+
+        # cache_version is not inherited
+        self.assertIn("def __init__", OpImpVersionedChild(1).get_hashable_string_representation())
+
+        # the __init__ args of ops deriving directly from OpBase, and ops passed to other ops, are part of the description
+        self.assertNotEqual(
+            OpToOneHot(3).get_hashable_string_representation(), OpToOneHot(4).get_hashable_string_representation()
+        )
+        self.assertNotEqual(
+            OpRepeat(OpToOneHot(3), [{}]).get_hashable_string_representation(),
+            OpRepeat(OpToOneHot(4), [{}]).get_hashable_string_representation(),
+        )
+        self.assertNotIn(" at 0x", OpRepeat(OpToOneHot(3), [{}]).get_hashable_string_representation())
+
+    def test_hashable_string_representation_unchanged(self):
+        """
+        The memoization does not change the description of a pipeline (and so the hash of its cache)
+        """
+        with mock.patch.object(
+            hashable_class, "get_callers_string_description", _reference_callers_string_description
+        ), mock.patch.object(hashable_class, "get_function_call_str", _reference_function_call_str), mock.patch.dict(
+            hashable_class.HashableClass._CALL_STR_REPRESENTATIONS, clear=True
+        ):
+            expected = _create_pipeline().get_hashable_string_representation()
+        caching_tools.get_code_source.cache_clear()
+        self.assertEqual(_create_pipeline().get_hashable_string_representation(), expected)
+        # memoized
+        self.assertEqual(_create_pipeline().get_hashable_string_representation(), expected)
+
 
 if __name__ == "__main__":
     unittest.main()
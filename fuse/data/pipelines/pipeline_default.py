@@ -16,13 +16,18 @@ limitations under the License.
 Created on June 30, 2021
 
 """
-from typing import List, Tuple, Union, Optional
-from fuse.data.ops.op_base import OpBase, OpReversibleBase, op_call, op_reverse
+from typing import Callable, Dict, List, Tuple, Union, Optional
+from functools import partial
+import inspect
+from fuse.data.ops.op_base import OpBase, OpReversibleBase, op_call, op_call_batch, op_reverse
+from fuse.data.utils.sample import get_sample_id
+from fuse.data.utils import profiling
 from fuse.utils.misc.context import DummyContext
 from fuse.utils.ndict import NDict
 from fuse.utils.cpu_profiling.timer import Timer
 
 import copy
+import time
 
 
 class PipelineDefault(OpReversibleBase):
@@ -88,27 +93,51 @@ class PipelineDefault(OpReversibleBase):
     def get_name(self) -> str:
         return self._name
 
-    def __str__(self) -> str:
+    def get_op_ids(self) -> List[str]:
+        return list(self._op_ids)
+
+    def get_description(self, until_op_id: Optional[str] = None) -> str:
+        """
+        A string representation of the pipeline, used for hashing
+        :param until_op_id: optional - describe only the ops up to (and including) the specified op_id
+        """
         text = []
         for (op_id, op_kwargs) in zip(self._op_ids, self._ops_and_kwargs):
             op, kwargs = op_kwargs
             text.append(str(op_id) + "@" + op.get_hashable_string_representation() + "@" + str(kwargs) + "@")
+            if until_op_id is not None and op_id == until_op_id:
+                break
         return "".join(text)  # this is faster than accumulate_str+=new_str
 
+    def __str__(self) -> str:
+        return self.get_description()
+
     def __call__(
-        self, sample_dict: NDict, op_id: Optional[str] = None, until_op_id: Optional[str] = None
+        self,
+        sample_dict: NDict,
+        op_id: Optional[str] = None,
+        until_op_id: Optional[str] = None,
+        start_after_op_id: Optional[str] = None,
     ) -> Union[None, dict, List[dict]]:
         """
         See super class
         plus
         :param until_op_id: optional - stop after the specified op_id - might be used for optimization
+        :param start_after_op_id: optional - skip the ops up to (and including) the specified op_id.
+            Used to resume processing of a sample that was already processed by the first ops.
         """
         # set op_id if not specified
         if op_id is None:
             op_id = f"internal.{self._name}"
 
+        if start_after_op_id is not None:
+            first_op_index = self._op_ids.index(start_after_op_id) + 1
+        else:
+            first_op_index = 0
+
+        profiling_enabled = profiling.is_profiling_enabled()
         samples_to_process = [sample_dict]
-        for sub_op_id, (op, op_kwargs) in zip(self._op_ids, self._ops_and_kwargs):
+        for sub_op_id, (op, op_kwargs) in zip(self._op_ids[first_op_index:], self._ops_and_kwargs[first_op_index:]):
             if self._verbose:
                 context = Timer(f"Pipeline {self._name}: op {type(op).__name__}, op_id {sub_op_id}", self._verbose)
             else:
@@ -118,7 +147,11 @@ class PipelineDefault(OpReversibleBase):
 
                 for sample in samples_to_process:
 
+                    if profiling_enabled:
+                        start_time = time.perf_counter()
                     sample = op_call(op, sample, f"{op_id}.{sub_op_id}", **op_kwargs)
+                    if profiling_enabled:
+                        profiling.record(self._get_profiling_stage(sub_op_id, op), time.perf_counter() - start_time)
 
                     # three options for return value:
                     # None - ignore the sample
@@ -146,6 +179,73 @@ class PipelineDefault(OpReversibleBase):
         else:
             return samples_to_process
 
+    def _get_profiling_stage(self, sub_op_id: str, op: OpBase) -> str:
+        """
+        The name of the op in the profiling statistics, see fuse.data.utils.profiling
+        """
+        return f"pipeline.{self._name}.{sub_op_id}.{type(op).__name__}"
+
+    def compile(self, op_id: Optional[str] = None) -> "PipelineCompiled":
+        """
+        Resolve once the op ids, the call convention and the kwargs of each op, and return a lean executor with the same semantics as __call__().
+        Useful when the pipeline is applied many times on small samples (for example, a dynamic pipeline with many cheap ops).
+        Note - the compiled pipeline is a snapshot, changes to the pipeline (extend()) after compile() will not be reflected.
+        :param op_id: see __call__()
+        """
+        return PipelineCompiled(self, op_id)
+
+    def get_batch_start_index(self) -> int:
+        """
+        :return: the index of the first op of the longest sequence of ops, at the end of the pipeline, that support batch mode (see OpBase.supports_batch()).
+            Those ops can be applied at once on a collated batch. Equals to the number of ops if the last op does not support batch mode.
+        """
+        index = len(self._ops_and_kwargs)
+        while index > 0 and self._ops_and_kwargs[index - 1][0].supports_batch():
+            index -= 1
+        return index
+
+    def supports_batch(self) -> bool:
+        return self.get_batch_start_index() == 0
+
+    def call_batch(
+        self,
+        batch_dict: NDict,
+        op_id: Optional[str],
+        per_sample_kwargs: List[dict],
+        start_after_op_id: Optional[str] = None,
+    ) -> NDict:
+        """
+        See super class
+        plus
+        :param per_sample_kwargs: a dict per sample in the batch, used here only to get the batch size
+        :param start_after_op_id: optional - skip the ops up to (and including) the specified op_id.
+            All of the following ops must support batch mode.
+        """
+        # set op_id if not specified
+        if op_id is None:
+            op_id = f"internal.{self._name}"
+
+        if start_after_op_id is not None:
+            first_op_index = self._op_ids.index(start_after_op_id) + 1
+        else:
+            first_op_index = 0
+
+        for sub_op_id, (op, op_kwargs) in zip(self._op_ids[first_op_index:], self._ops_and_kwargs[first_op_index:]):
+            if self._verbose:
+                context = Timer(
+                    f"Pipeline {self._name}: op {type(op).__name__}, op_id {sub_op_id} (batch)", self._verbose
+                )
+            else:
+                context = DummyContext()
+            with context:
+                start_time = time.perf_counter()
+                batch_dict = op_call_batch(op, batch_dict, f"{op_id}.{sub_op_id}", [op_kwargs] * len(per_sample_kwargs))
+                profiling.record(self._get_profiling_stage(sub_op_id, op) + ":batch", time.perf_counter() - start_time)
+                if not isinstance(batch_dict, dict):
+                    raise Exception(f"unexpected batch type returned by {type(op)}: {type(batch_dict)}")
+
+        return batch_dict
+
     def reverse(self, sample_dict: NDict, key_to_reverse: str, key_to_follow: str, op_id: Optional[str] = None) -> dict:
         """
         See super class
@@ -158,3 +258,144 @@ class PipelineDefault(OpReversibleBase):
             sample_dict = op_reverse(op, sample_dict, f"{op_id}.{sub_op_id}", key_to_reverse, key_to_follow)
 
         return sample_dict
+
+
+class PipelineCompiled:
+    """
+    A lean executor of PipelineDefault, created by PipelineDefault.compile()
+    Supports the same arguments and return values as PipelineDefault.__call__() without the per op overhead.
+    """
+
+    def __init__(self, pipeline: PipelineDefault, op_id: Optional[str] = None):
+        if op_id is None:
+            op_id = f"internal.{pipeline.get_name()}"
+
+        self._name = pipeline.get_name()
+        self._verbose = pipeline._verbose
+        self._op_ids = pipeline.get_op_ids()
+        # the first occurrence of each op_id, like PipelineDefault.__call__()
+        self._op_index: Dict[str, int] = {}
+        for index, sub_op_id in enumerate(self._op_ids):
+            self._op_index.setdefault(sub_op_id, index)
+        self._ops = pipeline.ops
+        self._full_op_ids = []
+        self._profiling_stages = []
+        self._steps: List[Callable] = []
+        for sub_op_id, (op, op_kwargs) in zip(self._op_ids, pipeline._ops_and_kwargs):
+            if inspect.isclass(op):
+                # let op_call raise the descriptive error
+                op_call(op, None, sub_op_id)
+            if not isinstance(op, OpBase):
+                raise Exception(
+                    f"Ops are expected to be instances of classes or subclasses of OpBase. The following op is not: {op}"
+                )
+            full_op_id = f"{op_id}.{sub_op_id}"
+            self._full_op_ids.append(full_op_id)
+            self._profiling_stages.append(pipeline._get_profiling_stage(sub_op_id, op))
+            if isinstance(op, OpReversibleBase):
+                self._steps.append(partial(op, op_id=full_op_id, **op_kwargs))
+            else:
+                self._steps.append(partial(op, **op_kwargs))
+
+    def __call__(
+        self,
+        sample_dict: NDict,
+        until_op_id: Optional[str] = None,
+        start_after_op_id: Optional[str] = None,
+    ) -> Union[None, dict, List[dict]]:
+        """
+        See PipelineDefault.__call__()
+        """
+        first_op_index = 0 if start_after_op_id is None else self._op_index[start_after_op_id] + 1
+        # an unknown until_op_id runs all of the ops, like PipelineDefault.__call__()
+        end_op_index = self._op_index.get(until_op_id, len(self._steps) - 1) + 1
+
+        if self._verbose or profiling.is_profiling_enabled():
+            return self._call_instrumented(sample_dict, first_op_index, end_op_index)
+
+        op_index = first_op_index
+        try:
+            # fast path - as long as the sample is not split
+            for op_index in range(first_op_index, end_op_index):
+                sample = self._steps[op_index](sample_dict)
+                if sample is None:
+                    return None
+                if isinstance(sample, list):
+                    break
+                if not isinstance(sample, dict):
+                    raise Exception(f"unexpected sample type returned by {type(self._ops[op_index])}: {type(sample)}")
+                sample_dict = sample
+            else:
+                return sample_dict
+        except:
+            self._print_error(op_index, sample_dict)
+            raise
+
+        # the sample was split into multiple samples
+        return self._call_samples(sample, op_index + 1, end_op_index)
+
+    def _call_samples(
+        self, samples: List[dict], first_op_index: int, end_op_index: int, profiling_enabled: bool = False
+    ) -> Union[None, dict, List[dict]]:
+        samples_to_process = samples
+        for op_index in range(first_op_index, end_op_index):
+            samples_to_process_next = []
+            for sample in samples_to_process:
+                try:
+                    if profiling_enabled:
+                        start_time = time.perf_counter()
+                    result = self._steps[op_index](sample)
+                    if profiling_enabled:
+                        profiling.record(self._profiling_stages[op_index], time.perf_counter() - start_time)
+                except:
+                    self._print_error(op_index, sample)
+                    raise
+                if result is None:
+                    return None
+                elif isinstance(result, list):
+                    samples_to_process_next += result
+                elif isinstance(result, dict):
+                    samples_to_process_next.append(result)
+                else:
+                    raise Exception(f"unexpected sample type returned by {type(self._ops[op_index])}: {type(result)}")
+            samples_to_process = samples_to_process_next
+
+        if len(samples_to_process) == 1:
+            return samples_to_process[0]
+        else:
+            return samples_to_process
+
+    def _call_instrumented(
+        self, sample_dict: NDict, first_op_index: int, end_op_index: int
+    ) -> Union[None, dict, List[dict]]:
+        """
+        Slower path, used when verbose is enabled or when profiling is enabled (see fuse.data.utils.profiling)
+        """
+        profiling_enabled = profiling.is_profiling_enabled()
+        samples_to_process = [sample_dict]
+        for op_index in range(first_op_index, end_op_index):
+            op = self._ops[op_index]
+            if self._verbose:
+                context = Timer(
+                    f"Pipeline {self._name}: op {type(op).__name__}, op_id {self._op_ids[op_index]}", self._verbose
+                )
+            else:
+                context = DummyContext()
+            with context:
+                result = self._call_samples(samples_to_process, op_index, op_index + 1, profiling_enabled)
+            if result is None:
+                return None
+            samples_to_process = result if isinstance(result, list) else [result]
+
+        if len(samples_to_process) == 1:
+            return samples_to_process[0]
+        else:
+            return samples_to_process
+
+    def _print_error(self, op_index: int, sample_dict: NDict) -> None:
+        # same message as op_call()
+        print(
+            "************************************************************************************************************************************\n"
+            + f"error in __call__ method of op={self._ops[op_index]}, op_id={self._full_op_ids[op_index]}, sample_id={get_sample_id(sample_dict)} - more details below"
+            + "*************************************************************************************************************************************\n"
+        )
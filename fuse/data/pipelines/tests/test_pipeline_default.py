@@ -76,6 +76,28 @@ class TestPipelineDefault(unittest.TestCase):
         self.assertEqual("data.test_pipeline" in sample_dict, False)
         self.assertEqual("data.test_pipeline_2" in sample_dict, False)
 
+    def test_partial_pipeline(self):
+        """
+        Test running a part of the pipeline and describing a prefix of the pipeline
+        """
+        pipeline_seq = [
+            (OpSetForTest(), dict(key="data.a", val=5)),
+            (OpSetForTest(), dict(key="data.b", val=6)),
+            (OpSetForTest(), dict(key="data.c", val=7)),
+        ]
+        pipe = PipelineDefault("test", pipeline_seq, op_ids=["a", "b", "c"])
+
+        sample_dict = pipe(NDict({}), until_op_id="b")
+        self.assertEqual(set(sample_dict["data"].keys()), {"a", "b"})
+        sample_dict = pipe(sample_dict, start_after_op_id="b")
+        self.assertEqual(sample_dict["data.c"], 7)
+        sample_dict = pipe(NDict({}), start_after_op_id="a", until_op_id="b")
+        self.assertEqual(set(sample_dict["data"].keys()), {"b"})
+
+        self.assertEqual(pipe.get_description(), str(pipe))
+        self.assertTrue(str(pipe).startswith(pipe.get_description(until_op_id="b")))
+        self.assertNotIn("data.c", pipe.get_description(until_op_id="b"))
+
     def test_none(self):
         """
         Test pipeline with an op returning None
@@ -108,6 +130,65 @@ class TestPipelineDefault(unittest.TestCase):
         samples = [sample["data.sample_id"] for sample in sample_dict]
         self.assertListEqual(expected_samples, samples)
 
+    def test_compile(self):
+        """
+        Test that the compiled pipeline has the same semantics
+        """
+        pipeline_seq = [
+            (OpSetForTest(), dict(key="data.a", val=5)),
+            (OpSetForTest(), dict(key="data.b", val=6)),
+            (OpSplitForTest(), dict()),
+            (OpSetForTest(), dict(key="data.c", val=7)),
+        ]
+        pipe = PipelineDefault("test", pipeline_seq, op_ids=["a", "b", "split", "c"])
+        compiled = pipe.compile()
+
+        for kwargs in [
+            dict(),
+            dict(until_op_id="a"),
+            dict(until_op_id="b", start_after_op_id="a"),
+            dict(until_op_id="split"),
+        ]:
+            expected = pipe(NDict({"data": {"sample_id": 0}}), **kwargs)
+            result = compiled(NDict({"data": {"sample_id": 0}}), **kwargs)
+            self.assertEqual(type(result), type(expected))
+            if isinstance(expected, list):
+                self.assertEqual([s.flatten() for s in result], [s.flatten() for s in expected])
+            else:
+                self.assertEqual(result.flatten(), expected.flatten())
+        self.assertEqual(len(compiled(NDict({"data": {"sample_id": 0}}))), 10)
+        self.assertEqual(compiled(NDict({"data": {"sample_id": 0}}))[0]["internal.test.c.key"], "data.c")
+        self.assertEqual(pipe.compile(op_id="other")(NDict({}), until_op_id="a")["other.a.key"], "data.a")
+
+        # duplicate op_ids - the first occurrence, and an unknown until_op_id - all of the ops
+        pipeline_seq = [
+            (OpSetForTest(), dict(key="data.a", val=5)),
+            (OpSetForTest(), dict(key="data.b", val=6)),
+            (OpSetForTest(), dict(key="data.a", val=7)),
+            (OpSetForTest(), dict(key="data.c", val=8)),
+        ]
+        pipe = PipelineDefault("test", pipeline_seq, op_ids=["a", "b", "a2", "c"])
+        pipe._op_ids = ["a", "b", "a", "c"]  # not allowed by the constructor, but might be set by subclasses
+        compiled = pipe.compile()
+        for kwargs in [
+            dict(until_op_id="a"),
+            dict(start_after_op_id="a"),
+            dict(until_op_id="b", start_after_op_id="a"),
+            dict(until_op_id="unknown"),
+        ]:
+            expected = pipe(NDict({"data": {"sample_id": 0}}), **kwargs)
+            result = compiled(NDict({"data": {"sample_id": 0}}), **kwargs)
+            self.assertEqual(result.flatten(), expected.flatten())
+        self.assertEqual(compiled(NDict({}), until_op_id="a")["data.a"], 5)
+        self.assertEqual(compiled(NDict({}), until_op_id="unknown")["data.c"], 8)
+
+        pipe = PipelineDefault("test", [(OpSetForTest(), dict(key="data.a", val=5)), (OpNoneForTest(), dict())])
+        self.assertIsNone(pipe.compile()(NDict({})))
+
+        pipe = PipelineDefault("test", [(OpSetForTest(), dict(key="data.a"))])
+        self.assertRaises(TypeError, pipe.compile(), NDict({"data": {"sample_id": 0}}))
+        self.assertRaises(Exception, lambda: PipelineDefault("test", [(OpSetForTest, dict())]).compile())
+
     def tearDown(self) -> None:
         return super().tearDown()
 
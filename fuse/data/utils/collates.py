@@ -16,12 +16,18 @@ limitations under the License.
 Created on June 30, 2021
 
 """
-from typing import Any, Callable, Dict, List, Sequence
+import functools
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import torch
 from torch.utils.data._utils.collate import default_collate
-import torch.nn.functional as F
+
+try:
+    # stacks the tensors directly into shared memory when running in a DataLoader worker
+    from torch.utils.data._utils.collate import collate_tensor_fn
+except ImportError:  # older versions of torch
+    collate_tensor_fn = default_collate
 
 from fuse.utils import NDict
 from fuse.utils.data.collate import CollateToBatchList
@@ -35,8 +41,14 @@ class CollateDefault(CollateToBatchList):
     Special collates per key can be specified in special_handlers_keys
     sample_id key will be collected to a list.
     Few options to special handlers implemented in this class as static methods
+
+    When all of the samples in a batch have the same keys (the common case), a collation "plan" is used:
+    the collate function of each key is selected once per set of keys and reused for the following batches.
     """
 
+    # the maximal number of cached plans (see _call_planned())
+    MAX_PLANS = 16
+
     def __init__(
         self,
         skip_keys: Sequence[str] = tuple(),
@@ -58,6 +70,9 @@ class CollateDefault(CollateToBatchList):
             self._special_handlers_keys.update(special_handlers_keys)
         self._special_handlers_keys[get_sample_id_key()] = CollateDefault.just_collect_to_list
         self._keep_keys = keep_keys
+        self._skip_keys_set = set(skip_keys)
+        # key set signature -> list of (key, collate function), or None if the fast path can't be used for this key set
+        self._plans: Dict[Tuple[str, ...], Optional[List[Tuple[str, Callable]]]] = {}
 
     def __call__(self, samples: List[Dict]) -> Dict:
         """
@@ -65,6 +80,14 @@ class CollateDefault(CollateToBatchList):
         :param samples: list of samples
         :return: batch_dict
         """
+        if isinstance(samples, dict):
+            # already collated by the dataset (see DatasetDefault batch_collate_fn)
+            return samples
+
+        batch_dict = self._call_planned(samples)
+        if batch_dict is not None:
+            return batch_dict
+
         batch_dict = NDict()
 
         # collect all keys
@@ -77,7 +100,7 @@ class CollateDefault(CollateToBatchList):
         for key in keys:
 
             # skip keys
-            if key in self._skip_keys:
+            if key in self._skip_keys_set:
                 continue
 
             try:
@@ -92,6 +115,116 @@ class CollateDefault(CollateToBatchList):
 
         return batch_dict
 
+    def _call_planned(self, samples: List[Dict]) -> Optional[NDict]:
+        """
+        Fast path for the case that all of the samples are NDicts with the same keys.
+        The collate function of each key is selected once per set of keys (a plan) - see _create_plan().
+        :return: batch_dict or None if the fast path can't be used
+        """
+        if len(samples) == 0 or not all(isinstance(sample, NDict) for sample in samples):
+            return None
+        stored = [sample.to_dict() for sample in samples]
+        keys = stored[0].keys()
+        for sample_stored in stored[1:]:
+            if sample_stored.keys() != keys:
+                return None
+
+        signature = tuple(keys)
+        if signature in self._plans:
+            plan = self._plans[signature]
+        else:
+            if len(self._plans) >= self.MAX_PLANS:
+                self._plans.clear()
+            plan = self._plans[signature] = self._create_plan(signature, stored[0])
+        if plan is None:
+            return None
+
+        batch_values = {}
+        nested_values = {}
+        for key, collate_fn in plan:
+            try:
+                value = collate_fn([sample_stored[key] for sample_stored in stored])
+            except:
+                print(f"Error: Failed to collect key {key}")
+                raise
+            if isinstance(value, dict):
+                # a special handler might return a dict, which should be flattened
+                nested_values[key] = value
+            else:
+                batch_values[key] = value
+
+        batch_dict = NDict(batch_values, already_flat=True)
+        batch_dict.merge(nested_values)
+        return batch_dict
+
+    def _create_plan(self, keys: Sequence[str], sample: dict) -> Optional[List[Tuple[str, Callable]]]:
+        """
+        Select the collate function of each key, based on the type of its value in the first sample
+        :param keys: the keys of all of the samples in the batch
+        :param sample: the first sample of the batch (flat dict)
+        :return: list of (key, collate function) or None if the keys do not include all of keep_keys
+        """
+        if self._keep_keys:
+            if not set(self._keep_keys).issubset(keys):
+                # missing keys, handled by __call__()
+                return None
+            keys = self._keep_keys
+
+        plan = []
+        for key in keys:
+            if key in self._skip_keys_set:
+                continue
+            value_type = type(sample[key])
+            generic_fn = functools.partial(self._collate_values, key)
+            if key in self._special_handlers_keys:
+                collate_fn = self._special_handlers_keys[key]
+            elif issubclass(value_type, torch.Tensor):
+                collate_fn = collate_tensor_fn
+            elif issubclass(value_type, np.ndarray):
+                collate_fn = CollateDefault._collate_ndarrays
+            elif value_type is float:
+                collate_fn = CollateDefault._collate_floats
+            elif value_type in (int, bool):
+                collate_fn = torch.tensor
+            elif value_type in (str, bytes):
+                collate_fn = CollateDefault.just_collect_to_list
+            elif issubclass(value_type, (float, int, str, bytes)):
+                # other subclasses of the supported types, for example numpy scalars
+                collate_fn = generic_fn
+            else:
+                # kept as a list
+                collate_fn = CollateDefault.just_collect_to_list
+            if collate_fn is not generic_fn and key not in self._special_handlers_keys:
+                # the type might change in the next batches, fall back to the generic dispatch in such a case
+                collate_fn = functools.partial(
+                    CollateDefault._collate_by_type, value_type=value_type, collate_fn=collate_fn, generic_fn=generic_fn
+                )
+            plan.append((key, collate_fn))
+        return plan
+
+    @staticmethod
+    def _collate_by_type(values: List[Any], value_type: type, collate_fn: Callable, generic_fn: Callable) -> Any:
+        if type(values[0]) is value_type:
+            return collate_fn(values)
+        return generic_fn(values)
+
+    @staticmethod
+    def _collate_ndarrays(values: List[np.ndarray]) -> torch.Tensor:
+        if values[0].dtype.kind in "OSUV":
+            # not supported by torch, let default_collate raise the error
+            return default_collate(values)
+        return collate_tensor_fn([torch.as_tensor(value) for value in values])
+
+    @staticmethod
+    def _collate_floats(values: List[float]) -> torch.Tensor:
+        return torch.tensor(values, dtype=torch.float64)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        # the plans are cached per process
+        state["_plans"] = {}
+        return state
+
     def _batch_dispatch(
         self, batch_dict: dict, samples: List[dict], key: str, has_error: bool, collected_values: list
     ) -> None:
@@ -107,14 +240,24 @@ class CollateDefault(CollateToBatchList):
         if has_error:
             # do nothing when error occurs
             batch_dict[key] = collected_values
-        elif key in self._special_handlers_keys:
+        else:
+            batch_dict[key] = self._collate_values(key, collected_values)
+
+    def _collate_values(self, key: str, collected_values: list) -> Any:
+        """
+        collate the values of a key
+        :param key: key to collate
+        :param collected values: the values collected from samples
+        :return: the batched values
+        """
+        if key in self._special_handlers_keys:
             # use special handler if specified
-            batch_dict[key] = self._special_handlers_keys[key](collected_values)
+            return self._special_handlers_keys[key](collected_values)
         elif isinstance(collected_values[0], (torch.Tensor, np.ndarray, float, int, str, bytes)):
             # batch with default PyTorch implementation
-            batch_dict[key] = default_collate(collected_values)
+            return default_collate(collected_values)
         else:
-            batch_dict[key] = collected_values
+            return collected_values
 
     @staticmethod
     def just_collect_to_list(values: List[Any]):
@@ -141,22 +284,17 @@ class CollateDefault(CollateToBatchList):
                 len(value.shape) == num_dims
             ), f"Expecting all tensors to have the same dim size, got {len(value.shape)} and {num_dims}"
 
-        # get max per dim
-        max_per_dim = np.amax(np.stack([value.shape for value in values]), axis=0)
+        shapes = [tuple(value.shape) for value in values]
+        if all(shape == shapes[0] for shape in shapes):
+            # nothing to pad
+            return collate_tensor_fn(values)
 
-        # pad
-        def _pad_size(value, dim):
-            assert max_per_dim[dim] >= value.shape[dim]
-            return [0, max_per_dim[dim] - value.shape[dim]]
+        # get max per dim
+        max_per_dim = [max(shape[dim] for shape in shapes) for dim in range(num_dims)]
 
-        padded_values = []
+        # allocate the padded batch once and copy each tensor into its place
+        batch = values[0].new_full([len(values)] + max_per_dim, pad_val)
+        for index, value in enumerate(values):
+            batch[index][tuple(slice(0, size) for size in value.shape)] = value
 
-        for value in values:
-            padding = []
-            # F.pad padding description is expected to be provided in REVERSE order (see torch.nn.functional.pad doc)
-            for dim in reversed(range(num_dims)):
-                padding += _pad_size(value, dim)
-            padded_value = F.pad(value, padding, mode="constant", value=pad_val)
-            padded_values.append(padded_value)
-
-        return default_collate(padded_values)
+        return batch
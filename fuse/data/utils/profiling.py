@@ -0,0 +1,270 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Low overhead instrumentation of the data pipelines - helps to find which op or I/O stage is the bottleneck in a real training run.
+
+When enabled, the following stages are measured:
+    pipeline.<pipeline name>.<op_id>.<op class name> - every op of the static and dynamic pipelines (":batch" suffix for ops applied on a batch)
+    cache.load_sample - reading a sample from the cache (SamplesCacher)
+    dataset.getitem / dataset.getitems - the entire process of getting a sample / a batch (DatasetDefault)
+
+Per stage, a count, the total time and a latency histogram (log2 scale buckets) are kept, so statistics of multiple processes can be merged.
+The DataLoader worker processes periodically dump their statistics into output_dir, and the main process merges them in get_stats().
+
+Usage example:
+    from fuse.data.utils import profiling
+    profiling.enable_profiling()
+    ... # create the DataLoader and train
+    print(profiling.format_report())
+    profiling.export_json("data_profiling.json")
+
+See also fuse.dl.lightning.pl_data_profiling.DataProfilingSummary to log the statistics to TensorBoard.
+"""
+
+import json
+import multiprocessing.util
+import os
+import tempfile
+import time
+from glob import glob
+from typing import Dict, Optional
+
+# environment variable used to enable profiling in processes created with "spawn"
+PROFILING_DIR_ENV_VAR = "FUSE_DATA_PROFILING_DIR"
+
+# histogram bucket i counts the durations d (in microseconds) with 2**(i-1) <= d < 2**i
+NUM_HISTOGRAM_BUCKETS = 40
+
+
+class _ProfilingState:
+    def __init__(self):
+        self.enabled = False
+        self.output_dir = None
+        self.flush_interval_sec = 5.0
+        self.pid = os.getpid()
+        self.stats: Dict[str, list] = {}  # stage -> [count, total_sec, min_sec, max_sec, histogram]
+        self.last_flush = time.monotonic()
+
+
+_state = _ProfilingState()
+
+
+def enable_profiling(output_dir: Optional[str] = None, flush_interval_sec: float = 5.0) -> str:
+    """
+    Enable profiling of the data pipelines, in this process and in worker processes started after this call.
+    :param output_dir: directory for the statistics of worker processes. A new temporary directory will be used if not specified.
+    :param flush_interval_sec: how often a worker process dumps its statistics to output_dir
+    :return: output_dir
+    """
+    if output_dir is None:
+        output_dir = tempfile.mkdtemp(prefix="fuse_data_profiling_")
+    os.makedirs(output_dir, exist_ok=True)
+    _state.enabled = True
+    _state.output_dir = output_dir
+    _state.flush_interval_sec = flush_interval_sec
+    _state.pid = os.getpid()
+    os.environ[PROFILING_DIR_ENV_VAR] = output_dir
+    return output_dir
+
+
+def disable_profiling() -> None:
+    _state.enabled = False
+    os.environ.pop(PROFILING_DIR_ENV_VAR, None)
+
+
+def is_profiling_enabled() -> bool:
+    return _state.enabled
+
+
+def record(stage: str, duration_sec: float) -> None:
+    """
+    Add a measurement. Does nothing when profiling is disabled.
+    :param stage: name of the measured stage
+    :param duration_sec: the measured duration in seconds
+    """
+    if not _state.enabled:
+        return
+
+    if _state.pid != os.getpid():
+        _start_worker()
+
+    stats = _state.stats.get(stage)
+    if stats is None:
+        stats = _state.stats[stage] = [0, 0.0, duration_sec, duration_sec, [0] * NUM_HISTOGRAM_BUCKETS]
+    stats[0] += 1
+    stats[1] += duration_sec
+    if duration_sec < stats[2]:
+        stats[2] = duration_sec
+    if duration_sec > stats[3]:
+        stats[3] = duration_sec
+    stats[4][min(int(duration_sec * 1e6).bit_length(), NUM_HISTOGRAM_BUCKETS - 1)] += 1
+
+    if _state.output_dir is not None and _state.pid != _main_pid:
+        now = time.monotonic()
+        if now - _state.last_flush > _state.flush_interval_sec:
+            _state.last_flush = now
+            flush()
+
+
+def flush() -> None:
+    """
+    Dump the statistics of this process into output_dir, called automatically by worker processes
+    """
+    if _state.output_dir is None or len(_state.stats) == 0:
+        return
+    filename = os.path.join(_state.output_dir, f"stats_{os.getpid()}.json")
+    # write to a temp file and rename, to make sure that the main process will not read a partially written file
+    with open(filename + ".tmp", "w") as f:
+        json.dump(_state.stats, f)
+    os.replace(filename + ".tmp", filename)
+
+
+def get_stats(include_workers: bool = True) -> Dict[str, dict]:
+    """
+    :param include_workers: merge the statistics dumped by the worker processes
+    :return: the raw statistics per stage - count, total_sec, min_sec, max_sec and histogram
+    """
+    all_stats = [_state.stats]
+    if include_workers and _state.output_dir is not None:
+        for filename in glob(os.path.join(_state.output_dir, "stats_*.json")):
+            if filename == os.path.join(_state.output_dir, f"stats_{os.getpid()}.json"):
+                continue
+            try:
+                with open(filename, "r") as f:
+                    all_stats.append(json.load(f))
+            except (OSError, ValueError):
+                # deleted by reset_stats() in the meantime
+                continue
+
+    merged = {}
+    for stats in all_stats:
+        for stage, (count, total_sec, min_sec, max_sec, histogram) in stats.items():
+            if stage not in merged:
+                merged[stage] = dict(
+                    count=0, total_sec=0.0, min_sec=min_sec, max_sec=max_sec, histogram=[0] * NUM_HISTOGRAM_BUCKETS
+                )
+            stage_stats = merged[stage]
+            stage_stats["count"] += count
+            stage_stats["total_sec"] += total_sec
+            stage_stats["min_sec"] = min(stage_stats["min_sec"], min_sec)
+            stage_stats["max_sec"] = max(stage_stats["max_sec"], max_sec)
+            stage_stats["histogram"] = [a + b for a, b in zip(stage_stats["histogram"], histogram)]
+
+    return merged
+
+
+def reset_stats() -> None:
+    """
+    Clear the statistics of this process and the statistics already dumped by worker processes
+    """
+    _state.stats = {}
+    if _state.output_dir is not None:
+        for filename in glob(os.path.join(_state.output_dir, "stats_*.json")):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+
+def get_report(stats: Optional[Dict[str, dict]] = None) -> Dict[str, dict]:
+    """
+    Summarize the statistics per stage, sorted by the total time
+    :param stats: the output of get_stats(), will be called if not specified
+    :return: per stage - count, total_sec, mean_ms, p50_ms, p90_ms, p99_ms, min_ms and max_ms
+    """
+    if stats is None:
+        stats = get_stats()
+
+    report = {}
+    for stage, stage_stats in sorted(stats.items(), key=lambda item: -item[1]["total_sec"]):
+        count = stage_stats["count"]
+        report[stage] = dict(
+            count=count,
+            total_sec=stage_stats["total_sec"],
+            mean_ms=stage_stats["total_sec"] / count * 1e3,
+            p50_ms=_histogram_percentile(stage_stats, 0.5) * 1e3,
+            p90_ms=_histogram_percentile(stage_stats, 0.9) * 1e3,
+            p99_ms=_histogram_percentile(stage_stats, 0.99) * 1e3,
+            min_ms=stage_stats["min_sec"] * 1e3,
+            max_ms=stage_stats["max_sec"] * 1e3,
+        )
+    return report
+
+
+def format_report(report: Optional[Dict[str, dict]] = None) -> str:
+    """
+    :param report: the output of get_report(), will be called if not specified
+    :return: the report as a printable table
+    """
+    if report is None:
+        report = get_report()
+    columns = ["count", "total_sec", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"]
+    stage_width = max([len("stage")] + [len(stage) for stage in report])
+    lines = ["stage".ljust(stage_width) + "".join(f"{column:>12}" for column in columns)]
+    for stage, stage_report in report.items():
+        values = "".join(
+            f"{stage_report[column]:>12d}" if column == "count" else f"{stage_report[column]:>12.3f}"
+            for column in columns
+        )
+        lines.append(stage.ljust(stage_width) + values)
+    return "\n".join(lines)
+
+
+def export_json(filename: str, report: Optional[Dict[str, dict]] = None) -> None:
+    """
+    Save the report (see get_report()) to a json file
+    """
+    if report is None:
+        report = get_report()
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=4)
+
+
+def _histogram_percentile(stage_stats: dict, percentile: float) -> float:
+    """
+    An estimation of the percentile - the upper bound of the relevant histogram bucket
+    """
+    target = percentile * stage_stats["count"]
+    accumulated = 0
+    for bucket, bucket_count in enumerate(stage_stats["histogram"]):
+        accumulated += bucket_count
+        if accumulated >= target and bucket_count > 0:
+            upper_bound_sec = (2**bucket) / 1e6
+            return min(max(upper_bound_sec, stage_stats["min_sec"]), stage_stats["max_sec"])
+    return stage_stats["max_sec"]
+
+
+def _start_worker() -> None:
+    """
+    Called on the first measurement in a new process. The statistics inherited from the parent process (fork) are dropped,
+    and the statistics are dumped when the process exits.
+    """
+    _state.pid = os.getpid()
+    _state.stats = {}
+    _state.last_flush = time.monotonic()
+    multiprocessing.util.Finalize(None, flush, exitpriority=10)
+
+
+def _init_from_env() -> None:
+    # processes created with "spawn" do not inherit the state, but do inherit the environment variables
+    output_dir = os.environ.get(PROFILING_DIR_ENV_VAR, None)
+    if output_dir is not None:
+        _state.enabled = True
+        _state.output_dir = output_dir
+        _state.pid = None
+
+
+_main_pid = os.getpid() if PROFILING_DIR_ENV_VAR not in os.environ else None
+_init_from_env()
@@ -0,0 +1,261 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import copy
+import hashlib
+from collections.abc import Sequence as SequenceABC
+from typing import Any, Hashable, Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+
+# number of sample ids to decode at once when iterating or hashing
+CHUNK_SIZE = 2**16
+
+
+class SampleIdsArray(SequenceABC):
+    """
+    A compact, immutable sequence of sample ids, for datasets with tens of millions of samples.
+    Integer sample ids are stored in a single int64 numpy array.
+    String sample ids are stored as a single utf-8 buffer and an array of offsets (similar to Arrow string arrays).
+    Compared to a python list, it takes a fraction of the memory, it is pickled (sent to DataLoader workers) quickly,
+    and it can be shared by DatasetDefault and subset() without copying.
+    Note that SamplesCacher.cache_samples() still processes the sample ids one by one - it keeps per sample id python
+    dicts (the mapping to the output sample ids and the index of the processed samples), so caching millions of samples
+    temporarily takes the memory of python objects. After caching, DatasetDefault keeps the final sample ids in a SampleIdsArray again
+    (unless the morphed sample ids mix integers and strings).
+
+    Usage example:
+        sample_ids = SampleIdsArray.from_iterable(df["sample_id"])
+        dataset = DatasetDefault(sample_ids, static_pipeline, dynamic_pipeline, cacher=cacher)
+    """
+
+    def __init__(self, values: np.ndarray, offsets: Optional[np.ndarray] = None):
+        """
+        Use from_iterable() to create an instance
+        :param values: int64 array of integer sample ids, or uint8 array - the utf-8 buffer of string sample ids
+        :param offsets: for string sample ids - int64 array of len(sample_ids) + 1 - the start of each sample id in values
+        """
+        self._values = values
+        self._offsets = offsets
+        # optional index, used to find the position of a sample id, see index(). Built on demand and not pickled.
+        self._sorted_keys = None
+        self._sorted_positions = None
+
+    @staticmethod
+    def from_iterable(sample_ids: Iterable[Union[int, str]]) -> "SampleIdsArray":
+        """
+        :param sample_ids: either all integers or all strings
+        """
+        if isinstance(sample_ids, SampleIdsArray):
+            return sample_ids
+        if isinstance(sample_ids, np.ndarray) and sample_ids.dtype.kind in "iu":
+            return SampleIdsArray(sample_ids.astype(np.int64))
+
+        sample_ids = list(sample_ids)
+        if SampleIdsArray._all_int(sample_ids):
+            return SampleIdsArray(np.array(sample_ids, dtype=np.int64))
+        if SampleIdsArray._all_str(sample_ids):
+            encoded = [sample_id.encode("utf-8") for sample_id in sample_ids]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(e) for e in encoded], out=offsets[1:])
+            values = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+            return SampleIdsArray(values, offsets)
+        raise Exception("Error: SampleIdsArray supports either integer sample ids or string sample ids")
+
+    @staticmethod
+    def is_supported(sample_ids: Sequence[Any]) -> bool:
+        """
+        :return: True if from_iterable() can represent the sample ids - either all integers or all strings
+        """
+        return SampleIdsArray._all_int(sample_ids) or SampleIdsArray._all_str(sample_ids)
+
+    @staticmethod
+    def _all_int(sample_ids: Sequence[Any]) -> bool:
+        return all(
+            isinstance(sample_id, (int, np.integer)) and not isinstance(sample_id, bool) for sample_id in sample_ids
+        )
+
+    @staticmethod
+    def _all_str(sample_ids: Sequence[Any]) -> bool:
+        return all(isinstance(sample_id, str) for sample_id in sample_ids)
+
+    @property
+    def is_str(self) -> bool:
+        return self._offsets is not None
+
+    @property
+    def nbytes(self) -> int:
+        return self._values.nbytes + (self._offsets.nbytes if self.is_str else 0)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1 if self.is_str else len(self._values)
+
+    def __getitem__(self, index: Union[int, np.integer, slice, Sequence[int]]) -> Union[int, str, "SampleIdsArray"]:
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if index < 0 or index >= len(self):
+                raise IndexError(index)
+            if self.is_str:
+                return self._values[self._offsets[index] : self._offsets[index + 1]].tobytes().decode("utf-8")
+            return int(self._values[index])
+        if isinstance(index, slice):
+            index = np.arange(len(self))[index]
+        return self.take(index)
+
+    def take(self, indices: Sequence[int]) -> "SampleIdsArray":
+        """
+        :return: a new SampleIdsArray with the sample ids at the specified positions
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if not self.is_str:
+            return SampleIdsArray(self._values[indices])
+
+        starts = self._offsets[indices]
+        lengths = self._offsets[indices + 1] - starts
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # the position of each byte in the source buffer
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1], dtype=np.int64)
+        return SampleIdsArray(self._values[positions], offsets)
+
+    def __iter__(self) -> Iterator[Union[int, str]]:
+        for start in range(0, len(self), CHUNK_SIZE):
+            yield from self._decode_range(start, min(start + CHUNK_SIZE, len(self)))
+
+    def to_list(self) -> List[Union[int, str]]:
+        return list(self)
+
+    def __contains__(self, sample_id: Hashable) -> bool:
+        return self._find(sample_id) is not None
+
+    def index(self, sample_id: Hashable) -> int:
+        """
+        :return: the position of the sample id. An index is built on the first call (O(n)), the following calls are O(log(n))
+        """
+        position = self._find(sample_id)
+        if position is None:
+            raise ValueError(f"{sample_id} is not in SampleIdsArray")
+        return position
+
+    def content_hash(self) -> str:
+        """
+        :return: md5 hex digest of the sorted sample ids - identical to hashing "@".join([str(x) for x in sorted(sample_ids)])
+        """
+        order = self._sorted_order()
+        md5 = hashlib.md5()
+        for start in range(0, len(order), CHUNK_SIZE):
+            chunk = self.take(order[start : start + CHUNK_SIZE])
+            if start > 0:
+                md5.update(b"@")
+            md5.update("@".join([str(x) for x in chunk._decode_range(0, len(chunk))]).encode("utf-8"))
+        return md5.hexdigest()
+
+    def __getstate__(self) -> dict:
+        state = copy.copy(self.__dict__)
+        # the index of string sample ids relies on python's hash() which is not guaranteed to be the same in other processes
+        state["_sorted_keys"] = None
+        state["_sorted_positions"] = None
+        return state
+
+    def __deepcopy__(self, memo: dict) -> "SampleIdsArray":
+        # immutable
+        return self
+
+    def __repr__(self) -> str:
+        return f"SampleIdsArray(len={len(self)}, type={'str' if self.is_str else 'int'}, nbytes={self.nbytes})"
+
+    def _decode_range(self, start: int, end: int) -> List[Union[int, str]]:
+        if not self.is_str:
+            return self._values[start:end].tolist()
+        offsets = (self._offsets[start : end + 1] - self._offsets[start]).tolist()
+        buffer = self._values[self._offsets[start] : self._offsets[end]].tobytes()
+        return [buffer[offsets[i] : offsets[i + 1]].decode("utf-8") for i in range(end - start)]
+
+    def _sorted_order(self) -> np.ndarray:
+        """
+        :return: the positions of the sample ids in sorted order (same order as python's sorted())
+        """
+        if not self.is_str:
+            return np.argsort(self._values, kind="stable")
+        # the order of utf-8 bytes is the order of the unicode code points - same as python's str comparison
+        lengths = np.diff(self._offsets)
+        max_length = max(int(lengths.max()) if len(lengths) > 0 else 0, 1)
+        fixed = np.zeros((len(self), max_length), dtype=np.uint8)
+        rows = np.repeat(np.arange(len(self), dtype=np.int64), lengths)
+        columns = np.arange(len(self._values), dtype=np.int64) - np.repeat(self._offsets[:-1], lengths)
+        fixed[rows, columns] = self._values
+        return np.argsort(fixed.view(f"S{max_length}").ravel(), kind="stable")
+
+    def _find(self, sample_id: Hashable) -> Optional[int]:
+        if self.is_str:
+            if not isinstance(sample_id, str):
+                return None
+            key = hash(sample_id)
+        else:
+            if not isinstance(sample_id, (int, np.integer)):
+                return None
+            key = int(sample_id)
+
+        if self._sorted_keys is None:
+            keys = (
+                self._values
+                if not self.is_str
+                else np.fromiter((hash(x) for x in self), dtype=np.int64, count=len(self))
+            )
+            order = np.argsort(keys, kind="stable")
+            self._sorted_keys = keys[order]
+            self._sorted_positions = order
+
+        first = np.searchsorted(self._sorted_keys, key, side="left")
+        last = np.searchsorted(self._sorted_keys, key, side="right")
+        for candidate in range(first, last):
+            position = int(self._sorted_positions[candidate])
+            # for strings, verify it's not a hash collision
+            if not self.is_str or self[position] == sample_id:
+                return position
+        return None
+
+
+def copy_sample_ids(sample_ids: Any) -> Any:
+    """
+    A copy of a sequence of sample ids, faster than copy.deepcopy() for the common case of a list of strings or integers.
+    SampleIdsArray is immutable and is returned as is.
+    """
+    if isinstance(sample_ids, SampleIdsArray):
+        return sample_ids
+    if isinstance(sample_ids, (list, tuple)) and all(
+        isinstance(sample_id, (str, int, np.integer)) for sample_id in sample_ids
+    ):
+        return list(sample_ids) if isinstance(sample_ids, list) else sample_ids
+    return copy.deepcopy(sample_ids)
+
+
+def get_sample_ids_hash(sample_ids: Sequence[Hashable]) -> str:
+    """
+    md5 hex digest of the sorted sample ids - identical to hashing "@".join([str(x) for x in sorted(sample_ids)]),
+    but without building the entire string in memory
+    """
+    if isinstance(sample_ids, SampleIdsArray):
+        return sample_ids.content_hash()
+    sorted_sample_ids = sorted(sample_ids)
+    md5 = hashlib.md5()
+    for start in range(0, len(sorted_sample_ids), CHUNK_SIZE):
+        if start > 0:
+            md5.update(b"@")
+        md5.update("@".join([str(x) for x in sorted_sample_ids[start : start + CHUNK_SIZE]]).encode("utf-8"))
+    return md5.hexdigest()
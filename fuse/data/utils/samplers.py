@@ -17,9 +17,12 @@ Created on June 30, 2021
 
 """
 
+import logging
 import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from typing import Any, List, Optional, Union, Sequence, Dict
+from typing import Any, Iterable, Iterator, List, Optional, Union, Sequence, Dict
 from torch.utils.data.sampler import Sampler, BatchSampler
 from fuse.data.datasets.dataset_base import DatasetBase
 
@@ -274,3 +277,66 @@ class BatchSamplerDefault(BatchSampler):
         assert len(collected_data) > 0, "Error: sampling failed, dataset size is 0"
         balanced_classes = [sample[self._balanced_class_name] for sample in collected_data]
         return np.array(balanced_classes)
+
+
+class PrefetchingSampler(Sampler):
+    """
+    Wraps a sampler or a batch sampler (for example, BatchSamplerDefault) and publishes the upcoming sample indices to the dataset,
+    so background threads warm the cache of the samples (the OS page cache, or the RAM cache of CacheStorageSharedMemory / CacheStorageTiered)
+    before they are requested, overlapping the storage latency with compute. See DatasetDefault.prefetch().
+
+    Usage:
+        batch_sampler = PrefetchingSampler(BatchSamplerDefault(...), dataset)
+        dataloader = DataLoader(dataset, batch_sampler=batch_sampler, ...)
+
+    Note - DataLoader already asks the sampler for num_workers*prefetch_factor batches in advance,
+    set num_ahead larger than that for the prefetching to be effective.
+    """
+
+    def __init__(self, sampler: Iterable, dataset: DatasetBase, num_ahead: int = 16, num_threads: int = 4) -> None:
+        """
+        :param sampler: the wrapped sampler, yields either sample indices or batches (lists) of sample indices
+        :param dataset: the dataset to prefetch the samples of, must implement prefetch(items)
+        :param num_ahead: the number of items (indices or batches, depending on the wrapped sampler) to prefetch ahead
+        :param num_threads: the number of prefetching threads
+        """
+        self._sampler = sampler
+        self._dataset = dataset
+        self._num_ahead = num_ahead
+        self._num_threads = num_threads
+
+    def __iter__(self) -> Iterator:
+        executor = ThreadPoolExecutor(max_workers=self._num_threads, thread_name_prefix="fuse_prefetch")
+        pending = deque()
+        upcoming = deque()
+        sampler_iter = iter(self._sampler)
+        try:
+            while True:
+                while len(upcoming) <= self._num_ahead:
+                    try:
+                        item = next(sampler_iter)
+                    except StopIteration:
+                        break
+                    upcoming.append(item)
+                    # a future per sample, so the samples of a batch are prefetched in parallel
+                    for index in item if isinstance(item, (list, tuple, np.ndarray)) else [item]:
+                        pending.append(executor.submit(self._prefetch, index))
+                while len(pending) > 0 and pending[0].done():
+                    pending.popleft()
+                if len(upcoming) == 0:
+                    break
+                yield upcoming.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def __len__(self) -> int:
+        return len(self._sampler)
+
+    def _prefetch(self, index: Any) -> None:
+        try:
+            self._dataset.prefetch([index])
+        except Exception:
+            # just a hint, the error (if any) will be raised when the sample is loaded
+            logging.getLogger("Fuse").debug(f"failed to prefetch sample {index}", exc_info=True)
@@ -31,6 +31,7 @@ from fuse.data.utils.collates import CollateDefault
 from fuse.data.pipelines.pipeline_default import PipelineDefault
 from fuse.data.ops.op_base import OpBase
 from fuse.data import get_sample_id
+from fuse.utils.ndict import NDict
 
 
 class OpCustomCollateDefTest(OpBase):
@@ -79,6 +80,46 @@ class TestCollate(unittest.TestCase):
         self.assertListEqual(batch["data.partial"], [1, None, None])
         self.assertFalse("data.not_important" in batch)
 
+    def test_collate_planned(self):
+        def create_sample(index: int, label: Union[int, float]) -> NDict:
+            sample = NDict()
+            sample["data.sample_id"] = f"case_{index}"
+            sample["data.img"] = torch.full((2, 3), float(index))
+            sample["data.np"] = np.full((4,), index)
+            sample["data.label"] = label
+            sample["data.score"] = index / 10
+            sample["data.flag"] = index % 2 == 0
+            sample["data.name"] = str(index)
+            sample["data.np_scalar"] = np.float32(index)
+            sample["data.meta"] = {"x": [index]}
+            sample["data.other"] = [index]
+            sample["data.skip"] = index
+            return sample
+
+        collate = CollateDefault(skip_keys=["data.skip"])
+        for labels in [[0, 1, 2], [3, 4, 5], [0.5, 1, 2]]:
+            samples = [create_sample(i, label) for i, label in enumerate(labels)]
+            batch = collate(samples)
+            # compare to the general path
+            expected = collate([sample.to_dict() for sample in samples])
+            self.assertEqual(set(batch.keys()), set(expected.keys()))
+            self.assertNotIn("data.skip", batch)
+            for key in expected.keys():
+                if isinstance(expected[key], torch.Tensor):
+                    self.assertEqual(batch[key].dtype, expected[key].dtype)
+                    self.assertTrue(torch.equal(batch[key], expected[key]))
+                else:
+                    self.assertEqual(batch[key], expected[key])
+        # one plan for the same set of keys
+        self.assertEqual(len(collate._plans), 1)
+        self.assertEqual(batch["data.label"].dtype, torch.float64)
+
+        # samples with different keys - the general path is used
+        samples = [create_sample(0, 0), create_sample(1, 1)]
+        samples[1]["data.extra"] = 1
+        batch = CollateDefault(raise_error_key_missing=False)(samples)
+        self.assertListEqual(batch["data.extra"], [None, 1])
+
     def test_pad_all_tensors_to_same_size(self):
         a = torch.zeros((1, 1, 3))
         b = torch.ones((1, 2, 1))
@@ -100,6 +141,18 @@ class TestCollate(unittest.TestCase):
         values = CollateDefault.pad_all_tensors_to_same_size([a, b, c])
         self.assertListEqual(list(values.shape), [3, 3, 3, 3])
 
+    def test_pad_all_tensors_to_same_size_values(self):
+        values = [torch.arange(6).reshape(2, 3), torch.arange(4).reshape(4, 1)]
+        batch = CollateDefault.pad_all_tensors_to_same_size(values, pad_val=-1)
+        expected = torch.stack(
+            [
+                torch.nn.functional.pad(values[0], [0, 0, 0, 2], value=-1),
+                torch.nn.functional.pad(values[1], [0, 2, 0, 0], value=-1),
+            ]
+        )
+        self.assertEqual(batch.dtype, torch.int64)
+        self.assertTrue(torch.equal(batch, expected))
+
 
 if __name__ == "__main__":
     unittest.main()
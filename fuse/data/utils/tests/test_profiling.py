@@ -0,0 +1,113 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+from typing import List, Union
+
+import numpy as np
+from torch.utils.data.dataloader import DataLoader
+
+from fuse.data import get_sample_id
+from fuse.data.datasets.caching.samples_cacher import SamplesCacher
+from fuse.data.datasets.dataset_default import DatasetDefault
+from fuse.data.ops.op_base import OpBase
+from fuse.data.ops.ops_cast import OpToTensor
+from fuse.data.pipelines.pipeline_default import PipelineDefault
+from fuse.data.utils import profiling
+from fuse.data.utils.collates import CollateDefault
+from fuse.utils.ndict import NDict
+
+
+class OpFakeLoad(OpBase):
+    def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+        index = int(get_sample_id(sample_dict).split("_")[-1])
+        sample_dict["data.img"] = np.full((4, 4), index, dtype=np.float32)
+        return sample_dict
+
+
+class OpSleep(OpBase):
+    def __call__(self, sample_dict: NDict, duration: float) -> Union[None, dict, List[dict]]:
+        time.sleep(duration)
+        return sample_dict
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        profiling.enable_profiling(os.path.join(self.tmpdir, "profiling"))
+        profiling.reset_stats()
+
+    def test_record_and_report(self):
+        for duration in [0.001] * 98 + [0.1, 0.2]:
+            profiling.record("stage_a", duration)
+        profiling.record("stage_b", 0.5)
+
+        report = profiling.get_report()
+        self.assertEqual(list(report.keys()), ["stage_b", "stage_a"])
+        self.assertEqual(report["stage_a"]["count"], 100)
+        self.assertAlmostEqual(report["stage_a"]["total_sec"], 0.398)
+        self.assertAlmostEqual(report["stage_a"]["max_ms"], 200.0)
+        # an upper bound, up to the resolution of the histogram
+        self.assertTrue(1.0 <= report["stage_a"]["p50_ms"] <= 2.0)
+        self.assertTrue(100.0 <= report["stage_a"]["p99_ms"] <= 200.0)
+        self.assertIn("stage_a", profiling.format_report(report))
+
+        filename = os.path.join(self.tmpdir, "report.json")
+        profiling.export_json(filename)
+        with open(filename, "r") as f:
+            self.assertEqual(json.load(f)["stage_b"]["count"], 1)
+
+        profiling.disable_profiling()
+        profiling.record("stage_c", 0.5)
+        self.assertNotIn("stage_c", profiling.get_report())
+
+    def test_dataloader_workers(self):
+        static_pl = PipelineDefault("static", [(OpFakeLoad(), {})], op_ids=["load"])
+        dynamic_pl = PipelineDefault(
+            "dynamic",
+            [(OpSleep(), dict(duration=0.01)), (OpToTensor(), dict(key="data.img"))],
+            op_ids=["sleep", "to_tensor"],
+        )
+        cacher = SamplesCacher("test_cache", static_pl, os.path.join(self.tmpdir, "cache"), audit_first_sample=False)
+        sample_ids = [f"case_{i}" for i in range(12)]
+        ds = DatasetDefault(sample_ids, static_pl, dynamic_pipeline=dynamic_pl, cacher=cacher)
+        ds.create()
+        profiling.reset_stats()
+
+        dl = DataLoader(ds, batch_size=3, num_workers=2, collate_fn=CollateDefault())
+        self.assertEqual(len(list(dl)), 4)
+
+        # the statistics are dumped by the workers when they exit
+        report = profiling.get_report()
+        self.assertEqual(report["pipeline.dynamic.sleep.OpSleep"]["count"], 12)
+        self.assertGreaterEqual(report["pipeline.dynamic.sleep.OpSleep"]["mean_ms"], 10.0)
+        self.assertEqual(report["pipeline.dynamic.to_tensor.OpToTensor"]["count"], 12)
+        self.assertEqual(report["cache.load_sample"]["count"], 12)
+        self.assertEqual(report["dataset.getitem"]["count"], 12)
+        self.assertEqual(list(report.keys())[0], "dataset.getitem")
+
+    def tearDown(self):
+        profiling.disable_profiling()
+        profiling.reset_stats()
+
+
+if __name__ == "__main__":
+    unittest.main()
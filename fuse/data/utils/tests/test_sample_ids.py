@@ -0,0 +1,126 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import copy
+import hashlib
+import os
+import pickle
+import tempfile
+import unittest
+from glob import glob
+from typing import List, Union
+
+import numpy as np
+
+from fuse.data import get_sample_id
+from fuse.data.datasets.caching.samples_cacher import SamplesCacher
+from fuse.data.datasets.dataset_default import DatasetDefault
+from fuse.data.ops.op_base import OpBase
+from fuse.data.pipelines.pipeline_default import PipelineDefault
+from fuse.data.utils.sample_ids import SampleIdsArray, get_sample_ids_hash
+from fuse.utils.ndict import NDict
+
+
+class OpFakeLoad(OpBase):
+    def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+        sample_dict["data.value"] = len(get_sample_id(sample_dict))
+        return sample_dict
+
+
+class OpSplitOdd(OpBase):
+    """
+    Splits the samples with an odd integer sample id into two samples with string sample ids
+    """
+
+    def __call__(self, sample_dict: NDict, **kwargs) -> Union[None, dict, List[dict]]:
+        sample_id = get_sample_id(sample_dict)
+        if sample_id % 2 == 0:
+            return sample_dict
+        samples = []
+        for suffix in ["a", "b"]:
+            sample = NDict({"data": {"sample_id": f"{sample_id}_{suffix}"}})
+            samples.append(sample)
+        return samples
+
+
+def _legacy_hash(sample_ids: list) -> str:
+    return hashlib.md5("@".join([str(x) for x in sorted(sample_ids)]).encode("utf-8")).hexdigest()
+
+
+class TestSampleIds(unittest.TestCase):
+    def test_sample_ids_array(self):
+        str_ids = [f"case_{i}" for i in range(1000)] + ["", "שלום", "case_aé"]
+        int_ids = list(np.random.RandomState(0).permutation(10**6)[:1000])
+
+        for sample_ids in [str_ids, int_ids]:
+            array = SampleIdsArray.from_iterable(sample_ids)
+            self.assertEqual(len(array), len(sample_ids))
+            self.assertEqual(array.to_list(), sample_ids)
+            self.assertEqual(array[-1], sample_ids[-1])
+            self.assertEqual(array[5:20:3].to_list(), sample_ids[5:20:3])
+            self.assertEqual(array.take([7, 3, 3]).to_list(), [sample_ids[7], sample_ids[3], sample_ids[3]])
+            self.assertEqual(array.index(sample_ids[123]), 123)
+            self.assertIn(sample_ids[999], array)
+            self.assertNotIn("not_a_sample_id", array)
+            self.assertRaises(IndexError, array.__getitem__, len(sample_ids))
+
+            # compatible with the hash of the sample ids used by SamplesCacher
+            self.assertEqual(array.content_hash(), _legacy_hash(sample_ids))
+            self.assertEqual(get_sample_ids_hash(sample_ids), _legacy_hash(sample_ids))
+
+            self.assertIs(copy.deepcopy(array), array)
+            self.assertEqual(pickle.loads(pickle.dumps(array)).to_list(), sample_ids)
+
+        self.assertRaises(Exception, SampleIdsArray.from_iterable, ["a", 1])
+        self.assertTrue(SampleIdsArray.is_supported(str_ids))
+        self.assertTrue(SampleIdsArray.is_supported(int_ids))
+        self.assertFalse(SampleIdsArray.is_supported(["a", 1]))
+
+    def test_dataset(self):
+        tmpdir = tempfile.mkdtemp()
+        sample_ids = [f"case_{i}" for i in range(30)]
+        static_pl = PipelineDefault("static", [(OpFakeLoad(), {})])
+
+        cacher = SamplesCacher("test_cache", static_pl, tmpdir, audit_first_sample=False)
+        ds_list = DatasetDefault(sample_ids, static_pl, cacher=cacher)
+        ds_list.create()
+
+        cacher = SamplesCacher("test_cache", static_pl, tmpdir, audit_first_sample=False)
+        array = SampleIdsArray.from_iterable(sample_ids)
+        ds = DatasetDefault(array, static_pl, cacher=cacher)
+        ds.create()
+        # the compact representation is shared, and the already cached set of samples is found
+        self.assertIs(ds.get_all_sample_ids(), array)
+        self.assertEqual(len(glob(os.path.join(cacher._get_write_dir(), "full_sets_info", "samples_ids_hash@*"))), 1)
+        self.assertEqual([ds[i]["data.value"] for i in range(len(ds))], [ds_list[i]["data.value"] for i in range(30)])
+
+        ds.subset([3, 1, 2])
+        self.assertIsInstance(ds.get_all_sample_ids(), SampleIdsArray)
+        self.assertEqual(ds.get_all_sample_ids().to_list(), ["case_3", "case_1", "case_2"])
+        self.assertEqual(get_sample_id(ds[0]), "case_3")
+
+    def test_dataset_mixed_morphed_sample_ids(self):
+        # sample morphing which results in both integer and string sample ids - kept in a list
+        static_pl = PipelineDefault("static", [(OpSplitOdd(), {})])
+        ds = DatasetDefault(SampleIdsArray.from_iterable([0, 1, 2]), static_pl, allow_uncached_sample_morphing=True)
+        ds.create()
+        self.assertEqual(ds.get_all_sample_ids(), [0, "1_a", "1_b", 2])
+        self.assertEqual([get_sample_id(ds[i]) for i in range(len(ds))], [0, "1_a", "1_b", 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
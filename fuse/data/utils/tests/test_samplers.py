@@ -19,6 +19,7 @@ Created on June 30, 2021
 
 import os
 import tempfile
+import time
 import unittest
 import pandas as pds
 import numpy as np
@@ -34,7 +35,9 @@ from fuse.data.datasets.dataset_default import DatasetDefault
 from fuse.data.datasets.dataset_wrap_seq_to_dict import DatasetWrapSeqToDict
 from fuse.data.utils.collates import CollateDefault
 from fuse.data.pipelines.pipeline_default import PipelineDefault
-from fuse.data.utils.samplers import BatchSamplerDefault
+from fuse.data.datasets.caching.samples_cacher import SamplesCacher
+from fuse.data.datasets.caching.cache_storage import CacheStorageTiered
+from fuse.data.utils.samplers import BatchSamplerDefault, PrefetchingSampler
 
 
 class TestSamplers(unittest.TestCase):
@@ -172,6 +175,37 @@ class TestSamplers(unittest.TestCase):
         self.assertIn(1, batch["data.class"])
         self.assertIn(2, batch["data.class"])
 
+    def test_prefetching_sampler(self):
+        data = {
+            "sample_id": ["a", "b", "c", "d", "e"],
+            "data.values": [7, 4, 9, 2, 4],
+            "data.class": [0, 1, 2, 0, 0],
+        }
+        tmpdir = tempfile.mkdtemp()
+        fast_tier_dir = os.path.join(tmpdir, "fast_tier")
+        storage = CacheStorageTiered(fast_tier_dir, fast_tier_max_bytes=2**20)
+        pipeline = PipelineDefault("test", [(OpReadDataframe(pds.DataFrame(data)), {})])
+        cacher = SamplesCacher("test_prefetch", pipeline, [os.path.join(tmpdir, "cache")], storage=storage)
+        dataset = DatasetDefault(data["sample_id"], static_pipeline=pipeline, cacher=cacher)
+        dataset.create()
+
+        batches = [[0, 1], [2, 3], [4]]
+        sampler = PrefetchingSampler(batches, dataset, num_ahead=3, num_threads=2)
+        self.assertEqual(len(sampler), 3)
+        sampler_iter = iter(sampler)
+        self.assertEqual(next(sampler_iter), [0, 1])
+        # all of the upcoming samples are expected to be prefetched in the background
+        for _ in range(100):
+            if os.path.isdir(fast_tier_dir) and len(os.listdir(fast_tier_dir)) == 5:
+                break
+            time.sleep(0.05)
+        self.assertEqual(list(sampler_iter), [[2, 3], [4]])
+        self.assertEqual(storage.get_stats()["prefetches"], 5)
+
+        for i in range(len(dataset)):
+            self.assertEqual(dataset[i]["data.values"], data["data.values"][i])
+        self.assertEqual((storage.get_stats()["hits"], storage.get_stats()["misses"]), (5, 0))
+
 
 if __name__ == "__main__":
     unittest.main()
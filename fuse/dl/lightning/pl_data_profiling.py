@@ -0,0 +1,87 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import os
+from typing import Optional, Sequence
+
+import pytorch_lightning as pl
+from pytorch_lightning import Callback
+from pytorch_lightning.utilities.rank_zero import rank_zero_only
+
+from fuse.data.utils import profiling
+
+
+class DataProfilingSummary(Callback):
+    """
+    Reports the data pipelines profiling statistics (see fuse.data.utils.profiling) at the end of each epoch:
+    logs the statistics of each stage as scalars (TensorBoard or any other configured logger),
+    saves the full report to a json file and optionally prints it.
+    Profiling is enabled on construction, to include the DataLoader workers which will be started afterwards.
+    """
+
+    def __init__(
+        self,
+        dirpath: Optional[str] = None,
+        filename: str = "data_profiling.json",
+        log_values: Sequence[str] = ("mean_ms", "p90_ms", "total_sec"),
+        verbose: bool = False,
+        sep: str = ".",
+    ):
+        """
+        :param dirpath: location of the json report. Set to None to disable
+        :param filename: the name of the json report
+        :param log_values: the values to log per stage, see profiling.get_report()
+        :param verbose: print the report at the end of each epoch
+        :param sep: separator for the scalars names. use "/" for cleaner tensorboard.
+        """
+        super().__init__()
+        self._dirpath = dirpath
+        self._filename = filename
+        self._log_values = log_values
+        self._verbose = verbose
+        self._sep = sep
+        if not profiling.is_profiling_enabled():
+            profiling.enable_profiling()
+
+    @rank_zero_only
+    def on_train_epoch_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        self._report(trainer)
+
+    @rank_zero_only
+    def on_validation_epoch_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        if trainer.sanity_checking:
+            return
+        self._report(trainer)
+
+    def _report(self, trainer: pl.Trainer) -> None:
+        report = profiling.get_report()
+        if len(report) == 0:
+            return
+
+        metrics = {}
+        for stage, stage_report in report.items():
+            for value_name in self._log_values:
+                metrics[self._sep.join(["data_profiling", stage, value_name])] = stage_report[value_name]
+        for logger in trainer.loggers:
+            logger.log_metrics(metrics, step=trainer.current_epoch)
+
+        if self._dirpath is not None:
+            os.makedirs(self._dirpath, exist_ok=True)
+            profiling.export_json(os.path.join(self._dirpath, self._filename), report)
+
+        if self._verbose:
+            print(f"Data profiling, epoch {trainer.current_epoch}:\n{profiling.format_report(report)}")
@@ -138,16 +138,11 @@ def convert_predictions_to_dataframe(predictions: List[NDict]) -> pd.DataFrame:
     assert len(predictions) > 0
 
     values = {}
-    predictions_per_sample = []
     for elem in predictions:
-        predictions_per_sample += uncollate(elem)
-    if isinstance(predictions_per_sample[0], NDict):
-        keys = predictions_per_sample[0].keypaths()
-    else:  # dict
-        keys = predictions_per_sample[0].keys()
-
-    for key in keys:
-        values[key] = [elem[key] for elem in predictions_per_sample]
+        # columnar - avoids creating a dict per sample
+        samples = uncollate(elem, lazy=True)
+        for key in samples.keys():
+            values.setdefault(key, []).extend(samples.column(key))
 
     df = pd.DataFrame(values)
     return df
@@ -20,6 +20,7 @@ import pytorch_lightning as pl
 from typing import Optional
 
 from fuse.dl.lightning.pl_funcs import *  # noqa
+from fuse.dl.lightning.pl_data_profiling import DataProfilingSummary
 
 
 class LightningModuleDefault(pl.LightningModule):
@@ -41,6 +42,7 @@ class LightningModuleDefault(pl.LightningModule):
         best_epoch_source: Optional[Union[Dict, List[Dict]]] = None,
         save_hyperparameters: Optional[List[str]] = None,
         tensorboard_sep: str = ".",
+        data_profiling: bool = False,
         **kwargs: dict,
     ):
         """
@@ -57,6 +59,7 @@ class LightningModuleDefault(pl.LightningModule):
                                   Either a dict with arguments to pass to ModelCheckpoint or list dicts for multiple ModelCheckpoint callbacks (to monitor and save checkpoints for more then one metric).
         :param save_hyperparameters: specify which hyperparameters you would like to save. Default None.  See pl.LightningModule.save_hyperparameters() for more details.
         :param tensorboard_sep: use "/" for cleaner tensorboard. "." is for backward compatibility.
+        :param data_profiling: profile the data pipelines and log per op statistics at the end of each epoch, see fuse.dl.lightning.pl_data_profiling.DataProfilingSummary
         """
         super().__init__(**kwargs)
         if save_hyperparameters is not None:
@@ -74,6 +77,8 @@ class LightningModuleDefault(pl.LightningModule):
         self._callbacks = callbacks if callbacks is not None else []
         if best_epoch_source is not None:
             self._callbacks += model_checkpoint_callbacks(model_dir, best_epoch_source)
+        if data_profiling:
+            self._callbacks.append(DataProfilingSummary(dirpath=model_dir, sep=tensorboard_sep))
 
         # init state
         self._prediction_keys = None
@@ -71,6 +71,76 @@ class MetricBase(ABC):
         raise NotImplementedError
 
 
+class _CollectedValues:
+    """
+    Growable storage of the values collected for a single name.
+    Batches of numpy arrays are copied into a single preallocated array (doubled when full) - a column per name.
+    Once a value that doesn't fit (different dtype / shape, a per-sample value, a non-array value) is collected,
+    switches to a python list.
+    """
+
+    def __init__(self):
+        self._array = None  # the preallocated buffer, the values are in self._array[: self._size]
+        self._size = 0
+        self._list = None  # used instead of self._array when the values can't be stored in a single array
+        self._list_cache = None  # the values as a list, returned by to_list() until the next change
+
+    def __len__(self) -> int:
+        return len(self._list) if self._list is not None else self._size
+
+    def append(self, value: Any) -> None:
+        self._switch_to_list()
+        self._list.append(value)
+
+    def extend(self, values: Sequence) -> None:
+        if self._list is None and isinstance(values, np.ndarray) and values.ndim > 0:
+            if self._array is None:
+                self._array = np.empty(values.shape, dtype=values.dtype)
+            if values.dtype == self._array.dtype and values.shape[1:] == self._array.shape[1:]:
+                required = self._size + len(values)
+                if required > len(self._array):
+                    # amortized doubling
+                    capacity = max(required, 2 * len(self._array))
+                    array = np.empty((capacity,) + self._array.shape[1:], dtype=self._array.dtype)
+                    array[: self._size] = self._array[: self._size]
+                    self._array = array
+                self._array[self._size : required] = values
+                self._size = required
+                self._list_cache = None
+                return
+
+        self._switch_to_list()
+        self._list.extend(values)
+
+    def to_list(self) -> List[Any]:
+        """
+        :return: the collected values as a list - same as extending a list with each of the collected batches
+        """
+        if self._list is not None:
+            return self._list
+        if self._list_cache is None:
+            self._list_cache = list(self._array[: self._size]) if self._array is not None else []
+        return self._list_cache
+
+    def take(self, permutation: np.ndarray) -> List[Any]:
+        """
+        :return: a list of the values in the specified positions
+        """
+        if self._array is None:
+            values = self.to_list()
+            return [values[i] for i in permutation]
+        if len(permutation) > 0 and permutation.max() >= self._size:
+            raise IndexError(f"index {permutation.max()} is out of bounds, collected {self._size} values")
+        return list(self._array[permutation])
+
+    def _switch_to_list(self) -> None:
+        if self._list is None:
+            self._list = list(self.to_list())
+            self._array = None
+            self._size = 0
+            self._list_cache = None
+
+
 class MetricCollector(MetricBase):
     """
     Collect data for metrics with native support for data sampling
@@ -113,18 +183,35 @@ class MetricCollector(MetricBase):
             batch = NDict(batch)
 
         if self._pre_collect_process_func is not None or self._post_collect_process_func is not None:
-            samples = uncollate(batch)
-            for sample in samples:
+            samples = uncollate(batch, lazy=True)
+            if self._pre_collect_process_func is None:
+                # columnar - the tensors are converted to numpy once per batch instead of once per sample
+                columns = {}
+                for name, key in self._keys_to_collect.items():
+                    column = samples.column(key)
+                    if isinstance(column, torch.Tensor):
+                        column = column.detach().cpu().numpy()
+                        # a numpy view per sample (0-d array for a 1-d tensor) - same as converting the tensor of each sample
+                        column = [column[sample_index, ...] for sample_index in range(len(samples))]
+                    else:
+                        column = [
+                            value.detach().cpu().numpy() if isinstance(value, torch.Tensor) else value
+                            for value in column
+                        ]
+                    columns[name] = column
+            for sample_index in range(len(samples)):
                 if self._pre_collect_process_func is not None:
-                    sample = self._pre_collect_process_func(sample)
+                    sample = self._pre_collect_process_func(samples[sample_index])
 
-                sample_to_collect = {}
-                for name, key in self._keys_to_collect.items():
-                    value = sample[key]
-                    if isinstance(value, torch.Tensor):
-                        value = value.detach().cpu().numpy()
+                    sample_to_collect = {}
+                    for name, key in self._keys_to_collect.items():
+                        value = sample[key]
+                        if isinstance(value, torch.Tensor):
+                            value = value.detach().cpu().numpy()
 
-                    sample_to_collect[name] = value
+                        sample_to_collect[name] = value
+                else:
+                    sample_to_collect = {name: column[sample_index] for name, column in columns.items()}
 
                 if self._post_collect_process_func is not None:
                     sample_to_collect = {"post_args": self._post_collect_process_func(**sample_to_collect)}
@@ -164,6 +251,7 @@ class MetricCollector(MetricBase):
 
         if ids is not None:
             self._collected_ids.extend(ids)
+            self._ids_index = None
 
     @staticmethod
     def sync_tensor_data_and_concat(data: torch.Tensor) -> torch.Tensor:
@@ -251,18 +339,21 @@ class MetricCollector(MetricBase):
 
         if ids is not None:
             self._collected_ids.extend(ids)
+            self._ids_index = None
 
     def reset(self) -> None:
         """
         See super class
         """
         if self._post_collect_process_func is None:
-            self._collected_data = {name: [] for name in self._keys_to_collect}
+            self._collected_data = {name: _CollectedValues() for name in self._keys_to_collect}
         else:
             # collect everything you get from post_collect_process_args
-            self._collected_data = {"post_args": []}
+            self._collected_data = {"post_args": _CollectedValues()}
 
         self._collected_ids = []  # the original collected ids
+        # sample id to position in self._collected_ids and the last permutation - built on demand by get()
+        self._ids_index = None
 
         self._sampled_ids = None  # the required ids - set be sample() method
 
@@ -278,20 +369,25 @@ class MetricCollector(MetricBase):
         each element in the dictionary will be a list of values from all samples
         """
         if ids is None:
-            return copy.copy(self._collected_data)
+            return {name: values.to_list() for name, values in self._collected_data.items()}
         else:
             # convert required ids to permutation
-            original_ids = self._collected_ids
-            required_ids = ids
-            original_ids_pos = {s: i for (i, s) in enumerate(original_ids)}
-
-            # permutation_old = [original_ids.index(sample_id) for sample_id in required_ids]  #16.399551391601562
-            permutation = [original_ids_pos[sample_id] for sample_id in required_ids]  # 0.008132457733154297 seconds
+            # metrics that share a collector typically ask for the same ids - reuse the permutation of the previous call
+            ids = list(ids)
+            if self._ids_index is not None and ids == self._ids_index["required_ids"]:
+                permutation = self._ids_index["permutation"]
+            else:
+                if self._ids_index is None:
+                    original_ids_pos = {s: i for (i, s) in enumerate(self._collected_ids)}
+                else:
+                    original_ids_pos = self._ids_index["original_ids_pos"]
+                permutation = np.array(list(map(original_ids_pos.__getitem__, ids)), dtype=np.int64)
+                self._ids_index = dict(original_ids_pos=original_ids_pos, required_ids=ids, permutation=permutation)
 
             # create the permuted dictionary
             data = {}
             for name, values in self._collected_data.items():
-                data[name] = [values[i] for i in permutation]
+                data[name] = values.take(permutation)
 
             return data
 
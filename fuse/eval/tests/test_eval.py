@@ -18,6 +18,9 @@ Created on June 30, 2021
 """
 
 from distutils.log import warn
+import os
+import shutil
+import tempfile
 import unittest
 
 
@@ -50,6 +53,16 @@ from fuse.eval.examples.examples_segmentation import (
 
 
 class TestEval(unittest.TestCase):
+    def setUp(self) -> None:
+        # the examples write their outputs (plots, ensemble results) to the working directory
+        self._orig_cwd = os.getcwd()
+        self._output_dir = tempfile.mkdtemp()
+        os.chdir(self._output_dir)
+
+    def tearDown(self) -> None:
+        os.chdir(self._orig_cwd)
+        shutil.rmtree(self._output_dir, ignore_errors=True)
+
     def test_eval_example_0(self):
         results = example_0()
         self.assertEqual(results["metrics.auc"], 0.845)
@@ -0,0 +1,71 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import unittest
+
+import numpy as np
+import torch
+
+from fuse.eval.metrics.metrics_common import MetricCollector
+
+
+class TestMetricCollector(unittest.TestCase):
+    def test_collect_and_get(self):
+        collector = MetricCollector(pred="model.output", target="data.label", meta="data.meta")
+        expected_pred = []
+        for batch_index in range(5):
+            ids = [f"id_{batch_index}_{i}" for i in range(3)]
+            pred = torch.rand(3, 2)
+            expected_pred.extend(pred.numpy())
+            meta = ["a", "b", "c"] if batch_index < 4 else np.array([1, 2, 3])
+            collector.collect(
+                {"data.sample_id": ids, "model.output": pred, "data.label": torch.tensor([0, 1, 0]), "data.meta": meta}
+            )
+
+        data = collector.get()
+        self.assertEqual(len(data["pred"]), 15)
+        self.assertTrue(all(np.array_equal(a, b) for a, b in zip(data["pred"], expected_pred)))
+        self.assertEqual(data["target"], [0, 1, 0] * 5)
+        self.assertEqual(data["meta"], ["a", "b", "c"] * 4 + [1, 2, 3])
+
+        ids = ["id_4_2", "id_0_1", "id_2_0"]
+        data = collector.get(ids)
+        self.assertTrue(np.array_equal(np.stack(data["pred"]), np.stack([expected_pred[i] for i in [14, 1, 6]])))
+        self.assertEqual(data["target"], [0, 1, 0])
+        self.assertEqual(data["meta"], [3, "b", "a"])
+
+        # the index of the ids is updated when new data is collected
+        collector.collect(
+            {
+                "data.sample_id": ["id_5_0"],
+                "model.output": torch.zeros(1, 2),
+                "data.label": torch.tensor([1]),
+                "data.meta": ["d"],
+            }
+        )
+        data = collector.get(["id_5_0", "id_4_2"])
+        self.assertEqual(data["target"], [1, 0])
+        self.assertEqual(data["meta"], ["d", 3])
+        with self.assertRaises(KeyError):
+            collector.get(["unknown_id"])
+
+        collector.reset()
+        self.assertEqual(collector.get(), {"pred": [], "target": [], "meta": []})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1 +1 @@
-from fuse.utils.data.collate import CollateToBatchList
+from fuse.utils.data.collate import CollateToBatchList, UncollatedBatch, uncollate
@@ -17,7 +17,8 @@ Created on June 30, 2021
 
 """
 import logging
-from typing import Callable, Dict, List, Sequence, Tuple, Any
+from collections.abc import Sequence as SequenceABC
+from typing import Callable, Dict, List, Sequence, Tuple, Any, Union
 
 from fuse.utils import NDict
 
@@ -108,10 +109,12 @@ class CollateToBatchList(Callable):
         return collected_values, has_error, has_missing_values
 
 
-def uncollate(batch: Dict) -> List[Dict]:
+def uncollate(batch: Dict, lazy: bool = False) -> Union[List[Dict], "UncollatedBatch"]:
     """
     Reverse collate method
     Gets a batch_dict and convert it back to list of samples
+    :param lazy: return an UncollatedBatch - a columnar view of the batch which creates the per-sample dicts only on demand.
+                 Recommended for large batches, especially when only a few keys are required (see UncollatedBatch.column()).
     """
     # empty batch
     if not batch.keys():
@@ -134,20 +137,118 @@ def uncollate(batch: Dict) -> List[Dict]:
     if batch_size is None:
         return batch  # assuming batch dict with no samples
 
-    samples = [NDict() for _ in range(batch_size)]
-    for key in batch.keys():
-        values = batch[key]
-        for sample_index in range(batch_size):
+    uncollated = UncollatedBatch(batch, batch_size)
+    if lazy:
+        return uncollated
+    return uncollated.to_list()
 
+
+class UncollatedBatch(SequenceABC):
+    """
+    Columnar (struct of arrays) view of a batch, returned by uncollate(batch, lazy=True).
+    Keeps the values of the batch per key, and creates the per-sample NDict only when a sample is accessed.
+    Values that are not a tensor, a numpy array or a list are broadcasted to all of the samples.
+
+    Example:
+        samples = uncollate(batch, lazy=True)
+        preds = samples.column("model.output", to_numpy=True)  # the tensor is converted to numpy once, preds[i] is a view
+        sample = samples[3]  # NDict of a single sample
+    """
+
+    def __init__(self, batch: Dict, batch_size: int):
+        """
+        :param batch: the batch dict (flat)
+        :param batch_size: the number of samples in the batch
+        """
+        self._batch = batch
+        self._batch_size = batch_size
+
+    def __len__(self) -> int:
+        return self._batch_size
+
+    def keys(self) -> List[str]:
+        return list(self._batch.keys())
+
+    def column(self, key: str, to_numpy: bool = False) -> Sequence:
+        """
+        :param key: the key to get
+        :param to_numpy: convert a tensor to a numpy array (once for the entire batch)
+        :return: the values of key for all of the samples - the batched value as is, or a list with the broadcasted value.
+                 If key is a branch (e.g. "data" of "data.img"), a list of per-sample NDicts of the sub-keys.
+        """
+        values = self._batch[key]
+        if isinstance(values, dict):
+            prefix = key + "."
+            sub_keys = [k for k in self._batch.keys() if k.startswith(prefix)]
+            sub_columns = {k[len(prefix) :]: self.column(k, to_numpy=to_numpy) for k in sub_keys}
+            return [
+                NDict({k: sub_column[index] for k, sub_column in sub_columns.items()}, already_flat=True)
+                for index in range(self._batch_size)
+            ]
+        if isinstance(values, torch.Tensor):
+            return values.detach().cpu().numpy() if to_numpy else values
+        if isinstance(values, (np.ndarray, list)):
+            return values
+        return [values] * self._batch_size
+
+    def get_value(self, index: int, key: str) -> Any:
+        """
+        :return: the value of key in sample index, without creating the sample
+        """
+        values = self._batch[key]
+        if isinstance(values, (np.ndarray, torch.Tensor, list)):
+            return values[index]
+        return values
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[NDict, List[NDict]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._batch_size))]
+        if index < 0:
+            index += self._batch_size
+        if index < 0 or index >= self._batch_size:
+            raise IndexError(index)
+        sample = NDict()
+        for key, values in self._batch.items():
             if isinstance(values, (np.ndarray, torch.Tensor, list)):
                 try:
-                    samples[sample_index][key] = values[sample_index]
+                    sample[key] = values[index]
                 except IndexError:
                     logging.error(
-                        f"Error - IndexError - key={key}, batch_size={batch_size}, type={type((batch[key]))}, len={len(batch[key])}"
+                        f"Error - IndexError - key={key}, batch_size={self._batch_size}, type={type(values)}, len={len(values)}"
                     )
                     raise
             else:
-                samples[sample_index][key] = values  # broadcast single value for all batch
+                sample[key] = values  # broadcast single value for all batch
+        return sample
+
+    def to_list(self) -> List[NDict]:
+        """
+        Create all of the samples. Each value is split once per key (for example with tensor.unbind()), rather than indexed per sample.
+        """
+        samples = [{} for _ in range(self._batch_size)]
+        # values that should be flattened by NDict
+        nested = []
+        for key, values in self._batch.items():
+            if isinstance(values, torch.Tensor):
+                per_sample = values.unbind(0)
+            elif isinstance(values, (np.ndarray, list)):
+                per_sample = list(values)
+            else:
+                per_sample = [values] * self._batch_size  # broadcast single value for all batch
+
+            if len(per_sample) < self._batch_size:
+                logging.error(
+                    f"Error - IndexError - key={key}, batch_size={self._batch_size}, type={type(values)}, len={len(values)}"
+                )
+                raise IndexError(f"key {key} has {len(per_sample)} values, expected {self._batch_size}")
+
+            for sample_index, (sample, value) in enumerate(zip(samples, per_sample)):
+                if isinstance(value, dict):
+                    nested.append((sample_index, key, value))
+                else:
+                    sample[key] = value
 
-    return samples
+        samples = [NDict(sample, already_flat=True) for sample in samples]
+        for sample_index, key, value in nested:
+            samples[sample_index][key] = value
+        return samples
@@ -1,6 +1,10 @@
 import unittest
 
-from fuse.utils.data import CollateToBatchList
+import numpy as np
+import torch
+
+from fuse.utils.data import CollateToBatchList, UncollatedBatch, uncollate
+from fuse.utils.ndict import NDict
 
 
 class TestTimer(unittest.TestCase):
@@ -13,6 +17,43 @@ class TestTimer(unittest.TestCase):
         y = col(x)
         self.assertEqual(y.to_dict(), ref)
 
+    def test_uncollate(self):
+        batch = NDict()
+        batch["data.sample_id"] = ["a", "b", "c"]
+        batch["model.output"] = torch.arange(6, dtype=torch.float32).reshape(3, 2)
+        batch["model.pred"] = np.array([0, 1, 0])
+        batch["data.epoch"] = 7
+        batch["data.meta"] = [{"x": 1}, {"x": 2}, {"x": 3}]
+
+        samples = uncollate(batch)
+        lazy_samples = uncollate(batch, lazy=True)
+        self.assertIsInstance(lazy_samples, UncollatedBatch)
+        self.assertEqual(len(samples), 3)
+        self.assertEqual(len(lazy_samples), 3)
+        for index in range(3):
+            for sample in [samples[index], lazy_samples[index]]:
+                self.assertIsInstance(sample, NDict)
+                self.assertEqual(sample["data.sample_id"], "abc"[index])
+                self.assertTrue(torch.equal(sample["model.output"], batch["model.output"][index]))
+                self.assertEqual(sample["model.pred"], batch["model.pred"][index])
+                self.assertEqual(sample["data.epoch"], 7)
+                self.assertEqual(sample["data.meta.x"], index + 1)
+
+        # columnar access
+        self.assertIsInstance(lazy_samples.column("model.output", to_numpy=True), np.ndarray)
+        self.assertListEqual(lazy_samples.column("data.epoch"), [7, 7, 7])
+        self.assertEqual(lazy_samples.get_value(1, "data.sample_id"), "b")
+        model_column = lazy_samples.column("model")
+        self.assertEqual(len(model_column), 3)
+        self.assertEqual(model_column[2]["pred"], 0)
+        self.assertTrue(torch.equal(model_column[2]["output"], batch["model.output"][2]))
+        self.assertEqual([s["data.sample_id"] for s in lazy_samples[1:]], ["b", "c"])
+
+        # inconsistent batch size
+        batch["model.pred"] = np.array([0, 1])
+        with self.assertRaises(IndexError):
+            uncollate(batch)
+
 
 if __name__ == "__main__":
     unittest.main()
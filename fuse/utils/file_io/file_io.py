@@ -24,6 +24,71 @@ from fuse.utils.misc.misc import Misc
 # and when using, import tables  before everything else
 
 
+# supported codecs for compress_bytes/decompress_bytes, and the file extension used for each of them
+# note - lz4 and zstd require installing the optional packages "lz4" and "zstandard"
+COMPRESSION_CODECS_EXTENSIONS = {"none": "", "gzip": ".gz", "lz4": ".lz4", "zstd": ".zst"}
+
+
+def compress_bytes(data: bytes, codec: str = "gzip", level: Optional[int] = None) -> bytes:
+    """
+    Compresses bytes with the specified codec
+    :param codec: one of COMPRESSION_CODECS_EXTENSIONS keys
+    :param level: optional compression level, None for the codec default
+    """
+    if codec == "none":
+        return data
+    elif codec == "gzip":
+        return gzip.compress(data, compresslevel=9 if level is None else level)
+    elif codec == "lz4":
+        return _import_codec_module("lz4").frame.compress(data, compression_level=0 if level is None else level)
+    elif codec == "zstd":
+        return _import_codec_module("zstd").ZstdCompressor(level=3 if level is None else level).compress(data)
+    raise Exception(f"unsupported codec {codec}, supported codecs are {list(COMPRESSION_CODECS_EXTENSIONS.keys())}")
+
+
+def decompress_bytes(data: bytes, codec: str = "gzip") -> bytes:
+    """
+    Decompresses bytes compressed by compress_bytes()
+    :param codec: one of COMPRESSION_CODECS_EXTENSIONS keys
+    """
+    if codec == "none":
+        return data
+    elif codec == "gzip":
+        return gzip.decompress(data)
+    elif codec == "lz4":
+        return _import_codec_module("lz4").frame.decompress(data)
+    elif codec == "zstd":
+        return _import_codec_module("zstd").ZstdDecompressor().decompress(data)
+    raise Exception(f"unsupported codec {codec}, supported codecs are {list(COMPRESSION_CODECS_EXTENSIONS.keys())}")
+
+
+def get_codec_from_filename(filename: str) -> str:
+    """
+    infers the codec from the file extension, see COMPRESSION_CODECS_EXTENSIONS
+    """
+    for codec, ext in COMPRESSION_CODECS_EXTENSIONS.items():
+        if ext != "" and filename.endswith(ext):
+            return codec
+    return "none"
+
+
+def _import_codec_module(codec: str) -> Any:
+    try:
+        if codec == "lz4":
+            import lz4.frame
+
+            return lz4
+        elif codec == "zstd":
+            import zstandard
+
+            return zstandard
+    except ImportError:
+        raise Exception(
+            f'codec {codec} requires an optional package, install it with "pip install {"lz4" if codec == "lz4" else "zstandard"}"'
+        )
+    raise Exception(f"unexpected codec {codec}")
+
+
 def save_pickle(obj: Any, output_filename: str, compress: bool = False, verbose: int = 0) -> None:
     """
     Pickles object to a file, optionally compressing it.
@@ -49,17 +114,41 @@ def load_pickle(filename: str) -> Any:
         use_open = gzip.open
     elif filename.endswith(".pbz2"):
         use_open = bz2.open
+    elif filename.endswith(COMPRESSION_CODECS_EXTENSIONS["lz4"]) or filename.endswith(
+        COMPRESSION_CODECS_EXTENSIONS["zstd"]
+    ):
+        with open(filename, "rb") as f:
+            return pickle.loads(decompress_bytes(f.read(), get_codec_from_filename(filename)))
     with use_open(filename, "rb") as f:
         return pickle.load(f)
 
 
-def save_pickle_safe(obj: Any, output_filename: str, compress: bool = False, verbose: bool = 0) -> None:
+def save_pickle_safe(
+    obj: Any,
+    output_filename: str,
+    compress: bool = False,
+    verbose: bool = 0,
+    codec: Optional[str] = None,
+    codec_level: Optional[int] = None,
+) -> None:
     """
     a multi-threading/multi-process safe version of save_pickle()
+    :param codec: optional, overrides compress - one of COMPRESSION_CODECS_EXTENSIONS keys.
+        the extension of output_filename is expected to match the codec (see COMPRESSION_CODECS_EXTENSIONS) so load_pickle() will be able to load it.
+    :param codec_level: optional compression level for the codec
     """
 
     scrambed_filename = get_randomized_postfix_name(output_filename)
 
+    if codec is not None:
+        data = compress_bytes(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), codec=codec, level=codec_level)
+        with open(scrambed_filename, "wb") as f:
+            f.write(data)
+        os.rename(scrambed_filename, output_filename)
+        if verbose > 0:
+            print("saved pickle: ", output_filename)
+        return output_filename
+
     use_open = gzip.open if compress else open
     if compress and not output_filename.endswith(".gz"):
         output_filename += ".gz"
@@ -176,11 +265,13 @@ def create_simple_timestamp_file(file_path: str) -> None:
         f.close()
 
 
-def save_hdf5_safe(filename: str, use_blosc: bool = True, **kwarrays):
+def save_hdf5_safe(filename: str, use_blosc: bool = True, blosc_kwargs: Optional[dict] = None, **kwarrays):
     """
     multi-threading and multi-processing safe saving content to hdf5 file
     args:
         use_blosc: uses the blosc compression algorithm
+        blosc_kwargs: optional arguments for hdf5plugin.Blosc - cname (sub codec, for example "lz4", "zstd"), clevel and shuffle.
+            The compression settings are stored in the hdf5 file, so loading does not require knowing them.
     """
     # first validate the request
     for k, d in kwarrays.items():
@@ -194,7 +285,7 @@ def save_hdf5_safe(filename: str, use_blosc: bool = True, **kwarrays):
         for k, d in kwarrays.items():
             _use_kwargs = {}
             if use_blosc:
-                _use_kwargs = hdf5plugin.Blosc()
+                _use_kwargs = hdf5plugin.Blosc(**(blosc_kwargs or {}))
             h5f.create_dataset(k, data=d, **_use_kwargs)
 
     os.rename(scrambed_filename, filename)  # '.' + saved_tensors_format)
@@ -1,2 +1,8 @@
-from .run_multiprocessed import run_multiprocessed, get_from_global_storage
+from .run_multiprocessed import (
+    run_multiprocessed,
+    get_from_global_storage,
+    PersistentPool,
+    get_persistent_pool,
+    shutdown_persistent_pools,
+)
 from .helpers import get_chunks_ranges
@@ -1,6 +1,15 @@
+import atexit
 import functools
-from typing import Any, List, Optional
+import pickle
+import shutil
+import sys
+import tempfile
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 from fuse.utils.utils_debug import FuseDebug
+from fuse.utils.ndict import NDict
+import numpy as np
 import torch
 from tqdm import tqdm
 import multiprocessing as mp
@@ -17,6 +26,15 @@ Typically, you'd only need to call get_from_global_storage from your worker_func
 """
 _multiprocess_global_storage = {}
 
+# "guided" chunksize - the size of each chunk is the number of the remaining tasks divided by GUIDED_CHUNKS_FACTOR * workers
+GUIDED_CHUNKS_FACTOR = 4
+
+# with shared_memory_results, numpy arrays of at least this size (in bytes) are returned from the workers through shared memory
+SHARED_MEMORY_MIN_BYTES = 2**20
+
+# multiprocessing.shared_memory (used by shared_memory_results) requires python 3.8
+_SHARED_MEMORY_SUPPORTED = sys.version_info >= (3, 8)
+
 
 def run_multiprocessed(
     worker_func,
@@ -28,6 +46,11 @@ def run_multiprocessed(
     as_iterator=False,
     mp_context: Optional[str] = None,
     desc: Optional[str] = None,
+    chunksize: Union[int, str] = 1,
+    persistent_pool: bool = False,
+    global_storage_key: Optional[str] = None,
+    task_cost: Optional[Callable[[Any], float]] = None,
+    shared_memory_results: bool = False,
 ) -> List[Any]:
     """
     Args:
@@ -50,6 +73,20 @@ def run_multiprocessed(
          or in the case that you want to parallelize some calculation with the generation.
          if False, the answers will be accumulated to a list and returned.
     :param mp_context: "fork", "spawn", "thread" or None for multiprocessing default
+    :param chunksize: the number of tasks sent to a worker at once - larger chunks reduce the communication overhead.
+        Set to "guided" for tasks with uneven durations: the chunks get smaller towards the end, and since idle workers pull the next chunk
+        from a shared queue, no worker is left waiting for a single long chunk.
+    :param persistent_pool: reuse warm worker processes between calls (see PersistentPool) instead of creating a new pool for each call.
+    :param global_storage_key: relevant only with persistent_pool - identifies the content of copy_to_global_storage.
+        Calls with the same key ship copy_to_global_storage to the workers only once. Use a new key whenever the content changes.
+        None to ship it for this call only.
+    :param task_cost: optional cost hint - a function that gets an element of args_list and returns its estimated cost, for example the size of its file.
+        The tasks are dispatched from the most expensive to the cheapest, so a single huge task at the end of args_list will not create a long tail.
+        The order of the results is not affected (see keep_results_order). With chunksize="guided" the chunks are balanced by cost.
+    :param shared_memory_results: return the large numpy arrays (see SHARED_MEMORY_MIN_BYTES) within the results of the workers through shared memory,
+        instead of pickling them through a single pipe. Useful when the results are large, for example samples with images.
+        torch tensors are already returned through shared memory by torch.
+        Requires python 3.8 or later (multiprocessing.shared_memory), on older versions the results are pickled as usual.
     Returns:
         if as_iterator is set to True, returns an iterator.
         Otherwise, returns a list of results from calling func
@@ -64,6 +101,11 @@ def run_multiprocessed(
         keep_results_order=keep_results_order,
         mp_context=mp_context,
         desc=desc,
+        chunksize=chunksize,
+        persistent_pool=persistent_pool,
+        global_storage_key=global_storage_key,
+        task_cost=task_cost,
+        shared_memory_results=shared_memory_results,
     )
 
     if as_iterator:
@@ -82,6 +124,11 @@ def _run_multiprocessed_as_iterator_impl(
     keep_results_order: bool = True,
     mp_context: Optional[str] = None,
     desc: Optional[str] = None,
+    chunksize: Union[int, str] = 1,
+    persistent_pool: bool = False,
+    global_storage_key: Optional[str] = None,
+    task_cost: Optional[Callable[[Any], float]] = None,
+    shared_memory_results: bool = False,
 ) -> List[Any]:
     """
     an iterator version of run_multiprocessed - useful when the accumulated answer is too large to fit in memory
@@ -103,6 +150,11 @@ def _run_multiprocessed_as_iterator_impl(
         keep_results_order: determined if imap or imap_unordered is used. if strict_answers_order is set to False, then results will be ordered by their readiness.
             if strict_answers_order is set to True, the answers will be provided at the same order as defined in the args_list
     :param mp_context: "fork", "spawn", "thread" or None for multiprocessing default
+    :param chunksize: see run_multiprocessed()
+    :param persistent_pool: see run_multiprocessed()
+    :param global_storage_key: see run_multiprocessed()
+    :param task_cost: see run_multiprocessed()
+    :param shared_memory_results: see run_multiprocessed()
     """
     if "DEBUG_SINGLE_PROCESS" in os.environ and os.environ["DEBUG_SINGLE_PROCESS"] in ["T", "t", "True", "true", 1]:
         workers = None
@@ -116,6 +168,7 @@ def _run_multiprocessed_as_iterator_impl(
         cprint("Due to the FuseDebug mode, run_multiprocessed is not using multiprocessing", "red")
 
     assert callable(worker_func)
+    shared_memory_results = shared_memory_results and _SHARED_MEMORY_SUPPORTED
 
     if verbose < 1:
         tqdm_func = lambda x: x
@@ -139,6 +192,24 @@ def _run_multiprocessed_as_iterator_impl(
         assert isinstance(workers, int)
         assert workers >= 0
 
+        if persistent_pool:
+            pool = get_persistent_pool(workers, mp_context)
+            if verbose > 0:
+                cprint(f"using a persistent multiprocess pool with {workers} workers.", "cyan")
+            results = pool.imap(
+                worker_func,
+                args_list,
+                copy_to_global_storage=copy_to_global_storage,
+                global_storage_key=global_storage_key,
+                keep_results_order=keep_results_order,
+                chunksize=chunksize,
+                task_cost=task_cost,
+                shared_memory_results=shared_memory_results,
+            )
+            for curr_ans in tqdm(results, desc=desc, total=len(args_list), smoothing=0.1, disable=verbose < 1):
+                yield curr_ans
+            return
+
         if mp_context == "thread":
             from multiprocessing.pool import ThreadPool
 
@@ -148,17 +219,197 @@ def _run_multiprocessed_as_iterator_impl(
         else:
             pool = mp.get_context(mp_context).Pool
 
-        worker_func = functools.partial(worker_func_wrapper, worker_func=worker_func)
+        shared_memory_results = shared_memory_results and mp_context != "thread"
+        if shared_memory_results:
+            _ensure_resource_tracker()
+        task_func = functools.partial(
+            _run_chunk,
+            worker_func=worker_func,
+            shared_memory_min_bytes=SHARED_MEMORY_MIN_BYTES if shared_memory_results else None,
+        )
         with pool(processes=workers, initializer=_store_in_global_storage, initargs=(copy_to_global_storage,)) as pool:
             if verbose > 0:
                 cprint(f"multiprocess pool created with {workers} workers.", "cyan")
-            map_func = pool.imap if keep_results_order else pool.imap_unordered
-            for curr_ans in tqdm_func(
-                map_func(worker_func, args_list), total=len(args_list), smoothing=0.1, disable=verbose < 1
-            ):
+            results = _imap_chunks(
+                pool, task_func, args_list, workers, chunksize, keep_results_order, task_cost, shared_memory_results
+            )
+            for curr_ans in tqdm(results, desc=desc, total=len(args_list), smoothing=0.1, disable=verbose < 1):
                 yield curr_ans
 
 
+def _get_chunks(
+    num_tasks: int, workers: int, chunksize: Union[int, str], costs: Optional[Sequence[float]] = None
+) -> List[Tuple[int, int]]:
+    """
+    Split the tasks to chunks
+    :param chunksize: a fixed chunk size or "guided" - decreasing chunk sizes
+    :param costs: optional estimated cost per task, used to balance the "guided" chunks by cost rather than by the number of tasks
+    :return: list of (start, end) ranges
+    """
+    if chunksize == "guided":
+        if costs is None:
+            costs = [1.0] * num_tasks
+        remaining_cost = float(sum(costs))
+        chunks = []
+        start = 0
+        while start < num_tasks:
+            target_cost = remaining_cost / (GUIDED_CHUNKS_FACTOR * workers)
+            end = start + 1
+            chunk_cost = costs[start]
+            while end < num_tasks and chunk_cost + costs[end] <= target_cost:
+                chunk_cost += costs[end]
+                end += 1
+            chunks.append((start, end))
+            remaining_cost -= chunk_cost
+            start = end
+        return chunks
+
+    if not isinstance(chunksize, int) or chunksize < 1:
+        raise Exception(f"Error: chunksize must be a positive integer or 'guided', got {chunksize}")
+    return [(start, min(start + chunksize, num_tasks)) for start in range(0, num_tasks, chunksize)]
+
+
+def _imap_chunks(
+    pool: Any,
+    task_func: Callable,
+    args_list: Sequence,
+    workers: int,
+    chunksize: Union[int, str],
+    keep_results_order: bool,
+    task_cost: Optional[Callable[[Any], float]] = None,
+    shared_memory_results: bool = False,
+) -> Iterator[Any]:
+    """
+    Send the tasks to the pool in chunks, and yield the results of the individual tasks.
+    The pool workers pull the chunks from a shared queue, so a worker that finished its chunk takes the next one.
+    :param task_func: a function that gets (chunk index, list of arguments) and returns (chunk index, list of results)
+    :param task_cost: optional cost hint, the most expensive tasks are dispatched first
+    :param shared_memory_results: task_func returns the large arrays through shared memory (see _to_shared_memory())
+    """
+    restore = _from_shared_memory if shared_memory_results else lambda ans: ans
+    num_tasks = len(args_list)
+    if task_cost is None:
+        order = range(num_tasks)
+        chunks = _get_chunks(num_tasks, workers, chunksize)
+    else:
+        costs = [task_cost(args_list[i]) for i in range(num_tasks)]
+        order = sorted(range(num_tasks), key=lambda i: -costs[i])
+        chunks = _get_chunks(num_tasks, workers, chunksize, [costs[i] for i in order])
+    tasks = ((chunk_index, [args_list[i] for i in order[start:end]]) for chunk_index, (start, end) in enumerate(chunks))
+
+    if task_cost is None or not keep_results_order:
+        map_func = pool.imap if keep_results_order else pool.imap_unordered
+        for _, chunk_ans in map_func(task_func, tasks):
+            for ans in chunk_ans:
+                yield restore(ans)
+        return
+
+    # the tasks are dispatched by cost - restore the order of args_list
+    pending = {}
+    next_index = 0
+    for chunk_index, chunk_ans in pool.imap_unordered(task_func, tasks):
+        start, end = chunks[chunk_index]
+        pending.update(zip(order[start:end], chunk_ans))
+        while next_index in pending:
+            yield restore(pending.pop(next_index))
+            next_index += 1
+
+
+def _run_chunk(
+    task: Tuple[int, List[Any]], worker_func: Callable, shared_memory_min_bytes: Optional[int] = None
+) -> Tuple[int, List[Any]]:
+    torch.set_num_threads(1)
+    chunk_index, chunk = task
+    return chunk_index, [_to_shared_memory(worker_func(args), shared_memory_min_bytes) for args in chunk]
+
+
+def _ensure_resource_tracker() -> None:
+    """
+    Start the resource tracker before starting the workers, otherwise each worker will start its own tracker which will
+    consider the shared memory blocks returned to the main process (and released by it) as leaked
+    """
+    if not _SHARED_MEMORY_SUPPORTED:
+        return
+    from multiprocessing import resource_tracker  # python 3.8
+
+    resource_tracker.ensure_running()
+
+
+class _SharedArray:
+    """
+    A handle of a numpy array in shared memory, returned by a worker instead of the array (see shared_memory_results)
+    """
+
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype: np.dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+
+def _to_shared_memory(obj: Any, min_bytes: Optional[int]) -> Any:
+    """
+    Move the large numpy arrays in obj (recursively in dicts, lists and tuples) to shared memory, replacing them with handles.
+    :param min_bytes: the minimal size of an array to move, None to do nothing
+    """
+    if min_bytes is None:
+        return obj
+    if isinstance(obj, np.ndarray):
+        if obj.nbytes < max(min_bytes, 1) or obj.dtype.hasobject:
+            return obj
+        from multiprocessing.shared_memory import SharedMemory
+
+        shm = SharedMemory(create=True, size=obj.nbytes)
+        shared = np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)
+        shared[...] = obj
+        del shared
+        shm.close()
+        return _SharedArray(shm.name, obj.shape, obj.dtype)
+    if isinstance(obj, NDict):
+        _to_shared_memory(obj.to_dict(), min_bytes)
+        return obj
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            obj[key] = _to_shared_memory(value, min_bytes)
+        return obj
+    if isinstance(obj, list):
+        for i, value in enumerate(obj):
+            obj[i] = _to_shared_memory(value, min_bytes)
+        return obj
+    if isinstance(obj, tuple) and type(obj) is tuple:
+        return tuple(_to_shared_memory(value, min_bytes) for value in obj)
+    return obj
+
+
+def _from_shared_memory(obj: Any) -> Any:
+    """
+    The inverse of _to_shared_memory(): copy the arrays out of the shared memory and release it
+    """
+    if isinstance(obj, _SharedArray):
+        from multiprocessing.shared_memory import SharedMemory
+
+        shm = SharedMemory(name=obj.name)
+        try:
+            array = np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+        return array
+    if isinstance(obj, NDict):
+        _from_shared_memory(obj.to_dict())
+        return obj
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            obj[key] = _from_shared_memory(value)
+        return obj
+    if isinstance(obj, list):
+        for i, value in enumerate(obj):
+            obj[i] = _from_shared_memory(value)
+        return obj
+    if isinstance(obj, tuple) and type(obj) is tuple:
+        return tuple(_from_shared_memory(value) for value in obj)
+    return obj
+
+
 def worker_func_wrapper(*args, worker_func, **kwargs):
     torch.set_num_threads(1)
     return worker_func(*args, **kwargs)
@@ -207,6 +458,250 @@ def get_from_global_storage(key: str) -> Any:
     return _multiprocess_global_storage[key]
 
 
+class PersistentPool:
+    """
+    A long lived pool of warm worker processes, reused by multiple run_multiprocessed() calls to avoid paying the startup of the workers
+    and the copy of copy_to_global_storage (often an entire dataset with its pipelines) in each call.
+    The global storage payloads are cached by key: a payload is pickled once to a temporary file, and each worker loads it once
+    and keeps it in memory for the following calls (up to max_cached_payloads).
+    Use get_persistent_pool() to get a shared instance, or run_multiprocessed(..., persistent_pool=True).
+
+    Example:
+        pool = get_persistent_pool(workers=8)
+        for fold in range(5):
+            ans = list(pool.imap(worker_func, args_list[fold], copy_to_global_storage={"dataset": dataset}, global_storage_key="dataset@v1"))
+    """
+
+    def __init__(self, workers: int, mp_context: Optional[str] = None, max_cached_payloads: int = 4):
+        """
+        :param workers: number of worker processes
+        :param mp_context: "fork", "spawn", "thread" or None for multiprocessing default
+        :param max_cached_payloads: the maximum number of global storage payloads kept by the pool and by each worker
+        """
+        self._workers = workers
+        self._mp_context = mp_context
+        self._max_cached_payloads = max_cached_payloads
+        self._is_thread_pool = mp_context == "thread"
+        # shared memory results (see shared_memory_results) require the workers to share the resource tracker of this process,
+        # started (and the workers restarted) on the first call that requests them
+        self._has_resource_tracker = False
+        self._running_calls = 0
+        self._pool = self._create_pool()
+        self._payloads_dir = tempfile.mkdtemp(prefix="fuse_mp_payloads_")
+        self._payload_files: "OrderedDict[str, str]" = OrderedDict()  # key -> filename
+        self._payload_users: Dict[str, int] = {}  # key -> number of running imap() calls
+        self._pid = os.getpid()
+        self._closed = False
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _create_pool(self) -> Any:
+        if self._is_thread_pool:
+            from multiprocessing.pool import ThreadPool
+
+            return ThreadPool(processes=self._workers, initializer=_init_persistent_worker)
+        context = mp if self._mp_context is None else mp.get_context(self._mp_context)
+        return context.Pool(processes=self._workers, initializer=_init_persistent_worker)
+
+    def imap(
+        self,
+        worker_func: Callable,
+        args_list: Sequence,
+        copy_to_global_storage: Optional[dict] = None,
+        global_storage_key: Optional[str] = None,
+        keep_results_order: bool = True,
+        chunksize: Union[int, str] = 1,
+        task_cost: Optional[Callable[[Any], float]] = None,
+        shared_memory_results: bool = False,
+    ) -> Iterator[Any]:
+        """
+        Run worker_func on each element of args_list, see run_multiprocessed() for the details of the arguments.
+        :param global_storage_key: identifies the content of copy_to_global_storage - calls with the same key ship it to the workers only once.
+            Use a new key whenever the content changes. None to ship it for this call only.
+        :return: an iterator over the results
+        """
+        if self._closed:
+            raise Exception("Error: the persistent pool is closed")
+
+        if self._is_thread_pool:
+            # the threads share the global storage of the main process
+            _store_in_global_storage(copy_to_global_storage)
+            try:
+                task_func = functools.partial(_run_chunk, worker_func=worker_func)
+                yield from _imap_chunks(
+                    self._pool, task_func, args_list, self._workers, chunksize, keep_results_order, task_cost
+                )
+            finally:
+                if copy_to_global_storage is not None:
+                    _remove_from_global_storage(list(copy_to_global_storage.keys()))
+            return
+
+        shared_memory_results = shared_memory_results and _SHARED_MEMORY_SUPPORTED
+        if shared_memory_results and not self._has_resource_tracker:
+            if self._running_calls == 0:
+                self._pool.terminate()
+                self._pool.join()
+                _ensure_resource_tracker()
+                self._pool = self._create_pool()
+                self._has_resource_tracker = True
+            else:
+                # can't restart the workers while they are in use by another call - the results are pickled as usual
+                shared_memory_results = False
+
+        payload_key, payload_filename, cache_payload = None, None, False
+        if copy_to_global_storage:
+            cache_payload = global_storage_key is not None
+            payload_key = global_storage_key if cache_payload else f"temporary@{uuid.uuid4().hex}"
+            payload_filename = self._acquire_payload(payload_key, copy_to_global_storage)
+        self._running_calls += 1
+        try:
+            task_func = functools.partial(
+                _run_persistent_chunk,
+                worker_func=worker_func,
+                payload_key=payload_key,
+                payload_filename=payload_filename,
+                cache_payload=cache_payload,
+                max_cached_payloads=self._max_cached_payloads,
+                shared_memory_min_bytes=SHARED_MEMORY_MIN_BYTES if shared_memory_results else None,
+            )
+            yield from _imap_chunks(
+                self._pool,
+                task_func,
+                args_list,
+                self._workers,
+                chunksize,
+                keep_results_order,
+                task_cost,
+                shared_memory_results,
+            )
+        finally:
+            self._running_calls -= 1
+            if payload_key is not None:
+                self._release_payload(payload_key, remove=not cache_payload)
+
+    def close(self) -> None:
+        """
+        Terminate the workers and delete the cached payloads
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._pid == os.getpid():
+            self._pool.terminate()
+            self._pool.join()
+            shutil.rmtree(self._payloads_dir, ignore_errors=True)
+
+    def _acquire_payload(self, key: str, payload: dict) -> str:
+        """
+        Pickle the payload to a file, unless it's already cached
+        :return: the filename
+        """
+        if key in self._payload_files:
+            self._payload_files.move_to_end(key)
+        else:
+            filename = os.path.join(self._payloads_dir, f"{uuid.uuid4().hex}.pkl")
+            with open(filename, "wb") as f:
+                pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self._payload_files[key] = filename
+        self._payload_users[key] = self._payload_users.get(key, 0) + 1
+
+        # evict the least recently used payloads which are not in use
+        for evicted_key in list(self._payload_files.keys()):
+            if len(self._payload_files) <= self._max_cached_payloads:
+                break
+            if self._payload_users.get(evicted_key, 0) == 0:
+                os.remove(self._payload_files.pop(evicted_key))
+
+        return self._payload_files[key]
+
+    def _release_payload(self, key: str, remove: bool) -> None:
+        self._payload_users[key] -= 1
+        if self._payload_users[key] == 0:
+            del self._payload_users[key]
+            if remove:
+                os.remove(self._payload_files.pop(key))
+
+
+# the persistent pools of this process: (workers, mp_context) -> PersistentPool
+_persistent_pools: Dict[Tuple[int, Optional[str]], PersistentPool] = {}
+
+# state of a persistent pool worker process
+_worker_payloads: "OrderedDict[str, dict]" = OrderedDict()  # cached payloads: key -> payload
+_worker_active_payload_key: Optional[str] = None  # the key of the payload currently in the global storage
+
+
+def get_persistent_pool(workers: int, mp_context: Optional[str] = None) -> PersistentPool:
+    """
+    Get a shared persistent pool (see PersistentPool), created on the first call. Closed automatically when the process exits.
+    :param workers: number of worker processes
+    :param mp_context: "fork", "spawn", "thread" or None for multiprocessing default
+    """
+    key = (workers, mp_context)
+    pool = _persistent_pools.get(key)
+    if pool is None or pool.closed or pool._pid != os.getpid():
+        # a process created by fork can't use the pools of its parent
+        pool = _persistent_pools[key] = PersistentPool(workers, mp_context)
+    return pool
+
+
+def shutdown_persistent_pools() -> None:
+    """
+    Close all the shared persistent pools of this process
+    """
+    for pool in _persistent_pools.values():
+        pool.close()
+    _persistent_pools.clear()
+
+
+atexit.register(shutdown_persistent_pools)
+
+
+def _init_persistent_worker() -> None:
+    global _worker_active_payload_key
+    torch.set_num_threads(1)
+    # a process created by fork inherits the global storage of the main process, it will be replaced by the payload of each task
+    _worker_payloads.clear()
+    _worker_active_payload_key = None
+
+
+def _run_persistent_chunk(
+    task: Tuple[int, List[Any]],
+    worker_func: Callable,
+    payload_key: Optional[str],
+    payload_filename: Optional[str],
+    cache_payload: bool,
+    max_cached_payloads: int,
+    shared_memory_min_bytes: Optional[int] = None,
+) -> Tuple[int, List[Any]]:
+    """
+    Run a chunk of tasks in a persistent pool worker, after making sure the global storage holds the required payload
+    """
+    global _worker_active_payload_key
+    if payload_key != _worker_active_payload_key:
+        payload = _worker_payloads.get(payload_key, None) if payload_key is not None else {}
+        if payload is None:
+            with open(payload_filename, "rb") as f:
+                payload = pickle.load(f)
+            if cache_payload:
+                _worker_payloads[payload_key] = payload
+                while len(_worker_payloads) > max_cached_payloads:
+                    _worker_payloads.popitem(last=False)
+        elif payload_key is not None:
+            _worker_payloads.move_to_end(payload_key)
+        _multiprocess_global_storage.clear()
+        _multiprocess_global_storage.update(payload)
+        _worker_active_payload_key = payload_key
+
+    chunk_index, chunk = task
+    return chunk_index, [_to_shared_memory(worker_func(args), shared_memory_min_bytes) for args in chunk]
+
+
 ctx = mp.get_context("spawn")
 
 
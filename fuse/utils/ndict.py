@@ -24,7 +24,7 @@ import copy
 import types
 import numpy
 import torch
-from typing import Any, Callable, Iterator, Optional, Sequence, Union, List, MutableMapping
+from typing import Any, Callable, Collection, Dict, Iterator, Optional, Sequence, Union, List, MutableMapping
 
 
 class NDict(dict):
@@ -57,14 +57,23 @@ class NDict(dict):
         :param already_flat: optimization option. set to True only if you are sure that the input "dict_like" is a dict without nested dictionaries.
         """
 
+        # prefix index of the keys, created on the first branch query (see _NDictIndex)
+        self._index = None
+
         if dict_like is None:
             self._stored = dict()
 
         elif isinstance(dict_like, NDict):
             self._stored = dict_like._stored
+            # a view shares the index as well
+            if dict_like._index is None:
+                dict_like._index = _NDictIndex()
+            self._index = dict_like._index
 
         elif isinstance(dict_like, dict) and already_flat:
             self._stored = dict_like
+            # the dict might be modified directly (for example, wrapped by another NDict)
+            self._index = _NDictIndex(exclusive=False)
 
         elif dict_like is not None:
             self._stored = dict()
@@ -79,7 +88,13 @@ class NDict(dict):
     def to_dict(self) -> dict:
         """
         converts to standard python dict
+        Note: it's the underlying storage - modifying it modifies the NDict.
         """
+        # keys might be added or removed directly from now on, so the prefix index can no longer be trusted
+        if self._index is None:
+            self._index = _NDictIndex(exclusive=False)
+        else:
+            self._index.disable()
         return self._stored
 
     def clone(self, deepcopy: bool = True) -> NDict:
@@ -90,9 +105,11 @@ class NDict(dict):
         :param deepcopy: if true, does deep copy, otherwise does a shallow copy
         """
         if not deepcopy:
-            return NDict(copy.copy(self._stored), already_flat=True)
+            ans = NDict(copy.copy(self._stored), already_flat=True)
         else:
-            return NDict(copy.deepcopy(self._stored), already_flat=True)
+            ans = NDict(copy.deepcopy(self._stored), already_flat=True)
+        ans._index = None  # a private copy
+        return ans
 
     def flatten(self) -> NDict:
         """
@@ -124,8 +141,10 @@ class NDict(dict):
             >>> ndict.top_level_keys()
             ['a1', 'a2']
         """
-        top_level_keys = {key.split(".")[0] for key in self.keys()}
-        return list(top_level_keys)
+        index = self._get_index()
+        if index is None:
+            return list(dict.fromkeys(key.split(".")[0] for key in self._stored))
+        return list(index.top_level_keys)
 
     def values(self) -> dict_items:
         return self._stored.values()
@@ -176,17 +195,15 @@ class NDict(dict):
             >>> ndict.get_sub_dict("a.b")
             {'c': 'x', 'd': 'y', 'e': 'z'}
         """
-        res = NDict()
-        prefix_key = key + "."
-        suffix_key = None
-        for kk in self.keys():
-            if kk.startswith(prefix_key):
-                suffix_key = kk[len(prefix_key) :]
-                res[suffix_key] = self[kk]
-
-        if suffix_key is None:
+        branch_keys = self._get_branch_keys(key)
+        if len(branch_keys) == 0:
             return None
 
+        res = NDict()
+        prefix_len = len(key) + 1
+        for kk in branch_keys:
+            res[kk[prefix_len:]] = self._stored[kk]
+
         return res
 
     def __setitem__(self, key: str, value: Any) -> None:
@@ -208,6 +225,9 @@ class NDict(dict):
             for sub_key in value:
                 self[f"{key}.{sub_key}"] = value[sub_key]
             return
+        index = self._index
+        if index is not None and index.built and key not in self._stored:
+            index.add(key)
         self._stored[key] = value
 
     def __delitem__(self, key: str) -> None:
@@ -221,13 +241,17 @@ class NDict(dict):
         # delete specific (key, value)
         if key in self._stored:
             del self._stored[key]
+            if self._index is not None and self._index.built:
+                self._index.remove(key)
             deleted = True
 
         # delete entire branch
-        for kk in list(self.keys()):
-            if kk.startswith(f"{key}."):
-                del self[kk]
-                deleted = True
+        index = self._get_index()
+        for kk in list(self._get_branch_keys(key)):
+            del self._stored[kk]
+            if index is not None:
+                index.remove(kk)
+            deleted = True
 
         if not deleted:
             raise NestedKeyError(key, self)
@@ -302,6 +326,14 @@ class NDict(dict):
     def __reduce__(self) -> Union[str, tuple]:
         return super().__reduce__()
 
+    def __getstate__(self) -> dict:
+        # the index is not pickled, it will be rebuilt on demand
+        return {"_stored": self._stored}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._index = None
+
     def __iter__(self) -> Iterator:
         return iter(self._stored)
 
@@ -319,14 +351,12 @@ class NDict(dict):
         if key in self._stored:
             return True
 
-        key_dot = key + "."
-        # iterate over all keys and looking for a match
-        for kk in self.keys():
-            if kk.startswith(key_dot):
-                return True
-
-        # a match wasn't found
-        return False
+        # a prefix of other keys
+        index = self._get_index()
+        if index is None:
+            key_dot = key + "."
+            return any(kk.startswith(key_dot) for kk in self._stored)
+        return key in index.branch_keys
 
     def get(self, key: str, default_value: Any = None) -> Any:
         if key not in self:
@@ -424,6 +454,29 @@ class NDict(dict):
                 else:
                     print("---" * level, key)
 
+    def _get_index(self) -> Optional[_NDictIndex]:
+        """
+        :return: the prefix index, built if needed. None if the stored dict might be modified directly (see _NDictIndex)
+        """
+        index = self._index
+        if index is None:
+            index = self._index = _NDictIndex()
+        if not index.exclusive:
+            return None
+        if not index.built:
+            index.build(self._stored)
+        return index
+
+    def _get_branch_keys(self, key: str) -> Collection[str]:
+        """
+        :return: the keys which start with key + "."
+        """
+        index = self._get_index()
+        if index is None:
+            key_dot = key + "."
+            return [kk for kk in self._stored if kk.startswith(key_dot)]
+        return index.branch_keys.get(key, ())
+
     def describe(self) -> None:
         for k in self.keys():
             print(f"{k}")
@@ -433,6 +486,78 @@ class NDict(dict):
                 print(f"\tshape={val.shape}")
 
 
+class _NDictIndex:
+    """
+    Prefix index of the keys of NDict - allows branch queries (membership of a prefix, sub dict, deletion of a branch, top level keys)
+    in O(depth + result) instead of scanning all of the keys.
+    Built on the first branch query, and from then on kept in sync by NDict on set and delete.
+    Used only as long as all of the changes to the keys are made through NDict (and its views, which share the index).
+    Once the stored dict might be modified directly - it was passed with already_flat=True or returned by to_dict() -
+    the index is disabled and the branch queries scan the keys.
+    """
+
+    def __init__(self, exclusive: bool = True) -> None:
+        """
+        :param exclusive: False if the stored dict might be modified directly, see disable()
+        """
+        self.exclusive = exclusive
+        self.built = False
+        # prefix -> the keys which start with prefix + "." (in insertion order, like the keys of NDict)
+        self.branch_keys: Dict[str, Dict[str, None]] = {}
+        # top level key -> the number of keys it's a prefix of (including itself)
+        self.top_level_keys: Dict[str, int] = {}
+
+    def disable(self) -> None:
+        """
+        The stored dict might be modified directly from now on - stop using the index
+        """
+        self.exclusive = False
+        self.built = False
+        self.branch_keys = {}
+        self.top_level_keys = {}
+
+    def build(self, stored: dict) -> None:
+        self.branch_keys = {}
+        self.top_level_keys = {}
+        for key in stored:
+            self.add(key)
+        self.built = True
+
+    def add(self, key: str) -> None:
+        """
+        Add a new key
+        """
+        pos = key.find(".")
+        top_level_key = key if pos < 0 else key[:pos]
+        self.top_level_keys[top_level_key] = self.top_level_keys.get(top_level_key, 0) + 1
+        while pos >= 0:
+            prefix = key[:pos]
+            keys = self.branch_keys.get(prefix, None)
+            if keys is None:
+                keys = self.branch_keys[prefix] = {}
+            keys[key] = None
+            pos = key.find(".", pos + 1)
+
+    def remove(self, key: str) -> None:
+        """
+        Remove an existing key
+        """
+        pos = key.find(".")
+        top_level_key = key if pos < 0 else key[:pos]
+        count = self.top_level_keys[top_level_key] - 1
+        if count == 0:
+            del self.top_level_keys[top_level_key]
+        else:
+            self.top_level_keys[top_level_key] = count
+        while pos >= 0:
+            prefix = key[:pos]
+            keys = self.branch_keys[prefix]
+            del keys[key]
+            if len(keys) == 0:
+                del self.branch_keys[prefix]
+            pos = key.find(".", pos + 1)
+
+
 class NestedKeyError(KeyError):
     def __init__(self, key: str, d: NDict) -> None:
         closest_keys = d.get_closest_keys(key, n=3)
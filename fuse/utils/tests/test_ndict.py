@@ -17,6 +17,7 @@ Created on June 30, 2021
 
 """
 
+import pickle
 import unittest
 
 
@@ -238,6 +239,68 @@ class TestNDict(unittest.TestCase):
         self.assertDictEqual(ndict.unflatten()["a"]["b"], {"c": 42, "d": 23})
         self.assertDictEqual(ndict["a"].unflatten()["b"], {"c": 42, "d": 23})
 
+    def test_prefix_index(self) -> None:
+        ndict = NDict()
+        ndict["data.input.a"] = 1
+        ndict["data.input.b.c"] = 2
+        ndict["data.label"] = 3
+        ndict["meta"] = 4
+        view = NDict(ndict)
+
+        self.assertTrue("data.input" in ndict)
+        self.assertTrue("data.input.b" in ndict)
+        self.assertFalse("data.inp" in ndict)
+        self.assertEqual(list(ndict.get_sub_dict("data").keys()), ["input.a", "input.b.c", "label"])
+        self.assertEqual(ndict.top_level_keys(), ["data", "meta"])
+
+        # the index is kept in sync on set and delete (including through a view)
+        del view["data.input"]
+        self.assertFalse("data.input" in ndict)
+        self.assertIsNone(ndict.get_sub_dict("data.input"))
+        self.assertEqual(ndict.keypaths(), ["data.label", "meta"])
+        del ndict["data.label"]
+        self.assertFalse("data" in view)
+        self.assertEqual(view.top_level_keys(), ["meta"])
+        view["data.x.y"] = 5
+        self.assertDictEqual(ndict["data"].to_dict(), {"x.y": 5})
+
+        # flat dicts, copies and pickled NDicts build the index on demand
+        for other in [
+            NDict({"a.b": 1, "a.c": 2, "d": 3}, already_flat=True),
+            NDict({"a.b": 1, "a.c": 2, "d": 3}).clone(),
+            pickle.loads(pickle.dumps(NDict({"a.b": 1, "a.c": 2, "d": 3}))),
+        ]:
+            self.assertTrue("a" in other)
+            self.assertDictEqual(other["a"].to_dict(), {"b": 1, "c": 2})
+            del other["a"]
+            self.assertEqual(other.keypaths(), ["d"])
+
+        # keys added directly to the underlying dict
+        ndict.to_dict()["z.w"] = 6
+        self.assertTrue("z" in ndict)
+
+        # keys added and removed directly, without changing the number of keys
+        ndict = NDict({"a.b": 1, "x": 2})
+        self.assertTrue("a" in ndict)
+        d = ndict.to_dict()
+        del d["a.b"]
+        d["c.d"] = 3
+        self.assertTrue("c" in ndict)
+        self.assertFalse("a" in ndict)
+        self.assertDictEqual(ndict.get_sub_dict("c").to_dict(), {"d": 3})
+        self.assertRaises(KeyError, ndict.__getitem__, "a")
+        self.assertEqual(ndict.top_level_keys(), ["x", "c"])
+
+        # wrappers of the same flat dict
+        shared = {"a.b": 1, "x": 2}
+        first, second = NDict(shared, already_flat=True), NDict(shared, already_flat=True)
+        self.assertTrue("a" in first)
+        del second["a"]
+        second["c.d"] = 3
+        self.assertFalse("a" in first)
+        self.assertTrue("c" in first)
+        self.assertIsNone(first.get_sub_dict("a"))
+
     def tearDown(self) -> None:
         delattr(self, "nested_dict")
 
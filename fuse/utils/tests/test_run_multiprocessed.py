@@ -0,0 +1,237 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import importlib
+import os
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from fuse.utils.multiprocessing import (
+    PersistentPool,
+    get_from_global_storage,
+    get_persistent_pool,
+    run_multiprocessed,
+    shutdown_persistent_pools,
+)
+from fuse.utils.multiprocessing.run_multiprocessed import SHARED_MEMORY_MIN_BYTES, _get_chunks
+from fuse.utils.ndict import NDict
+
+# the module (the package exports a function with the same name)
+run_multiprocessed_module = importlib.import_module("fuse.utils.multiprocessing.run_multiprocessed")
+
+
+class CountPickles:
+    """
+    Counts the number of times it was pickled in the main process
+    """
+
+    num_pickles = 0
+
+    def __init__(self, value: int):
+        self.value = value
+
+    def __getstate__(self) -> dict:
+        CountPickles.num_pickles += 1
+        return self.__dict__
+
+
+def add_value(x: int) -> int:
+    return x + get_from_global_storage("payload").value
+
+
+def get_pid(x: int) -> int:
+    return os.getpid()
+
+
+def sleep_uneven(x: int) -> int:
+    time.sleep(0.05 if x % 10 == 0 else 0.001)
+    return x
+
+
+def create_sample(x: int) -> NDict:
+    sample = NDict()
+    sample["data.img"] = np.full((SHARED_MEMORY_MIN_BYTES // 8 + 1,), x, dtype=np.float64)
+    sample["data.small"] = np.full((3,), x)
+    sample["data.items"] = [np.full((SHARED_MEMORY_MIN_BYTES,), x, dtype=np.uint8), (x, "a")]
+    return sample
+
+
+def sleep_and_log_start(x: int) -> tuple:
+    start = time.monotonic()
+    time.sleep(x / 100.0)
+    return x, start
+
+
+class TestRunMultiprocessed(unittest.TestCase):
+    def test_chunks(self):
+        self.assertEqual(_get_chunks(5, 2, 2), [(0, 2), (2, 4), (4, 5)])
+        chunks = _get_chunks(1000, 4, "guided")
+        sizes = [end - start for start, end in chunks]
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], 1000)
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertEqual(sizes[-1], 1)
+        with self.assertRaises(Exception):
+            _get_chunks(10, 2, 0)
+
+    def test_chunksize(self):
+        args_list = list(range(100))
+        for chunksize in [1, 7, "guided"]:
+            ans = run_multiprocessed(sleep_uneven, args_list, workers=3, chunksize=chunksize)
+            self.assertEqual(ans, args_list)
+            ans = run_multiprocessed(sleep_uneven, args_list, workers=3, chunksize=chunksize, keep_results_order=False)
+            self.assertEqual(sorted(ans), args_list)
+
+    def test_shared_memory_results(self):
+        for persistent_pool in [False, True]:
+            ans = run_multiprocessed(
+                create_sample, [1, 2, 3], workers=2, shared_memory_results=True, persistent_pool=persistent_pool
+            )
+            for x, sample in zip([1, 2, 3], ans):
+                self.assertIsInstance(sample, NDict)
+                self.assertIsInstance(sample["data.img"], np.ndarray)
+                self.assertTrue(np.all(sample["data.img"] == x))
+                self.assertTrue(np.all(sample["data.small"] == x))
+                self.assertTrue(np.all(sample["data.items"][0] == x))
+                self.assertEqual(sample["data.items"][1], (x, "a"))
+
+    def test_shared_memory_results_not_supported(self):
+        # python 3.7 - the results are pickled as usual
+        with mock.patch.object(run_multiprocessed_module, "_SHARED_MEMORY_SUPPORTED", False), mock.patch.object(
+            run_multiprocessed_module, "_from_shared_memory"
+        ) as from_shared_memory:
+            for persistent_pool in [False, True]:
+                ans = run_multiprocessed(
+                    create_sample, [1, 2], workers=2, shared_memory_results=True, persistent_pool=persistent_pool
+                )
+                self.assertTrue(all(np.all(sample["data.img"] == x) for x, sample in zip([1, 2], ans)))
+        from_shared_memory.assert_not_called()
+
+    def test_task_cost(self):
+        args_list = [1, 2, 3, 4, 50, 5]
+        for chunksize in [1, "guided"]:
+            ans = run_multiprocessed(
+                sleep_and_log_start, args_list, workers=2, task_cost=lambda x: x, chunksize=chunksize
+            )
+            # the order of the results is kept
+            self.assertEqual([x for x, _ in ans], args_list)
+            # the most expensive task is dispatched first (along with the second one), before the cheapest tasks
+            start_times = dict(ans)
+            self.assertLess(start_times[50], min(start_times[1], start_times[2], start_times[3]))
+
+        ans = run_multiprocessed(
+            sleep_and_log_start, args_list, workers=2, task_cost=lambda x: x, keep_results_order=False
+        )
+        self.assertEqual(sorted(x for x, _ in ans), sorted(args_list))
+
+        chunks = _get_chunks(6, 1, "guided", costs=[16, 1, 1, 1, 1, 1])
+        self.assertEqual(chunks[0], (0, 1))
+
+    def test_persistent_pool(self):
+        CountPickles.num_pickles = 0
+        args_list = list(range(20))
+        payload = {"payload": CountPickles(100)}
+        for _ in range(3):
+            ans = run_multiprocessed(
+                add_value,
+                args_list,
+                workers=2,
+                copy_to_global_storage=payload,
+                persistent_pool=True,
+                global_storage_key="payload@100",
+                chunksize="guided",
+            )
+            self.assertEqual(ans, [x + 100 for x in args_list])
+        # shipped once
+        self.assertEqual(CountPickles.num_pickles, 1)
+
+        # a different payload with the same name
+        ans = run_multiprocessed(
+            add_value,
+            args_list,
+            workers=2,
+            copy_to_global_storage={"payload": CountPickles(200)},
+            persistent_pool=True,
+            global_storage_key="payload@200",
+        )
+        self.assertEqual(ans, [x + 200 for x in args_list])
+        # no key - shipped for this call only
+        ans = run_multiprocessed(
+            add_value, args_list, workers=2, copy_to_global_storage={"payload": CountPickles(300)}, persistent_pool=True
+        )
+        self.assertEqual(ans, [x + 300 for x in args_list])
+        self.assertEqual(CountPickles.num_pickles, 3)
+
+        # warm workers
+        pool = get_persistent_pool(2)
+        pids = set(run_multiprocessed(get_pid, list(range(20)), workers=2, persistent_pool=True))
+        pids2 = set(run_multiprocessed(get_pid, list(range(20)), workers=2, persistent_pool=True))
+        worker_pids = {process.pid for process in pool._pool._pool}
+        self.assertTrue(pids.issubset(worker_pids))
+        self.assertTrue(pids2.issubset(worker_pids))
+        self.assertIs(get_persistent_pool(2), pool)
+
+        shutdown_persistent_pools()
+        self.assertTrue(pool.closed)
+        self.assertIsNot(get_persistent_pool(2), pool)
+
+    def test_persistent_pool_resource_tracker(self):
+        # the resource tracker is started, and the workers are restarted, only when shared memory results are requested
+        with mock.patch.object(
+            run_multiprocessed_module,
+            "_ensure_resource_tracker",
+            wraps=run_multiprocessed_module._ensure_resource_tracker,
+        ) as ensure_resource_tracker:
+            pool = PersistentPool(workers=2)
+            try:
+                pids = set(pool.imap(get_pid, list(range(10))))
+                ensure_resource_tracker.assert_not_called()
+                for _ in range(2):
+                    ans = list(pool.imap(create_sample, [1, 2], shared_memory_results=True))
+                    self.assertTrue(all(np.all(sample["data.img"] == x) for x, sample in zip([1, 2], ans)))
+                ensure_resource_tracker.assert_called_once()
+                self.assertTrue(pids.isdisjoint(process.pid for process in pool._pool._pool))
+            finally:
+                pool.close()
+
+    def test_persistent_pool_payload_cache(self):
+        pool = PersistentPool(workers=2, max_cached_payloads=2)
+        try:
+            for value in [1, 2, 3, 1]:
+                ans = list(
+                    pool.imap(
+                        add_value,
+                        [0, 1, 2],
+                        copy_to_global_storage={"payload": CountPickles(value)},
+                        global_storage_key=f"payload@{value}",
+                    )
+                )
+                self.assertEqual(ans, [value, value + 1, value + 2])
+            self.assertEqual(len(pool._payload_files), 2)
+        finally:
+            pool.close()
+        self.assertFalse(os.path.exists(pool._payloads_dir))
+
+    def tearDown(self):
+        shutdown_persistent_pools()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
-from typing import List, Optional
-from fuse.data.ops.op_base import OpBase
+from typing import Any, List, Optional
+import numpy as np
+from fuse.data.ops.op_base import OpBase, get_batch_kwarg, get_batch_param
 from fuse.utils.ndict import NDict
 from fuse.utils.rand.param_sampler import Gaussian
 from fuse.data.ops.ops_cast import Cast
@@ -70,6 +71,61 @@ class OpAugColor(OpBase):
         sample_dict[key] = aug_tensor
         return sample_dict
 
+    def supports_batch(self) -> bool:
+        return True
+
+    def call_batch(self, batch_dict: NDict, op_id: Optional[str], per_sample_kwargs: List[dict]) -> NDict:
+        """
+        See super class
+        The parameters might be different per sample, contrast is calculated separately per sample.
+        """
+        key = get_batch_kwarg(per_sample_kwargs, "key")
+        channels = get_batch_kwarg(per_sample_kwargs, "channels")
+        aug_input = batch_dict[key]
+
+        # verify
+        if self._verify_arguments:
+            assert isinstance(aug_input, torch.Tensor), f"Error: OpAugColor expects torch Tensor, got {type(aug_input)}"
+            assert (
+                aug_input.min() >= 0.0 and aug_input.max() <= 1.0
+            ), f"Error: OpAugColor expects tensor in range [0.0-1.0]. got [{aug_input.min()}-{aug_input.max()}]"
+
+        aug_tensor = aug_input if channels is None else aug_input[:, channels]
+        add = self._get_batch_param(per_sample_kwargs, "add", 0.0, aug_tensor)
+        mul = self._get_batch_param(per_sample_kwargs, "mul", 1.0, aug_tensor)
+        gamma = self._get_batch_param(per_sample_kwargs, "gamma", 1.0, aug_tensor)
+        contrast = self._get_batch_param(per_sample_kwargs, "contrast", 1.0, aug_tensor)
+
+        if add is not None:
+            aug_tensor = self.aug_op_add_col(aug_tensor, add)
+        if mul is not None:
+            aug_tensor = self.aug_op_mul_col(aug_tensor, mul)
+        if gamma is not None:
+            aug_tensor = self.aug_op_gamma(aug_tensor, 1.0, gamma)
+        if contrast is not None:
+            calculated_mean = aug_tensor.mean(dim=tuple(range(1, aug_tensor.dim())), keepdim=True)
+            aug_tensor = ((aug_tensor - calculated_mean) * contrast) + calculated_mean
+            aug_tensor = OpClip.clip(aug_tensor, clip=(0.0, 1.0))
+
+        if channels is None:
+            batch_dict[key] = aug_tensor
+        else:
+            aug_input[:, channels] = aug_tensor
+            batch_dict[key] = aug_input
+        return batch_dict
+
+    @staticmethod
+    def _get_batch_param(per_sample_kwargs: List[dict], name: str, neutral_value: float, like: Tensor) -> Any:
+        """
+        Per sample values of a parameter, None if not specified for any of the samples.
+        Samples for which the parameter is not specified get the neutral value
+        """
+        values = [kwargs.get(name) for kwargs in per_sample_kwargs]
+        if all(value is None for value in values):
+            return None
+        values = [{name: value if value is not None else neutral_value} for value in values]
+        return get_batch_param(values, name, like)
+
     @staticmethod
     def aug_op_add_col(aug_input: Tensor, add: float) -> Tensor:
         """
@@ -150,3 +206,29 @@ class OpAugGaussian(OpBase):
 
         sample_dict[key] = aug_tensor
         return sample_dict
+
+    def supports_batch(self) -> bool:
+        return True
+
+    def call_batch(self, batch_dict: NDict, op_id: Optional[str], per_sample_kwargs: List[dict]) -> NDict:
+        """
+        See super class
+        """
+        key = get_batch_kwarg(per_sample_kwargs, "key")
+        channels = get_batch_kwarg(per_sample_kwargs, "channels")
+        aug_input = batch_dict[key]
+        if not isinstance(aug_input, torch.Tensor):
+            raise Exception(f"Error: expecting a collated tensor in batch mode, got {type(aug_input)}")
+
+        aug_tensor = aug_input if channels is None else aug_input[:, channels]
+        mean = get_batch_param(per_sample_kwargs, "mean", aug_tensor, default=0.0)
+        std = get_batch_param(per_sample_kwargs, "std", aug_tensor, default=0.03)
+        rand_patch = Cast.like(np.random.randn(*aug_tensor.shape), aug_tensor)
+        aug_tensor = aug_tensor + rand_patch * std + mean
+
+        if channels is None:
+            batch_dict[key] = aug_tensor
+        else:
+            aug_input[:, channels] = aug_tensor
+            batch_dict[key] = aug_input
+        return batch_dict
@@ -1,9 +1,9 @@
-from typing import Tuple, Union
+from typing import List, Optional, Tuple, Union
 import numpy as np
 import torch
 from fuse.utils.ndict import NDict
 
-from fuse.data.ops.op_base import OpBase
+from fuse.data.ops.op_base import OpBase, get_batch_kwarg, get_batch_param
 
 from fuseimg.utils.typing.key_types_imaging import DataTypeImaging
 from fuseimg.data.ops.ops_common_imaging import OpApplyTypesImaging
@@ -36,6 +36,26 @@ class OpClip(OpBase):
         sample_dict[key] = processed_img
         return sample_dict
 
+    def supports_batch(self) -> bool:
+        return True
+
+    def call_batch(self, batch_dict: NDict, op_id: Optional[str], per_sample_kwargs: List[dict]) -> NDict:
+        """
+        See super class
+        """
+        key = get_batch_kwarg(per_sample_kwargs, "key")
+        img = batch_dict[key]
+        if not isinstance(img, torch.Tensor):
+            raise Exception(f"Error: expecting a collated tensor in batch mode, got {type(img)}")
+        lower = get_batch_param(per_sample_kwargs, "clip", img, default=(0.0, 1.0), index=0)
+        upper = get_batch_param(per_sample_kwargs, "clip", img, default=(0.0, 1.0), index=1)
+
+        if isinstance(lower, torch.Tensor) or isinstance(upper, torch.Tensor):
+            batch_dict[key] = torch.clamp(img, lower, upper)
+        else:
+            batch_dict[key] = self.clip(img, (lower, upper))
+        return batch_dict
+
     @staticmethod
     def clip(
         img: Union[np.ndarray, torch.Tensor], clip: Tuple[float, float] = (0.0, 1.0)
@@ -130,5 +150,29 @@ class OpToRange(OpBase):
 
         return sample_dict
 
+    def supports_batch(self) -> bool:
+        return True
+
+    def call_batch(self, batch_dict: NDict, op_id: Optional[str], per_sample_kwargs: List[dict]) -> NDict:
+        """
+        See super class
+        """
+        key = get_batch_kwarg(per_sample_kwargs, "key")
+        img = batch_dict[key]
+        if not isinstance(img, torch.Tensor):
+            raise Exception(f"Error: expecting a collated tensor in batch mode, got {type(img)}")
+        from_range_start = get_batch_param(per_sample_kwargs, "from_range", img, index=0)
+        from_range_end = get_batch_param(per_sample_kwargs, "from_range", img, index=1)
+        to_range_start = get_batch_param(per_sample_kwargs, "to_range", img, index=0)
+        to_range_end = get_batch_param(per_sample_kwargs, "to_range", img, index=1)
+
+        img -= from_range_start
+        img *= (to_range_end - to_range_start) / (from_range_end - from_range_start)
+        img += to_range_start
+
+        batch_dict[key] = img
+
+        return batch_dict
+
 
 op_to_range_img = OpApplyTypesImaging({DataTypeImaging.IMAGE: (OpToRange(), {})})
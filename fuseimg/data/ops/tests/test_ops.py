@@ -2,6 +2,7 @@ import unittest
 
 from fuse.data.pipelines.pipeline_default import PipelineDefault
 from fuseimg.data.ops.color import OpClip, OpToRange
+from fuseimg.data.ops.aug.color import OpAugColor
 from fuseimg.data.ops.shape_ops import OpPad
 
 from fuse.utils.ndict import NDict
@@ -64,6 +65,38 @@ class TestOps(unittest.TestCase):
         self.assertTrue(np.array_equal(sample["data.input.tensor_img_2"], res_2))
         self.assertTrue(np.array_equal(sample["data.input.numpy_img_2"], res_2))
 
+    def test_batch_mode(self):
+        """
+        Test that applying the ops on a batch is equivalent to applying them per sample
+        """
+        imgs = torch.rand(4, 2, 8, 8)
+        per_sample_kwargs = {
+            OpClip(): [dict(key="data.img", clip=(0.1 * i, 0.9 - 0.1 * i)) for i in range(4)],
+            OpToRange(): [dict(key="data.img", from_range=(0.0, 1.0), to_range=(-i, i + 1.0)) for i in range(4)],
+            OpAugColor(): [
+                dict(key="data.img", add=0.1 * i, mul=None if i == 0 else 0.9, gamma=1.2, contrast=0.8 + 0.1 * i)
+                for i in range(4)
+            ],
+        }
+
+        for op, kwargs_list in per_sample_kwargs.items():
+            self.assertTrue(op.supports_batch())
+            expected = []
+            for i, kwargs in enumerate(kwargs_list):
+                sample = NDict({"data.img": imgs[i].clone()})
+                expected.append(op(sample, **kwargs)["data.img"])
+
+            batch_dict = NDict({"data.img": imgs.clone()})
+            batch_dict = op.call_batch(batch_dict, None, kwargs_list)
+            self.assertTrue(torch.allclose(batch_dict["data.img"], torch.stack(expected), atol=1e-6), type(op).__name__)
+
+        # same parameters for all of the samples
+        op = OpAugColor()
+        kwargs_list = [dict(key="data.img", add=0.1, channels=[1])] * 4
+        batch_dict = op.call_batch(NDict({"data.img": imgs.clone()}), None, kwargs_list)
+        self.assertTrue(torch.equal(batch_dict["data.img"][:, 0], imgs[:, 0]))
+        self.assertTrue(torch.allclose(batch_dict["data.img"][:, 1], torch.clamp(imgs[:, 1] + 0.1, 0.0, 1.0)))
+
     def test_op_resize_to(self):
         pass
 